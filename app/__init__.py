@@ -28,22 +28,30 @@ def create_app(config_name='development'):
     # Initialize database
     from app.utils.db import init_db, init_app as init_db_app
     with app.app_context():
-        logger.info("Initializing database")
-        init_db()
-    init_db_app(app)  # Register database teardown
-
-    # Initialize OpenAI client
-    try:
-        logger.info("Loading OpenAI client")
-        from load_client import load_client, isClientLoaded
-        if not isClientLoaded():
-            client = load_client()
-            logger.info(f"OpenAI client loaded: {client is not None}")
+        if init_db():
+            logger.info("Initialized database schema")
         else:
-            logger.info("OpenAI client already loaded")
-    except Exception as e:
-        logger.error(f"Error loading OpenAI client: {str(e)}", exc_info=True)
-        logger.warning("Application will continue, but chat functionality may not work properly")
+            logger.info("Database schema is current")
+    init_db_app(app)  # Register database teardown
+    from app.utils.compression import init_app as init_compression_app
+    init_compression_app(app)  # Register compression CLI commands
+    from app.utils.archive import init_app as init_archive_app
+    init_archive_app(app)  # Register archival CLI command
+    from app.services.jobs import init_app as init_jobs_app
+    init_jobs_app(app)  # Background job workers
+    from app.services import message_jobs  # noqa: F401  Job handlers, without importing the chat stack
+    from app.services.conversation_purger import init_app as init_purger_app
+    init_purger_app(app)  # Register purge CLI command
+    from app.utils.assets import init_app as init_assets_app
+    init_assets_app(app)  # Fingerprinted static assets + `flask build-assets`
+
+    # The OpenAI client is created on first use in each process (after gunicorn forks its
+    # workers, so no connection pool is shared). The agents/openai stack is imported lazily
+    # too, unless PRELOAD_CHAT_STACK asks for it up front (e.g. with `gunicorn --preload`,
+    # where the master imports it once and workers share the pages).
+    if app.config.get('PRELOAD_CHAT_STACK'):
+        logger.info("Preloading chat stack")
+        from app.services import chat_service  # noqa: F401
 
     # Configure JWT error handling
     @jwt.unauthorized_loader
@@ -64,11 +72,18 @@ def create_app(config_name='development'):
     from app.routes.user_routes import user_bp
     from app.routes.api_routes import api_bp
     from app.routes.model_routes import model_bp
+    from app.routes.admin_routes import admin_bp
+    from app.routes.health_routes import health_bp
 
     app.register_blueprint(chat_bp, url_prefix='/api/chat')
     app.register_blueprint(user_bp, url_prefix='/api/users')
     app.register_blueprint(api_bp, url_prefix='/api')
     app.register_blueprint(model_bp, url_prefix='/api')
+    app.register_blueprint(admin_bp)  # Routes carry their own /admin and /api/admin prefixes
+    app.register_blueprint(health_bp)  # /health (liveness), /health/ready (readiness)
+    if app.config.get('WS_ENABLED', True):
+        from app.routes.ws_routes import init_app as init_ws_app
+        init_ws_app(app)  # /api/chat/ws, if flask-sock is installed
 
     # Serve frontend at root route
     @app.route('/')
@@ -84,11 +99,6 @@ def create_app(config_name='development'):
     def register():
         return render_template('register.html')
 
-    # Health check endpoint
-    @app.route('/health')
-    def health_check():
-        return {"status": "healthy"}, 200
-
     # Error handlers
     @app.errorhandler(404)
     def not_found(e):
@@ -2,6 +2,9 @@
 """
 Configuration file for AI models and their instructions.
 Each model has a specific set of instructions to guide its behavior.
+Models whose provider accepts a `prompt_cache_key` (a routing hint that sends
+the turns of one conversation to the same prompt cache) set "prompt_cache_key": True;
+other providers may reject unknown request fields, so it is off by default.
 """
 
 MODELS = {
@@ -12,7 +15,8 @@ MODELS = {
         When you don't know something, admit it instead of making up information.
         You can use the shell tool for computations, data processing, or retrieving information
         when appropriate.
-        **Format all your responses using Markdown.**"""
+        **Format all your responses using Markdown.**""",
+        "prompt_cache_key": True
     },
     "deepseek/deepseek-v3-base:free": {
         "display_name": "DeepSeek v3",
@@ -55,6 +59,7 @@ MODELS = {
 
 
 DEFAULT_MODEL = "openai/gpt-4o-mini"
+TITLE_MODEL = "openai/gpt-4o-mini"  # Cheap model used for automatic conversation titles
 
 def get_model_config(model_name):
     """Get configuration for a specified model."""
@@ -62,6 +67,10 @@ def get_model_config(model_name):
         model_name = DEFAULT_MODEL
     return MODELS[model_name]
 
+def supports_prompt_cache_key(model_name):
+    """True if requests to this model may carry a prompt_cache_key."""
+    return MODELS.get(model_name, {}).get("prompt_cache_key", False)
+
 def get_available_models():
     """Get a list of all available models with their display names."""
     return [(key, model["display_name"]) for key, model in MODELS.items()]
@@ -1,14 +1,18 @@
 # app/models/conversation.py
+from app.utils.compression import row_content
 from app.utils.db import get_db
 
 class Conversation:
-    def __init__(self, id=None, user_id=None, title=None, created_at=None, updated_at=None, messages=None):
+    def __init__(self, id=None, user_id=None, title=None, created_at=None, updated_at=None, messages=None,
+                 archived_at=None, active_message_id=None):
         self.id = id
         self.user_id = user_id
         self.title = title
         self.created_at = created_at
         self.updated_at = updated_at
         self.messages = messages or []
+        self.archived_at = archived_at
+        self.active_message_id = active_message_id  # Leaf of the branch in `messages`
         
     @staticmethod
     def create(user_id, title="New Conversation"):
@@ -21,17 +25,30 @@ class Conversation:
         return Conversation.get_by_id(cursor.lastrowid)
     
     @staticmethod
-    def get_by_id(conversation_id):
+    def get_by_id(conversation_id, leaf_id='active', siblings=False):
+        """
+        The conversation with the messages of one branch: the active one, or the
+        branch ending at `leaf_id`. With `siblings`, messages carry the ids of their
+        other versions.
+        """
         db = get_db()
         conversation = db.execute(
-            'SELECT * FROM conversations WHERE id = ?', (conversation_id,)
+            'SELECT * FROM conversations WHERE id = ? AND deleted_at IS NULL', (conversation_id,)
         ).fetchone()
         
         if not conversation:
             return None
+        
+        # Bring archived (cold) conversations back into the hot tables on access
+        if conversation['archived_at']:
+            from app.utils.archive import restore_conversation
+            restore_conversation(conversation_id)
+            conversation = db.execute('SELECT * FROM conversations WHERE id = ?', (conversation_id,)).fetchone()
             
         from app.models.message import Message
-        messages = Message.get_by_conversation_id(conversation_id)
+        messages = Message.get_branch(conversation_id, conversation['active_message_id'] if leaf_id == Message.ACTIVE else leaf_id)
+        if siblings:
+            Message.load_siblings(conversation_id, messages)
         
         return Conversation(
             id=conversation['id'],
@@ -39,33 +56,130 @@ class Conversation:
             title=conversation['title'],
             created_at=conversation['created_at'],
             updated_at=conversation['updated_at'],
-            messages=messages
+            messages=messages,
+            active_message_id=conversation['active_message_id']
         )
     
     @staticmethod
-    def get_by_user_id(user_id):
+    def get_owner_id(conversation_id):
+        """Return the owning user's id, or None if the conversation doesn't exist (no messages loaded)."""
+        db = get_db()
+        row = db.execute(
+            'SELECT user_id FROM conversations WHERE id = ? AND deleted_at IS NULL', (conversation_id,)
+        ).fetchone()
+        return row['user_id'] if row else None
+    
+    @staticmethod
+    def fingerprint(conversation_id):
+        """
+        (owner_id, fingerprint) of a conversation without loading its messages, or
+        None if it doesn't exist. The fingerprint changes whenever the conversation
+        as returned by `to_dict` may have changed.
+        """
+        db = get_db()
+        row = db.execute(
+            'SELECT user_id, title, updated_at, archived_at, active_message_id, '
+            '(SELECT MAX(id) FROM messages WHERE conversation_id = conversations.id) AS last_message_id '
+            'FROM conversations WHERE id = ? AND deleted_at IS NULL', (conversation_id,)
+        ).fetchone()
+        if not row:
+            return None
+        # The active leaf changes on branch switches; the newest id when a sibling of a shown message is added
+        return row['user_id'], [row['title'], row['updated_at'], row['archived_at'], row['active_message_id'],
+                                row['last_message_id']]
+
+    @staticmethod
+    def list_fingerprint(user_id):
+        """Fingerprint of the user's conversation list (see `fingerprint`), from index lookups only."""
         db = get_db()
-        conversations = db.execute(
-            'SELECT * FROM conversations WHERE user_id = ? ORDER BY updated_at DESC', 
+        rows = db.execute(
+            'SELECT id, title, updated_at, archived_at, active_message_id, '
+            '(SELECT MAX(id) FROM messages WHERE conversation_id = conversations.id) AS last_message_id '
+            'FROM conversations WHERE user_id = ? AND deleted_at IS NULL ORDER BY id',
             (user_id,)
         ).fetchall()
-        
+        # updated_at has one-second resolution; titles and message ids catch changes within a second
+        return [[row['id'], row['title'], row['updated_at'], row['archived_at'], row['active_message_id'],
+                 row['last_message_id']] for row in rows]
+
+    @staticmethod
+    def get_by_user_id(user_id):
+        """
+        The user's conversations (the rows `list_fingerprint` covers), newest
+        first, each with its active branch, in one query.
+        """
+        from app.models.message import Message
+        db = get_db()
+        # Archived conversations are listed without messages; opening one restores it
+        rows = db.execute(
+            'WITH RECURSIVE branch(conversation_id, id, parent_id) AS ('
+            ' SELECT conversations.id, messages.id, messages.parent_id FROM conversations'
+            ' JOIN messages ON messages.id = conversations.active_message_id'
+            ' AND messages.conversation_id = conversations.id'
+            ' WHERE conversations.user_id = ? AND conversations.deleted_at IS NULL AND conversations.archived_at IS NULL'
+            ' UNION ALL'
+            ' SELECT branch.conversation_id, messages.id, messages.parent_id FROM messages'
+            ' JOIN branch ON messages.id = branch.parent_id'
+            ') '
+            'SELECT conversations.*, messages.id AS message_id, messages.role, messages.content, messages.content_blob, '
+            'messages.content_encoding, messages.created_at AS message_created_at, messages.parent_id '
+            'FROM conversations LEFT JOIN branch ON branch.conversation_id = conversations.id '
+            'LEFT JOIN messages ON messages.id = branch.id '
+            'WHERE conversations.user_id = ? AND conversations.deleted_at IS NULL '
+            'ORDER BY conversations.updated_at DESC, conversations.id DESC, messages.id',
+            (user_id, user_id)
+        ).fetchall()
+
         result = []
-        for conv in conversations:
-            from app.models.message import Message
-            messages = Message.get_by_conversation_id(conv['id'])
-            
-            result.append(Conversation(
-                id=conv['id'],
-                user_id=conv['user_id'],
-                title=conv['title'],
-                created_at=conv['created_at'],
-                updated_at=conv['updated_at'],
-                messages=messages
-            ))
-        
+        for row in rows:
+            if not result or result[-1].id != row['id']:
+                result.append(Conversation(
+                    id=row['id'],
+                    user_id=row['user_id'],
+                    title=row['title'],
+                    created_at=row['created_at'],
+                    updated_at=row['updated_at'],
+                    archived_at=row['archived_at'],
+                    active_message_id=row['active_message_id']
+                ))
+            if row['message_id'] is not None:
+                result[-1].messages.append(Message(
+                    id=row['message_id'],
+                    conversation_id=row['id'],
+                    role=row['role'],
+                    content=row_content(row),
+                    created_at=row['message_created_at'],
+                    parent_id=row['parent_id']
+                ))
         return result
     
+    @staticmethod
+    def find_message(conversation_id, message_id):
+        """The message if it belongs to the conversation, else None. An archived conversation is restored first."""
+        from app.models.message import Message
+        if not isinstance(message_id, int) or isinstance(message_id, bool):
+            return None
+        message = Message.get_by_id(message_id)
+        if message is None and Conversation.get_by_id(conversation_id):  # Restores it if archived
+            message = Message.get_by_id(message_id)
+        return message if message and message.conversation_id == conversation_id else None
+
+    @staticmethod
+    def set_active_branch(conversation_id, message_id):
+        """
+        Show the branch through `message_id`, down to its newest leaf. Returns the
+        new active leaf id, or None if the message isn't in this conversation.
+        """
+        from app.models.message import Message
+        if not Conversation.find_message(conversation_id, message_id):
+            return None
+        db = get_db()
+        leaf_id = Message.newest_leaf(conversation_id, message_id)
+        db.execute('UPDATE conversations SET active_message_id = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+                   (leaf_id, conversation_id))
+        db.commit()
+        return leaf_id
+
     def update_title(self, new_title):
         db = get_db()
         db.execute(
@@ -76,11 +190,55 @@ class Conversation:
         self.title = new_title
         return self
         
-    def delete(self):
+    def delete(self, soft=False):
+        """Delete this conversation (messages cascade). Returns True if it was deleted."""
+        return bool(Conversation.delete_many(self.user_id, [self.id], soft=soft))
+    
+    @staticmethod
+    def delete_many(user_id, conversation_ids, soft=False):
+        """
+        Delete the user's conversations among `conversation_ids` in one transaction
+        and return the ids actually deleted. With `soft`, they are only marked
+        deleted; the purger (app/services/conversation_purger.py) removes the rows later.
+        """
+        ids = sorted({int(conversation_id) for conversation_id in conversation_ids})
+        if not ids:
+            return []
         db = get_db()
-        db.execute('DELETE FROM messages WHERE conversation_id = ?', (self.id,))
-        db.execute('DELETE FROM conversations WHERE id = ?', (self.id,))
-        db.commit()
+        placeholders = ', '.join('?' * len(ids))
+        rows = db.execute(
+            f'SELECT id, archived_at FROM conversations '
+            f'WHERE user_id = ? AND deleted_at IS NULL AND id IN ({placeholders})',
+            (user_id, *ids)
+        ).fetchall()
+        found = [row['id'] for row in rows]
+        if not found:
+            return []
+        
+        archived = [row['id'] for row in rows if row['archived_at']]
+        if archived and not soft:
+            # Attach before the transaction starts: SQLite can't ATTACH inside one
+            from app.utils.archive import attach_archive
+            attach_archive(db)
+        placeholders = ', '.join('?' * len(found))
+        try:
+            if soft:
+                db.execute(
+                    f'UPDATE conversations SET deleted_at = CURRENT_TIMESTAMP WHERE id IN ({placeholders})', found
+                )
+            else:
+                if archived:
+                    db.execute(
+                        f'DELETE FROM archive.archived_conversations '
+                        f'WHERE conversation_id IN ({", ".join("?" * len(archived))})', archived
+                    )
+                # Messages go with their conversation (ON DELETE CASCADE)
+                db.execute(f'DELETE FROM conversations WHERE id IN ({placeholders})', found)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        return found
         
     def to_dict(self):
         return {
@@ -89,5 +247,7 @@ class Conversation:
             'title': self.title,
             'created_at': self.created_at,
             'updated_at': self.updated_at,
+            'archived': bool(self.archived_at),
+            'active_message_id': self.active_message_id,
             'messages': [message.to_dict() for message in self.messages]
         }
@@ -1,29 +1,87 @@
 # app/models/message.py
 from app.utils.db import get_db
+from app.utils.compression import compress_text, row_content
+
+# Messages form a tree per conversation (parent_id; NULL for the first message
+# of a branch) and `conversations.active_message_id` is the leaf of the branch
+# being shown. Regenerating or editing adds a sibling instead of copying history,
+# and a branch is loaded by walking parent ids up from its leaf.
+BRANCH_SQL = '''
+    WITH RECURSIVE branch(id, parent_id) AS (
+        SELECT id, parent_id FROM messages WHERE id = ? AND conversation_id = ?
+        UNION ALL
+        SELECT m.id, m.parent_id FROM messages m JOIN branch b ON m.id = b.parent_id
+    )
+    SELECT messages.* FROM messages JOIN branch ON messages.id = branch.id ORDER BY messages.id
+'''
 
 class Message:
-    def __init__(self, id=None, conversation_id=None, role=None, content=None, created_at=None):
+    ACTIVE = 'active'  # As parent_id / leaf_id: the conversation's active leaf
+    PARENT = 'parent'  # As active_if: the new message's parent
+    ALWAYS = 'always'  # As active_if: unconditionally
+
+    def __init__(self, id=None, conversation_id=None, role=None, content=None, created_at=None, html=None,
+                 parent_id=None):
         self.id = id
         self.conversation_id = conversation_id
         self.role = role
         self.content = content
         self.created_at = created_at
+        self.html = html  # Server-rendered Markdown, when requested (see app/utils/markdown_render.py)
+        self.parent_id = parent_id
+        self.sibling_ids = None  # Ids of all versions of this message (itself included), when loaded
     
     @staticmethod
-    def create(conversation_id, role, content):
+    def from_row(row):
+        """Build a Message from a messages row, decompressing content if needed."""
+        return Message(
+            id=row['id'],
+            conversation_id=row['conversation_id'],
+            role=row['role'],
+            content=row_content(row),
+            created_at=row['created_at'],
+            parent_id=row['parent_id']
+        )
+    
+    @staticmethod
+    def create(conversation_id, role, content, parent_id=ACTIVE, active_if=PARENT):
+        """
+        Add a message under `parent_id` (default: the active leaf; None starts a new
+        root branch). It becomes the conversation's active leaf only if the active
+        leaf is still `active_if`: by default its parent, so a reply saved after the
+        user moved on (sent another message, switched branch) doesn't hide what they
+        see now. A message id compares against that leaf instead; ALWAYS activates
+        unconditionally (a branch the user chose, e.g. an edited message).
+        """
         db = get_db()
-        # Update the conversation's updated_at timestamp
+        # Update the conversation's updated_at timestamp (and take its write lock before reading the active leaf)
         db.execute(
             'UPDATE conversations SET updated_at = CURRENT_TIMESTAMP WHERE id = ?',
             (conversation_id,)
         )
+        if parent_id == Message.ACTIVE:
+            row = db.execute('SELECT active_message_id FROM conversations WHERE id = ?', (conversation_id,)).fetchone()
+            parent_id = row['active_message_id'] if row else None
         
+        # Long content is stored compressed in content_blob (content is left empty)
+        blob, encoding = compress_text(content)
         cursor = db.execute(
-            'INSERT INTO messages (conversation_id, role, content) VALUES (?, ?, ?)',
-            (conversation_id, role, content)
+            'INSERT INTO messages (conversation_id, role, content, content_blob, content_encoding, parent_id) '
+            'VALUES (?, ?, ?, ?, ?, ?)',
+            (conversation_id, role, content if encoding is None else '', blob, encoding, parent_id)
         )
+        message_id = cursor.lastrowid
+        expected = parent_id if active_if == Message.PARENT else active_if
+        if expected == Message.ALWAYS:
+            db.execute('UPDATE conversations SET active_message_id = ? WHERE id = ?', (message_id, conversation_id))
+        elif expected is None:
+            db.execute('UPDATE conversations SET active_message_id = ? WHERE id = ? AND active_message_id IS NULL',
+                       (message_id, conversation_id))
+        else:
+            db.execute('UPDATE conversations SET active_message_id = ? WHERE id = ? AND active_message_id = ?',
+                       (message_id, conversation_id, expected))
         db.commit()
-        return Message.get_by_id(cursor.lastrowid)
+        return Message.get_by_id(message_id)
     
     @staticmethod
     def get_by_id(message_id):
@@ -33,36 +91,77 @@ class Message:
         ).fetchone()
         
         if message:
-            return Message(
-                id=message['id'],
-                conversation_id=message['conversation_id'],
-                role=message['role'],
-                content=message['content'],
-                created_at=message['created_at']
-            )
+            return Message.from_row(message)
         return None
     
     @staticmethod
     def get_by_conversation_id(conversation_id):
+        """All messages of the conversation, every branch (see `get_branch` for one)."""
         db = get_db()
         messages = db.execute(
             'SELECT * FROM messages WHERE conversation_id = ? ORDER BY id ASC',
             (conversation_id,)
         ).fetchall()
         
-        return [Message(
-            id=message['id'],
-            conversation_id=message['conversation_id'],
-            role=message['role'],
-            content=message['content'],
-            created_at=message['created_at']
-        ) for message in messages]
+        return [Message.from_row(message) for message in messages]
+    
+    @staticmethod
+    def get_branch(conversation_id, leaf_id=ACTIVE):
+        """Messages from the root down to `leaf_id` (default: the active leaf), one primary key lookup per message."""
+        db = get_db()
+        if leaf_id == Message.ACTIVE:
+            row = db.execute('SELECT active_message_id FROM conversations WHERE id = ?', (conversation_id,)).fetchone()
+            leaf_id = row['active_message_id'] if row else None
+        if leaf_id is None:
+            return []
+        return [Message.from_row(row) for row in db.execute(BRANCH_SQL, (leaf_id, conversation_id)).fetchall()]
+    
+    @staticmethod
+    def load_siblings(conversation_id, messages):
+        """Set `sibling_ids` on a branch's messages (one indexed query per 500 distinct parents)."""
+        db = get_db()
+        parents = sorted({message.parent_id for message in messages if message.parent_id is not None})
+        children = {}
+        for start in range(0, len(parents), 500):
+            chunk = parents[start:start + 500]
+            for row in db.execute(
+                f'SELECT id, parent_id FROM messages WHERE conversation_id = ? '
+                f'AND parent_id IN ({", ".join("?" * len(chunk))}) ORDER BY id',
+                (conversation_id, *chunk)
+            ).fetchall():
+                children.setdefault(row['parent_id'], []).append(row['id'])
+        if any(message.parent_id is None for message in messages):
+            children[None] = [row['id'] for row in db.execute(
+                'SELECT id FROM messages WHERE conversation_id = ? AND parent_id IS NULL ORDER BY id', (conversation_id,)
+            ).fetchall()]
+        for message in messages:
+            message.sibling_ids = children.get(message.parent_id, [message.id])
+        return messages
+    
+    @staticmethod
+    def newest_leaf(conversation_id, message_id):
+        """The leaf reached from `message_id` by following its newest child at each step."""
+        db = get_db()
+        while True:
+            row = db.execute(
+                'SELECT id FROM messages WHERE conversation_id = ? AND parent_id = ? ORDER BY id DESC LIMIT 1',
+                (conversation_id, message_id)
+            ).fetchone()
+            if row is None:
+                return message_id
+            message_id = row['id']
     
     def to_dict(self):
-        return {
+        data = {
             'id': self.id,
             'conversation_id': self.conversation_id,
             'role': self.role,
             'content': self.content,
-            'created_at': self.created_at
+            'created_at': self.created_at,
+            'parent_id': self.parent_id
         }
+        if self.sibling_ids is not None and len(self.sibling_ids) > 1:
+            data['sibling_ids'] = self.sibling_ids  # Other versions to switch to (regenerated / edited)
+        if self.html is not None:
+            data['html'] = self.html
+        return data
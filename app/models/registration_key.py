@@ -4,6 +4,11 @@ import datetime
 import secrets
 import string
 
+KEY_ALPHABET = string.ascii_letters + string.digits
+# Maps random bytes onto the alphabet; bytes >= 248 are dropped so every char is equally likely
+_BYTE_TO_KEY_CHAR = bytes(ord(KEY_ALPHABET[b % len(KEY_ALPHABET)]) for b in range(256))
+_REJECTED_BYTES = bytes(range(len(KEY_ALPHABET) * (256 // len(KEY_ALPHABET)), 256))
+
 class RegistrationKey:
     def __init__(self, id=None, key_value=None, is_used=False, used_by=None, 
                  created_at=None, used_at=None):
@@ -20,6 +25,82 @@ class RegistrationKey:
         alphabet = string.ascii_letters + string.digits
         return ''.join(secrets.choice(alphabet) for _ in range(length))
     
+    @staticmethod
+    def generate_keys(count, length=16):
+        """Generate `count` random alphanumeric keys (much faster than repeated generate_key)."""
+        chars = b''
+        needed = count * length
+        while len(chars) < needed:
+            raw = secrets.token_bytes(int((needed - len(chars)) * 1.05) + 16)
+            chars += raw.translate(_BYTE_TO_KEY_CHAR, _REJECTED_BYTES)
+        text = chars[:needed].decode('ascii')
+        return [text[i:i + length] for i in range(0, needed, length)]
+    
+    @staticmethod
+    def bulk_insert(key_values, chunk_size=10000):
+        """
+        Insert key values with INSERT OR IGNORE in a single transaction.
+        `key_values` may be any iterable (e.g. a file being streamed); it is
+        consumed in chunks. Returns (added, skipped) counts.
+        """
+        db = get_db()
+        added = skipped = 0
+        chunk = []
+        try:
+            for key_value in key_values:
+                chunk.append((key_value,))
+                if len(chunk) >= chunk_size:
+                    inserted = RegistrationKey._insert_chunk(db, chunk)
+                    added += inserted
+                    skipped += len(chunk) - inserted
+                    chunk = []
+            if chunk:
+                inserted = RegistrationKey._insert_chunk(db, chunk)
+                added += inserted
+                skipped += len(chunk) - inserted
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        return added, skipped
+    
+    @staticmethod
+    def _insert_chunk(db, rows):
+        before = db.total_changes
+        db.executemany('INSERT OR IGNORE INTO registration_keys (key_value) VALUES (?)', rows)
+        return db.total_changes - before
+    
+    @staticmethod
+    def bulk_create(count, chunk_size=10000):
+        """
+        Generate and insert `count` new keys in one transaction.
+        Returns the list of created key values.
+        """
+        db = get_db()
+        created = []
+        seen = set()
+        try:
+            (max_id_before,) = db.execute('SELECT COALESCE(MAX(id), 0) FROM registration_keys').fetchone()
+            while len(created) < count:
+                batch = [k for k in dict.fromkeys(RegistrationKey.generate_keys(min(chunk_size, count - len(created))))
+                         if k not in seen]
+                before = db.total_changes
+                db.executemany('INSERT OR IGNORE INTO registration_keys (key_value) VALUES (?)',
+                               [(k,) for k in batch])
+                if db.total_changes - before != len(batch):
+                    # Some values already existed (at 62^16 possible keys this practically
+                    # never happens); keep only the rows inserted by this transaction
+                    batch = [k for k in batch if db.execute(
+                        'SELECT id FROM registration_keys WHERE key_value = ?', (k,)
+                    ).fetchone()[0] > max_id_before]
+                created.extend(batch)
+                seen.update(batch)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        return created
+    
     @staticmethod
     def create():
         """Create a new registration key."""
@@ -83,6 +164,60 @@ class RegistrationKey:
             used_at=key['used_at']
         ) for key in keys]
     
+    @staticmethod
+    def list_page(limit=50, before_id=None, is_used=None, created_from=None,
+                  created_to=None, used_by=None):
+        """
+        Keyset-paginated, filtered listing, newest first. `created_from` and
+        `created_to` are 'YYYY-MM-DD' days, both inclusive.
+        Returns (keys, next_cursor); pass next_cursor as `before_id` for the next page.
+        """
+        clauses, params = [], []
+        if before_id is not None:
+            clauses.append('id < ?'); params.append(before_id)
+        if is_used is not None:
+            clauses.append('is_used = ?'); params.append(1 if is_used else 0)
+        if created_from:
+            clauses.append('created_at >= ?'); params.append(created_from)
+        if created_to:
+            # A whole day: keys created at any time on `created_to` are included
+            next_day = datetime.date.fromisoformat(str(created_to)[:10]) + datetime.timedelta(days=1)
+            clauses.append('created_at < ?'); params.append(next_day.isoformat())
+        if used_by is not None:
+            clauses.append('used_by = ?'); params.append(used_by)
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+        
+        db = get_db()
+        # ids are assigned in insertion order, so id DESC == created_at DESC
+        rows = db.execute(
+            f'SELECT * FROM registration_keys {where} ORDER BY id DESC LIMIT ?',
+            (*params, limit + 1)
+        ).fetchall()
+        
+        keys = [RegistrationKey(
+            id=key['id'],
+            key_value=key['key_value'],
+            is_used=bool(key['is_used']),
+            used_by=key['used_by'],
+            created_at=key['created_at'],
+            used_at=key['used_at']
+        ) for key in rows[:limit]]
+        next_cursor = keys[-1].id if len(rows) > limit else None
+        return keys, next_cursor
+    
+    @staticmethod
+    def counts():
+        """Total/used/unused key counts from a single aggregate query."""
+        db = get_db()
+        row = db.execute(
+            'SELECT COUNT(*) AS total, COALESCE(SUM(is_used), 0) AS used FROM registration_keys'
+        ).fetchone()
+        return {
+            'total': row['total'],
+            'used': row['used'],
+            'unused': row['total'] - row['used']
+        }
+    
     def mark_as_used(self, user_id):
         """Mark this key as used by a specific user."""
         if self.is_used:
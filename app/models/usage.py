@@ -0,0 +1,78 @@
+# app/models/usage.py
+from app.utils.db import get_db
+
+# Columns the admin aggregation may group by
+GROUP_BY = {
+    'user': 'user_id',
+    'model': 'model',
+    'day': 'day',
+    'month': 'substr(day, 1, 7)',
+}
+
+
+class Usage:
+    """Token usage of upstream model calls, one row per request."""
+
+    COLUMNS = ('user_id', 'conversation_id', 'model', 'input_tokens', 'cached_tokens', 'output_tokens',
+               'latency_ms', 'streaming', 'day', 'created_at')
+
+    @staticmethod
+    def insert_many(records):
+        """Insert usage records (dicts keyed by COLUMNS) in one transaction."""
+        if not records:
+            return 0
+        db = get_db()
+        db.executemany(
+            f'INSERT INTO usage ({", ".join(Usage.COLUMNS)}) VALUES ({", ".join("?" * len(Usage.COLUMNS))})',
+            [tuple(record[column] for column in Usage.COLUMNS) for record in records]
+        )
+        db.commit()
+        return len(records)
+
+    @staticmethod
+    def user_totals(user_id, day, month_start):
+        """Tokens (input + output) used by `user_id` on `day` and since `month_start` (both 'YYYY-MM-DD')."""
+        db = get_db()
+        row = db.execute(
+            'SELECT COALESCE(SUM(CASE WHEN day = ? THEN input_tokens + output_tokens ELSE 0 END), 0) AS day_tokens, '
+            'COALESCE(SUM(input_tokens + output_tokens), 0) AS month_tokens '
+            'FROM usage WHERE user_id = ? AND day >= ?',
+            (day, user_id, month_start)
+        ).fetchone()
+        return int(row['day_tokens']), int(row['month_tokens'])
+
+    @staticmethod
+    def aggregate(group_by='user', start=None, end=None, user_id=None, model=None, limit=100):
+        """
+        Sum usage per user, model, day or month. `start`/`end` are inclusive
+        'YYYY-MM-DD' days. Users and models are ordered by total tokens, days and
+        months chronologically.
+        """
+        key = GROUP_BY[group_by]
+        conditions, params = [], []
+        if start:
+            conditions.append('day >= ?'); params.append(start)
+        if end:
+            conditions.append('day <= ?'); params.append(end)
+        if user_id is not None:
+            conditions.append('user_id = ?'); params.append(user_id)
+        if model:
+            conditions.append('model = ?'); params.append(model)
+        where = f'WHERE {" AND ".join(conditions)}' if conditions else ''
+        order = 'total_tokens DESC' if group_by in ('user', 'model') else 'key'
+        rows = get_db().execute(
+            f'SELECT {key} AS key, COUNT(*) AS requests, SUM(input_tokens) AS input_tokens, '
+            f'SUM(cached_tokens) AS cached_tokens, SUM(output_tokens) AS output_tokens, '
+            f'SUM(input_tokens + output_tokens) AS total_tokens, AVG(latency_ms) AS avg_latency_ms '
+            f'FROM usage {where} GROUP BY {key} ORDER BY {order} LIMIT ?',
+            (*params, limit)
+        ).fetchall()
+        return [{
+            group_by: row['key'],
+            'requests': row['requests'],
+            'input_tokens': int(row['input_tokens'] or 0),
+            'cached_tokens': int(row['cached_tokens'] or 0),
+            'output_tokens': int(row['output_tokens'] or 0),
+            'total_tokens': int(row['total_tokens'] or 0),
+            'avg_latency_ms': round(float(row['avg_latency_ms']), 1) if row['avg_latency_ms'] is not None else None,
+        } for row in rows]
@@ -1,6 +1,6 @@
 # app/models/user.py (updated)
 from app.utils.db import get_db
-from werkzeug.security import generate_password_hash, check_password_hash
+from app.utils.password_hashing import get_password_hasher
 
 class User:
     def __init__(self, id=None, username=None, password_hash=None, created_at=None, updated_at=None):
@@ -13,7 +13,7 @@ class User:
     @staticmethod
     def create(username, password):
         db = get_db()
-        password_hash = generate_password_hash(password)
+        password_hash = get_password_hasher().hash(password)  # May raise HashingBusy
         
         try:
             cursor = db.execute(
@@ -60,7 +60,27 @@ class User:
         return None
     
     def verify_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        hasher = get_password_hasher()
+        if not hasher.verify(self.password_hash, password):
+            return False
+        # Transparently upgrade hashes made with outdated parameters
+        if hasher.needs_rehash(self.password_hash):
+            try:
+                self.update_password_hash(hasher.hash(password))
+            except Exception:
+                pass  # The login itself succeeded; retry the upgrade next time
+        return True
+    
+    def update_password_hash(self, password_hash):
+        db = get_db()
+        db.execute(
+            'UPDATE users SET password_hash = ?, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+            (password_hash, self.id)
+        )
+        db.commit()
+        self.password_hash = password_hash
+        from app.utils.user_cache import invalidate_user
+        invalidate_user(self.id)
     
     def to_dict(self):
         return {
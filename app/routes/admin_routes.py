@@ -1,46 +1,122 @@
 # app/routes/admin_routes.py
-from flask import Blueprint, request, jsonify, render_template, redirect, url_for
+from flask import Blueprint, request, jsonify, render_template, redirect, url_for, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
+import datetime
+import io
 import os
 
 from app.models.user import User
 from app.models.registration_key import RegistrationKey
-from app.utils.key_management import load_keys_from_file
+from app.models.usage import Usage, GROUP_BY as USAGE_GROUP_BY
+from app.services.usage import get_usage_tracker
+from app.utils.key_management import load_keys_from_file, import_keys
+from app.utils.metrics import metrics
 
 admin_bp = Blueprint('admin', __name__)
 
+def is_admin():
+    """Check if the current user is admin (user id 1 for simplicity)."""
+    # JWT identities are strings
+    return str(get_jwt_identity()) == '1'
+
+def _day(value):
+    """Validate a 'YYYY-MM-DD' filter value. Raises ValueError."""
+    return datetime.date.fromisoformat(value).isoformat() if value else None
+
+def key_listing_args():
+    """Parse pagination/filter query params for key listings. Raises ValueError on bad input."""
+    args = request.args
+    status = args.get('status')
+    if status not in (None, '', 'used', 'unused'):
+        raise ValueError("status must be 'used' or 'unused'")
+    max_limit = current_app.config.get('ADMIN_KEYS_PAGE_MAX', 500)
+    return {
+        'limit': max(1, min(int(args.get('limit', 50)), max_limit)),
+        'before_id': int(args['before']) if args.get('before') else None,
+        'is_used': {'used': True, 'unused': False}.get(status),
+        'created_from': _day(args.get('created_from')),
+        'created_to': _day(args.get('created_to')),
+        'used_by': int(args['used_by']) if args.get('used_by') else None,
+    }
+
 @admin_bp.route('/admin/keys', methods=['GET'])
 @jwt_required()
 def admin_keys():
     """Admin page to manage registration keys."""
-    # Check if the user is admin (user id 1 for simplicity)
-    user_id = get_jwt_identity()
-    if user_id != 1:
+    if not is_admin():
         return jsonify({"error": "Unauthorized"}), 403
     
-    keys = RegistrationKey.get_all()
-    return render_template('admin/keys.html', keys=keys)
+    try:
+        filters = key_listing_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    keys, next_cursor = RegistrationKey.list_page(**filters)
+    next_page_url = None
+    if next_cursor:
+        query = {k: v for k, v in request.args.items() if k != 'before'}
+        next_page_url = url_for('admin.admin_keys', before=next_cursor, **query)
+    return render_template('admin/keys.html', keys=keys, next_page_url=next_page_url,
+                           counts=RegistrationKey.counts(), filters=request.args)
 
 @admin_bp.route('/api/admin/keys/generate', methods=['POST'])
 @jwt_required()
 def api_generate_key():
-    """Generate a new registration key."""
-    user_id = get_jwt_identity()
-    if user_id != 1:
+    """Generate one or more registration keys. Optional JSON body: {"count": N}."""
+    if not is_admin():
+        return jsonify({"error": "Unauthorized"}), 403
+    
+    data = request.get_json(silent=True) or {}
+    try:
+        count = int(data.get('count', 1))
+    except (TypeError, ValueError):
+        return jsonify({"error": "count must be an integer"}), 400
+    max_count = current_app.config.get('ADMIN_KEYS_MAX_GENERATE', 1000000)
+    if count < 1 or count > max_count:
+        return jsonify({"error": f"count must be between 1 and {max_count}"}), 400
+    
+    if count == 1:
+        key = RegistrationKey.create()
+        return jsonify({
+            "message": "Key generated successfully",
+            "created": 1,
+            "key": key.to_dict()
+        }), 201
+    
+    keys = RegistrationKey.bulk_create(count)
+    response = {"message": f"Generated {len(keys)} keys", "created": len(keys)}
+    # Large batches are not echoed back; export them from the key listing instead
+    if len(keys) <= current_app.config.get('ADMIN_KEYS_RETURN_LIMIT', 1000):
+        response["keys"] = keys
+    return jsonify(response), 201
+
+@admin_bp.route('/api/admin/keys/import', methods=['POST'])
+@jwt_required()
+def api_import_keys():
+    """Import keys from an uploaded file (multipart field "file") or a text/plain body, one per line."""
+    if not is_admin():
         return jsonify({"error": "Unauthorized"}), 403
     
-    key = RegistrationKey.create()
+    upload = request.files.get('file')
+    if upload is not None:
+        lines = io.TextIOWrapper(upload.stream, encoding='utf-8', errors='ignore')
+    else:
+        lines = request.stream  # Read line by line, never buffered whole
+    
+    try:
+        added, skipped = import_keys(lines)
+    except Exception as e:
+        return jsonify({"error": f"Error importing keys: {str(e)}"}), 400
     return jsonify({
-        "message": "Key generated successfully",
-        "key": key.to_dict()
-    }), 201
+        "message": f"Added {added} keys ({skipped} already existed)",
+        "added": added,
+        "skipped": skipped
+    }), 200
 
 @admin_bp.route('/api/admin/keys/load', methods=['POST'])
 @jwt_required()
 def api_load_keys():
     """Load keys from the keys.txt file."""
-    user_id = get_jwt_identity()
-    if user_id != 1:
+    if not is_admin():
         return jsonify({"error": "Unauthorized"}), 403
     
     success, message = load_keys_from_file()
@@ -53,12 +129,75 @@ def api_load_keys():
 @admin_bp.route('/api/admin/keys', methods=['GET'])
 @jwt_required()
 def api_get_keys():
-    """Get all registration keys."""
-    user_id = get_jwt_identity()
-    if user_id != 1:
+    """List registration keys, newest first, one page at a time.
+
+    Query params: limit, before (cursor from the previous page's next_cursor),
+    status (used|unused), created_from, created_to, used_by.
+    Counters are included on the first page only.
+    """
+    if not is_admin():
         return jsonify({"error": "Unauthorized"}), 403
     
-    keys = RegistrationKey.get_all()
-    return jsonify({
-        "keys": [key.to_dict() for key in keys]
-    }), 200
+    try:
+        filters = key_listing_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    keys, next_cursor = RegistrationKey.list_page(**filters)
+    response = {
+        "keys": [key.to_dict() for key in keys],
+        "next_cursor": next_cursor
+    }
+    if filters['before_id'] is None:
+        response["counts"] = RegistrationKey.counts()
+    return jsonify(response), 200
+
+@admin_bp.route('/api/admin/keys/counts', methods=['GET'])
+@jwt_required()
+def api_key_counts():
+    """Total/used/unused key counters."""
+    if not is_admin():
+        return jsonify({"error": "Unauthorized"}), 403
+    
+    return jsonify({"counts": RegistrationKey.counts()}), 200
+
+@admin_bp.route('/api/admin/metrics', methods=['GET'])
+@jwt_required()
+def api_metrics():
+    """In-process metrics for this worker (token usage, prompt-cache hits, queue waits, jobs)."""
+    if not is_admin():
+        return jsonify({"error": "Unauthorized"}), 403
+    return jsonify(metrics.snapshot())
+
+@admin_bp.route('/api/admin/usage', methods=['GET'])
+@jwt_required()
+def api_usage():
+    """Token usage totals grouped by user, model, day or month.
+
+    Query params: group_by (user|model|day|month), from, to (inclusive UTC
+    days, YYYY-MM-DD), user_id, model, limit. With user_id, the user's quota
+    status is included.
+    """
+    if not is_admin():
+        return jsonify({"error": "Unauthorized"}), 403
+
+    args = request.args
+    group_by = args.get('group_by', 'user')
+    if group_by not in USAGE_GROUP_BY:
+        return jsonify({"error": f"group_by must be one of {', '.join(USAGE_GROUP_BY)}"}), 400
+    try:
+        user_id = int(args['user_id']) if args.get('user_id') else None
+        limit = max(1, min(int(args.get('limit', 100)), 1000))
+        for day in (args.get('from'), args.get('to')):
+            if day: datetime.date.fromisoformat(day)
+    except ValueError:
+        return jsonify({"error": "Invalid user_id, limit or date"}), 400
+
+    tracker = get_usage_tracker()
+    tracker.flush()  # Include this worker's buffered records
+    response = {
+        "group_by": group_by,
+        "usage": Usage.aggregate(group_by, args.get('from'), args.get('to'), user_id, args.get('model'), limit),
+    }
+    if user_id is not None:
+        response["quota"] = tracker.remaining(user_id)
+    return jsonify(response), 200
@@ -8,19 +8,29 @@ from flask_jwt_extended import (
 )
 from app.models.user import User
 from app.models.registration_key import RegistrationKey
+from app.utils.user_cache import load_user
+from app.utils.password_hashing import HashingBusy
 
 api_bp = Blueprint('api', __name__, url_prefix='/api')
 
+@api_bp.errorhandler(HashingBusy)
+def handle_hashing_busy(error):
+    return jsonify({"error": str(error)}), 503, {"Retry-After": str(error.retry_after)}
+
 @api_bp.route('/login', methods=['POST'])
 def login():
     """API endpoint for user login."""
     data = request.get_json()
 
     # ... (validation checks) ...
+    if not data or not data.get('username') or not data.get('password'):
+        return jsonify({"error": "Username and password are required"}), 400
 
     user = User.get_by_username(data['username'])
 
-    # ... (user/password verification) ...
+    # Verification runs in the hashing pool and may upgrade the stored hash
+    if not user or not user.verify_password(data['password']):
+        return jsonify({"error": "Invalid username or password"}), 401
 
     # --- CHANGE HERE: Convert user.id to string ---
     identity = str(user.id)
@@ -66,9 +76,8 @@ def get_current_user():
         # get_jwt_identity() will now return the ID as a string
         user_id_str = get_jwt_identity()
     
-        # Assuming User.get_by_id can handle a string or you convert it back if needed
-        # user = User.get_by_id(int(user_id_str)) # If get_by_id STRICTLY needs int
-        user = User.get_by_id(user_id_str) # Try this first, it often works
+        # Cached lookup (request-scoped + TTL cache); handles the string identity
+        user = load_user(user_id_str)
 
         if not user:
             # Log this specific case for debugging if it happens
@@ -5,58 +5,33 @@ from flask import (
 from flask_jwt_extended import jwt_required, get_jwt_identity
 import logging
 import json
-import asyncio
-import queue      # For thread communication
-import threading  # For running async task in background
+import time
 
 # Assuming DEFAULT_MODEL is defined correctly in this config path
 from app.config.models import DEFAULT_MODEL
 
 from app.models.conversation import Conversation
 from app.models.message import Message
-# Import the NON-streaming function and the QUEUE-based streaming function
-from app.services.chat_service import generate_response, _stream_response_async_to_queue
+# app.services.chat_service (the agents/openai stack) is imported on first chat use, see create_app
+from app.services.scheduler import SchedulerTimeout
+from app.services.stream_broker import StreamTimeout, get_stream_broker
+from app.services.conversation_purger import schedule_purge
+from app.services.title_service import needs_title, schedule_title
+from app.services.usage import check_quota
+from app.utils import markdown_render
+from app.utils.http_cache import make_etag, not_modified, with_etag
+from app.utils.rate_limit import RateLimitExceeded, admit_generation, rate_limit_response
+from app.utils.response_compression import compress_response
 
 chat_bp = Blueprint('chat', __name__)
+chat_bp.after_request(compress_response)  # Large conversation payloads go out compressed; SSE is skipped
 logger = logging.getLogger(__name__)
 
 
-# --- HELPER TO RUN ASYNC IN THREAD (Modified to accept app_instance) ---
-def run_async_in_thread(target_async_func, app_instance, *args): # Added app_instance parameter
-    """Helper to run an async function within its own event loop in a separate thread."""
-    logger.info(f"[HELPER_THREAD] Starting new thread for {target_async_func.__name__}")
-    def thread_target():
-        # Each thread needs its own event loop when using asyncio this way
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        logger.info(f"[HELPER_THREAD] Thread {threading.current_thread().name} started with new event loop.")
-        try:
-            # Pass app_instance as the first argument to the target async function
-            # Ensure the target function (_stream_response_async_to_queue) expects app_instance first
-            loop.run_until_complete(target_async_func(app_instance, *args))
-            logger.info(f"[HELPER_THREAD] Thread {threading.current_thread().name} async task completed.")
-        except Exception as e:
-             logger.error(f"[HELPER_THREAD] Exception in thread {threading.current_thread().name}: {e}", exc_info=True)
-        finally:
-            logger.info(f"[HELPER_THREAD] Thread {threading.current_thread().name} closing event loop.")
-            try:
-                # Ensure loop cleanup happens correctly
-                if loop.is_running():
-                     loop.stop()
-                if not loop.is_closed():
-                     loop.close()
-                     logger.info(f"[HELPER_THREAD] Event loop closed.")
-                else:
-                     logger.info(f"[HELPER_THREAD] Event loop was already closed.")
-            except Exception as close_err:
-                 logger.error(f"[HELPER_THREAD] Error during loop close: {close_err}")
-
-            logger.info(f"[HELPER_THREAD] Thread {threading.current_thread().name} finished.")
-
-    # Create and start the daemon thread
-    thread = threading.Thread(target=thread_target, daemon=True)
-    thread.start()
-    return thread
+@chat_bp.errorhandler(RateLimitExceeded)
+def handle_rate_limit(error):
+    logger.warning(f"[RATE_LIMIT] Rejected {request.path}: {error.message} (retry after {error.retry_after}s)")
+    return rate_limit_response(error)
 
 
 # --- Standard CRUD and Non-Streaming Routes (Keep as before, ensuring int(user_id_str)) ---
@@ -68,8 +43,12 @@ def get_conversations():
     if user_id_str is None: return jsonify({"error": "Authentication required", "conversations": []}), 401
     try:
         user_id_int = int(user_id_str)
+        # Repeat polls cost one indexed lookup: 304 if nothing in the list changed
+        etag = make_etag('conversations', user_id_int, Conversation.list_fingerprint(user_id_int))
+        cached = not_modified(etag)
+        if cached: return cached
         conversations = Conversation.get_by_user_id(user_id_int)
-        return jsonify({"conversations": [conv.to_dict() for conv in conversations]}), 200
+        return with_etag((jsonify({"conversations": [conv.to_dict() for conv in conversations]}), 200), etag)
     except ValueError: logger.error(f"[GET /conversations] Invalid JWT ID: {user_id_str}"); return jsonify({"error": "Invalid ID"}), 401
     except Exception as e: logger.error(f"[GET /conversations] Error: {e}", exc_info=True); return jsonify({"error": "Failed fetch"}), 500
 
@@ -92,11 +71,18 @@ def create_conversation():
 @jwt_required()
 def get_conversation(conversation_id):
     user_id_str = get_jwt_identity()
-    conversation = Conversation.get_by_id(conversation_id)
     try:
         user_id_int = int(user_id_str)
-        if not conversation or conversation.user_id != user_id_int: logger.warning(f"[GET /conv/{conversation_id}] Unauthorized user {user_id_int}"); return jsonify({"error": "Not found/unauthorized"}), 404
-        return jsonify({"conversation": conversation.to_dict()}), 200
+        owner_id, fingerprint = Conversation.fingerprint(conversation_id) or (None, None)
+        if owner_id != user_id_int: logger.warning(f"[GET /conv/{conversation_id}] Unauthorized user {user_id_int}"); return jsonify({"error": "Not found/unauthorized"}), 404
+        render_html = request.args.get('render') == 'html' and markdown_render.enabled(current_app)
+        etag = make_etag('conversation', conversation_id, fingerprint, render_html and markdown_render.RENDER_VERSION)
+        cached = not_modified(etag)
+        if cached: return cached
+        conversation = Conversation.get_by_id(conversation_id, siblings=True) # Active branch, with the ids of other versions
+        if not conversation: return jsonify({"error": "Not found/unauthorized"}), 404
+        if render_html: markdown_render.cached_html(conversation.messages) # Adds "html" to assistant messages
+        return with_etag((jsonify({"conversation": conversation.to_dict()}), 200), etag)
     except ValueError: logger.error(f"[GET /conv/{conversation_id}] Invalid JWT ID: {user_id_str}"); return jsonify({"error": "Invalid ID"}), 401
     except Exception as e: logger.error(f"[GET /conv/{conversation_id}] Error: {e}", exc_info=True); return jsonify({"error": "Failed fetch"}), 500
 
@@ -125,13 +111,38 @@ def delete_conversation(conversation_id):
     try:
         user_id_int = int(user_id_str)
         if not conversation or conversation.user_id != user_id_int: logger.warning(f"[DELETE /conv/{conversation_id}] Unauthorized user {user_id_int}"); return jsonify({"error": "Not found/unauthorized"}), 404
-        deleted = conversation.delete()
+        soft = current_app.config.get('CONVERSATION_SOFT_DELETE', True)
+        deleted = conversation.delete(soft=soft)
         if not deleted: raise Exception("Deletion failed in DB")
+        if soft: schedule_purge()
         logger.info(f"[DELETE /conv/{conversation_id}] Deleted for user {user_id_int}")
         return jsonify({"message": "Deleted"}), 200
     except ValueError: logger.error(f"[DELETE /conv/{conversation_id}] Invalid JWT ID: {user_id_str}"); return jsonify({"error": "Invalid ID"}), 401
     except Exception as e: logger.error(f"[DELETE /conv/{conversation_id}] Error: {e}", exc_info=True); return jsonify({"error": "Failed delete"}), 500
 
+@chat_bp.route('/conversations/bulk-delete', methods=['POST'])
+@jwt_required()
+def bulk_delete_conversations():
+    """Delete many of the user's conversations in one transaction. Body: {"ids": [1, 2, ...]}"""
+    user_id_str = get_jwt_identity()
+    data = request.get_json(silent=True) or {}
+    ids = data.get('ids')
+    limit = current_app.config.get('CONVERSATION_BULK_DELETE_MAX', 500)
+    if not isinstance(ids, list) or not all(isinstance(i, int) and not isinstance(i, bool) for i in ids):
+        return jsonify({"error": "ids must be a list of conversation ids"}), 400
+    if len(ids) > limit:
+        return jsonify({"error": f"At most {limit} conversations per request"}), 400
+    try:
+        user_id_int = int(user_id_str)
+        soft = current_app.config.get('CONVERSATION_SOFT_DELETE', True)
+        deleted = Conversation.delete_many(user_id_int, ids, soft=soft)
+        if soft and deleted: schedule_purge()
+        logger.info(f"[BULK_DELETE] Deleted {len(deleted)}/{len(ids)} conversations for user {user_id_int}")
+        # Ids that don't exist or belong to someone else are reported together
+        return jsonify({"deleted": deleted, "not_found": sorted(set(ids) - set(deleted))}), 200
+    except ValueError: logger.error(f"[BULK_DELETE] Invalid JWT ID: {user_id_str}"); return jsonify({"error": "Invalid ID"}), 401
+    except Exception as e: logger.error(f"[BULK_DELETE] Error: {e}", exc_info=True); return jsonify({"error": "Failed delete"}), 500
+
 @chat_bp.route('/conversations/<int:conversation_id>/messages', methods=['POST'])
 @jwt_required()
 def send_message(conversation_id):
@@ -140,37 +151,65 @@ def send_message(conversation_id):
     logger.info(f"[POST /messages] Received: user={user_id_str}, conv={conversation_id}, data={data}")
     content = data.get('content'); model = data.get('model', DEFAULT_MODEL)
     if not content: logger.warning("[POST /messages] Content missing"); return jsonify({"error": "Content required"}), 400
+    parent_id, error = _parent_from_request(conversation_id, data)
+    if error: return error
     conversation = Conversation.get_by_id(conversation_id)
     try: user_id_int = int(user_id_str)
     except ValueError: logger.error(f"[POST /messages] Invalid JWT ID: {user_id_str}"); return jsonify({"error": "Invalid ID"}), 401
     if not conversation or conversation.user_id != user_id_int: logger.warning(f"[POST /messages] Unauthorized"); return jsonify({"error": "Not found/unauthorized"}), 404
-    try: # Save user message
-        user_message = Message.create(conversation_id, 'user', content)
+    check_quota(user_id_int) # Raises QuotaExceeded -> 429
+    lease = admit_generation(user_id_int, model) # Raises RateLimitExceeded -> 429
+    try:
+        return _send_message_admitted(conversation_id, content, model, user_id_int,
+                                      needs_title(conversation.title, conversation.messages), parent_id)
+    finally:
+        lease.release()
+
+
+def _send_message_admitted(conversation_id, content, model, user_id_int, auto_title=False, parent_id=Message.ACTIVE):
+    try: # Save user message (it becomes the active leaf, so the reply is generated from its branch)
+        user_message = Message.create(conversation_id, 'user', content, parent_id, active_if=Message.ALWAYS)
         if not user_message: raise Exception("User msg save failed")
         logger.info(f"[POST /messages] User message saved: id={user_message.id}")
     except Exception as db_err: logger.error(f"[POST /messages] DB Error user msg: {db_err}", exc_info=True); return jsonify({"error": "Failed save user message"}), 500
     try: # Call service and save AI message
-        ai_content = generate_response(conversation_id, content, model) # Calls sync wrapper
+        from app.services.chat_service import generate_response
+        ai_content = generate_response(conversation_id, content, model, user_id_int) # Calls sync wrapper
         logger.info(f"[POST /messages] Service response len: {len(ai_content)}")
-        ai_message = Message.create(conversation_id, 'assistant', ai_content)
+        ai_message = Message.create(conversation_id, 'assistant', ai_content, user_message.id)
         if not ai_message: raise Exception("AI msg save failed")
         logger.info(f"[POST /messages] Assistant message saved: id={ai_message.id}")
+        if auto_title: schedule_title(conversation_id) # Titled by a background job, off the request path
         updated_conversation = Conversation.get_by_id(conversation_id)
         return jsonify({"conversation": updated_conversation.to_dict()}), 200
+    except SchedulerTimeout as e:
+        logger.warning(f"[POST /messages] {e}")
+        return jsonify({"error": "The model is busy, please retry shortly"}), 503, {"Retry-After": "5"}
     except Exception as e: logger.error(f"[POST /messages] Error service/AI save: {e}", exc_info=True); return jsonify({"error": f"Failed generate/save response: {str(e)}"}), 500
 
 
-# --- MODIFIED STREAMING ROUTE (Using Thread/Queue) ---
+# --- MODIFIED STREAMING ROUTE (Using shared upstream loop/Queue) ---
 @chat_bp.route('/conversations/<int:conversation_id>/stream', methods=['POST'])
 @jwt_required()
 def stream_message(conversation_id):
-    """Handles POST requests to stream chat responses using Thread/Queue."""
+    """
+    Handles POST requests to stream chat responses.
+
+    Only the cheap checks (ownership, admission) run before the response
+    starts; headers and a `{"started": true, "generation_id": ...}` event are
+    flushed immediately, and the user message is saved concurrently with the
+    upstream call. Events carry SSE ids; see `resume_stream` for reattaching.
+    An optional `parent_id` (an assistant message, or null for a new first
+    message) forks the conversation there instead of continuing the active branch.
+    """
+    started_at = time.monotonic()
     user_id_str = get_jwt_identity()
     data = request.get_json()
     content = data.get('content')
     model = data.get('model', DEFAULT_MODEL)
+    render_markdown = bool(data.get('render_markdown')) # Also send server-rendered HTML blocks
     # --- Get app instance HERE in the main thread ---
-    # Necessary to pass the application context to the background thread
+    # Necessary to pass the application context to the shared upstream loop
     app_instance = current_app._get_current_object()
     # -------------------------------------------------
     logger.info(f"[ROUTE_STREAM_Q] START: user={user_id_str}, conv={conversation_id}, model={model}")
@@ -178,82 +217,160 @@ def stream_message(conversation_id):
     if not content:
         logger.warning("[ROUTE_STREAM_Q] Content missing")
         return jsonify({"error": "Message content is required"}), 400
+    parent_id, error = _parent_from_request(conversation_id, data)
+    if error:
+        return error
 
-    # --- Authorization Check ---
-    conversation = Conversation.get_by_id(conversation_id)
+    # --- Authorization Check (owner only; history is loaded alongside the upstream call) ---
+    owner_id = Conversation.get_owner_id(conversation_id)
     try:
         user_id_int = int(user_id_str)
     except ValueError:
         logger.error(f"[ROUTE_STREAM_Q] Invalid user ID format: {user_id_str}")
         return jsonify({"error": "Invalid user identity"}), 401
 
-    if not conversation or conversation.user_id != user_id_int:
-        logger.warning(f"[ROUTE_STREAM_Q] Unauthorized: conv_owner={conversation.user_id if conversation else 'None'}, req_user={user_id_int}")
+    if owner_id != user_id_int:
+        logger.warning(f"[ROUTE_STREAM_Q] Unauthorized: conv_owner={owner_id}, req_user={user_id_int}")
         return jsonify({"error": "Conversation not found or unauthorized"}), 404
     # --- End Auth Check ---
 
-    # --- Save User Message ---
-    # Saving before starting stream ensures history is correct for the AI call
-    logger.info(f"[ROUTE_STREAM_Q] Saving user message...")
+    # --- Admission (token quotas, rate limits, concurrency caps) and start ---
+    # Raises RateLimitExceeded (-> 429) before anything is written. The service
+    # publishes its SSE events to the stream broker; this request (or any other,
+    # e.g. after a reconnect) subscribes by generation id.
+    from app.services.chat_service import start_stream
+    generation_id, _ = start_stream(app_instance, user_id_int, conversation_id, content, model,
+                                    render_markdown, started_at, parent_id=parent_id)
+    return _generation_response(app_instance, generation_id)
+
+
+@chat_bp.route('/conversations/<int:conversation_id>/regenerate', methods=['POST'])
+@jwt_required()
+def regenerate_message(conversation_id):
+    """
+    Stream another version of an assistant reply. Body (all optional):
+    `message_id` (the reply to redo; default: the active leaf), `model`,
+    `render_markdown`. The new reply is added next to the old one under the
+    same user message, so no history is copied; both stay reachable through
+    `sibling_ids` and `PUT /branch`.
+    """
+    started_at = time.monotonic()
+    data = request.get_json(silent=True) or {}
+    model = data.get('model', DEFAULT_MODEL)
+    app_instance = current_app._get_current_object()
+    try:
+        user_id_int = int(get_jwt_identity())
+    except ValueError:
+        return jsonify({"error": "Invalid user identity"}), 401
+    owner_id, fingerprint = Conversation.fingerprint(conversation_id) or (None, None)
+    if owner_id != user_id_int:
+        return jsonify({"error": "Conversation not found or unauthorized"}), 404
+
+    message_id = data.get('message_id')
+    if message_id is None:
+        message_id = fingerprint[3] # The active leaf
+    target = Conversation.find_message(conversation_id, message_id)
+    if not target:
+        return jsonify({"error": "Message not found in this conversation"}), 400
+    # Answer the user message the reply was for (or the leaf itself, if its reply never arrived)
+    prompt = target if target.role == 'user' else Message.get_by_id(target.parent_id) if target.parent_id else None
+    if not prompt or prompt.role != 'user':
+        return jsonify({"error": "This message has no user message to answer"}), 400
+    logger.info(f"[ROUTE_STREAM_Q] Regenerating reply to message {prompt.id}: conv={conversation_id}, model={model}")
+
+    from app.services.chat_service import start_stream
+    generation_id, _ = start_stream(app_instance, user_id_int, conversation_id, prompt.content, model,
+                                    bool(data.get('render_markdown')), started_at, reply_to=prompt.id)
+    return _generation_response(app_instance, generation_id)
+
+
+@chat_bp.route('/conversations/<int:conversation_id>/branch', methods=['PUT'])
+@jwt_required()
+def switch_branch(conversation_id):
+    """Show another branch. Body: {"message_id": ...}; the newest branch below that message becomes active."""
+    data = request.get_json(silent=True) or {}
+    message_id = data.get('message_id')
+    try:
+        user_id_int = int(get_jwt_identity())
+    except ValueError:
+        return jsonify({"error": "Invalid user identity"}), 401
+    if not isinstance(message_id, int) or isinstance(message_id, bool):
+        return jsonify({"error": "message_id required"}), 400
+    if Conversation.get_owner_id(conversation_id) != user_id_int:
+        return jsonify({"error": "Conversation not found or unauthorized"}), 404
+    leaf_id = Conversation.set_active_branch(conversation_id, message_id)
+    if leaf_id is None:
+        return jsonify({"error": "Message not found in this conversation"}), 400
+    logger.info(f"[BRANCH] conv={conversation_id} now shows the branch ending at message {leaf_id}")
+    conversation = Conversation.get_by_id(conversation_id, siblings=True)
+    return jsonify({"conversation": conversation.to_dict()}), 200
+
+
+def _parent_from_request(conversation_id, data):
+    """
+    (parent_id, error_response) from the optional `parent_id` key of a send:
+    absent continues the active branch, null starts a new first message,
+    otherwise an assistant message of the conversation to continue from.
+    """
+    if 'parent_id' not in data:
+        return Message.ACTIVE, None
+    parent_id = data['parent_id']
+    if parent_id is None:
+        return None, None
+    parent = Conversation.find_message(conversation_id, parent_id)
+    if not parent or parent.role != 'assistant':
+        return None, (jsonify({"error": "parent_id must be an assistant message of this conversation"}), 400)
+    return parent_id, None
+
+
+def _generation_response(app_instance, generation_id):
+    """SSE response relaying a just-started generation."""
+    broker = get_stream_broker(app_instance)
+    # First event goes out with the headers, before any upstream work has finished
+    started = f'data: {json.dumps({"started": True, "generation_id": generation_id})}\n\n'
+    # Tell proxies not to buffer, so the started event reaches the client immediately.
+    return Response(_sse_events(broker, generation_id, first=started), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no', 'X-Generation-Id': generation_id})
+
+
+@chat_bp.route('/conversations/<int:conversation_id>/stream', methods=['GET'])
+@jwt_required()
+def resume_stream(conversation_id):
+    """
+    Attach to a streamed reply, from this or any other worker: `generation`
+    (default: the conversation's reply in progress) and, to resume, the last
+    seen event id as `from` or the Last-Event-ID header.
+    """
+    try:
+        user_id_int = int(get_jwt_identity())
+        after = int(request.args.get('from') or request.headers.get('Last-Event-ID') or 0)
+    except ValueError:
+        return jsonify({"error": "Invalid user identity or event id"}), 400
+    if Conversation.get_owner_id(conversation_id) != user_id_int:
+        return jsonify({"error": "Conversation not found or unauthorized"}), 404
+    broker = get_stream_broker()
+    generation_id = request.args.get('generation') or broker.latest(conversation_id)
+    info = broker.info(generation_id) if generation_id else None
+    if not info or info['user_id'] != user_id_int or info['conversation_id'] != conversation_id:
+        return jsonify({"error": "No reply is being generated"}), 404
+    logger.info(f"[ROUTE_STREAM_Q] Resuming generation {generation_id} after event {after}")
+    return Response(_sse_events(broker, generation_id, after), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no', 'X-Generation-Id': generation_id})
+
+
+def _sse_events(broker, generation_id, after=0, first=None):
+    """Synchronous generator relaying a generation's events, each tagged with its id for resumes."""
+    items_yielded = 0
     try:
-        user_message = Message.create(conversation_id, 'user', content)
-        if not user_message: raise Exception("Message creation returned None")
-        logger.info(f"[ROUTE_STREAM_Q] User message saved: id={user_message.id}")
-    except Exception as db_err:
-         logger.error(f"[ROUTE_STREAM_Q] DB Error saving user msg: {db_err}", exc_info=True)
-         return jsonify({"error": "Failed to save user message"}), 500
-    # --- End Save ---
-
-    # Create the queue for this request to receive SSE formatted strings
-    result_queue = queue.Queue()
-
-    # Define the synchronous generator that reads from the queue
-    def queue_reader_generator():
-        """Synchronous generator yields items received from the queue."""
-        logger.info("[ROUTE_STREAM_Q] queue_reader_generator started.")
-        items_yielded = 0
-        try:
-            # Start the async service function in the background thread
-            logger.info("[ROUTE_STREAM_Q] Starting background thread for service...")
-            # Pass the actual app instance to the helper, followed by other args
-            run_async_in_thread(
-                _stream_response_async_to_queue, # Target async func in service
-                app_instance,                    # The app instance for context
-                conversation_id,                 # Original args for target...
-                content,
-                model,
-                result_queue                     # The queue
-            )
-            logger.info("[ROUTE_STREAM_Q] Background thread started.")
-
-            # Loop, getting items from the queue (blocks)
-            while True:
-                item = result_queue.get() # Wait for an item from the background thread
-                # logger.debug(f"[ROUTE_STREAM_Q] Queue reader got item: {item!r}")
-
-                # Check for the None sentinel to stop
-                if item is None:
-                    logger.info("[ROUTE_STREAM_Q] Queue reader received None sentinel, stopping.")
-                    break # Exit the while loop
-
-                # Yield the item (which is already an SSE formatted string from the service)
-                items_yielded += 1
-                # logger.debug(f"[ROUTE_STREAM_Q] Yielding item #{items_yielded}")
-                yield item # This yield goes to the Flask Response
-
-            logger.info(f"[ROUTE_STREAM_Q] queue_reader_generator finished after yielding {items_yielded} items.")
-        except Exception as e:
-            logger.error(f"[ROUTE_STREAM_Q] Error in queue_reader_generator: {e}", exc_info=True)
-            # Attempt to yield an error back
-            try:
-                 # Ensure error message is also SSE formatted
-                 error_payload = json.dumps({"error": f"Error reading stream: {e!s}"})
-                 yield f'data: {error_payload}\n\n'
-            except: pass # Ignore errors during error yield
-        finally:
-             logger.info("[ROUTE_STREAM_Q] queue_reader_generator finally block.")
-
-    # Return the Response object, passing the SYNCHRONOUS generator directly
-    logger.info("[ROUTE_STREAM_Q] Returning Response with sync queue reader generator.")
-    # No stream_with_context needed here as queue_reader_generator is sync
-    return Response(queue_reader_generator(), mimetype='text/event-stream')
\ No newline at end of file
+        if first:
+            yield first
+        for seq, item in broker.subscribe(generation_id, after):
+            items_yielded += 1
+            yield f'id: {seq}\n{item}' # Items are already SSE formatted by the service
+        logger.info(f"[ROUTE_STREAM_Q] Generation {generation_id} relayed, {items_yielded} items.")
+    except (KeyError, StreamTimeout) as e:
+        logger.warning(f"[ROUTE_STREAM_Q] Generation {generation_id} unavailable: {e!r}")
+        yield f'data: {json.dumps({"error": "The reply stream is no longer available"})}\n\n'
+    except Exception as e:
+        logger.error(f"[ROUTE_STREAM_Q] Error relaying generation {generation_id}: {e}", exc_info=True)
+        yield f'data: {json.dumps({"error": f"Error reading stream: {e!s}"})}\n\n'
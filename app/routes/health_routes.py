@@ -0,0 +1,27 @@
+# app/routes/health_routes.py
+from flask import Blueprint, jsonify
+
+from app.services.health import get_health_monitor
+
+health_bp = Blueprint('health', __name__)
+
+
+@health_bp.route('/health')
+@health_bp.route('/health/live')
+def liveness():
+    """Liveness: the process is up and serving requests. Checks nothing else."""
+    return {"status": "healthy"}, 200
+
+
+@health_bp.route('/health/ready')
+def readiness():
+    """Readiness: 200 if this worker can serve chats, else 503 (see app/services/health.py)."""
+    monitor = get_health_monitor()
+    monitor.start()
+    ready, body = monitor.report()
+    response = jsonify(body)
+    response.status_code = 200 if ready else 503
+    response.headers['Cache-Control'] = 'no-store'
+    if body['status'] in ('starting', 'overloaded'):
+        response.headers['Retry-After'] = '5'
+    return response
@@ -1,10 +1,17 @@
 # app/routes/model_routes.py
 from flask import Blueprint, jsonify, request
 from flask_jwt_extended import jwt_required, verify_jwt_in_request, get_jwt_identity
-from app.config.models import get_available_models
+from app.config.models import MODELS, get_available_models
+from app.utils.http_cache import make_etag, not_modified, with_etag
 
 model_bp = Blueprint('model', __name__)
 
+# MODELS is static: build the list and its tag once per process
+_MODELS_BODY = {
+    "models": [{"id": model_id, "display_name": display_name} for model_id, display_name in get_available_models()]
+}
+_MODELS_ETAG = make_etag('models', MODELS)
+
 @model_bp.route('/models', methods=['GET'])
 def get_models():
     """Get a list of all available models."""
@@ -15,7 +22,7 @@ def get_models():
         # If no valid JWT, still return models
         pass
     
-    models = get_available_models()
-    return jsonify({
-        "models": [{"id": model_id, "display_name": display_name} for model_id, display_name in models]
-    }), 200
\ No newline at end of file
+    cached = not_modified(_MODELS_ETAG, public=True)
+    if cached:
+        return cached
+    return with_etag((jsonify(_MODELS_BODY), 200), _MODELS_ETAG, public=True)
\ No newline at end of file
@@ -3,14 +3,14 @@ from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
 
 from app.models.user import User
+from app.utils.user_cache import load_current_user, invalidate_user
 
 user_bp = Blueprint('user', __name__)
 
 @user_bp.route('/profile', methods=['GET'])
 @jwt_required()
 def get_profile():
-    user_id = get_jwt_identity()
-    user = User.get_by_id(user_id)
+    user = load_current_user()
     
     if not user:
         return jsonify({"error": "User not found"}), 404
@@ -22,8 +22,7 @@ def get_profile():
 @user_bp.route('/profile', methods=['PUT'])
 @jwt_required()
 def update_profile():
-    user_id = get_jwt_identity()
-    user = User.get_by_id(user_id)
+    user = load_current_user()
     
     if not user:
         return jsonify({"error": "User not found"}), 404
@@ -31,6 +30,8 @@ def update_profile():
     data = request.get_json()
     
     # Implement profile update logic here
+    # Any change to the users row must drop the cached copy
+    invalidate_user(user.id)
     
     return jsonify({
         "message": "Profile updated successfully",
@@ -40,8 +41,7 @@ def update_profile():
 @user_bp.route('/me', methods=['GET'])
 @jwt_required()
 def get_current_user():
-    user_id = get_jwt_identity()
-    user = User.get_by_id(user_id)
+    user = load_current_user()
     
     if not user:
         return jsonify({"error": "User not found"}), 404
@@ -0,0 +1,243 @@
+# app/routes/ws_routes.py
+"""
+WebSocket transport for chat (optional; needs `flask-sock`).
+
+One connection per client session at /api/chat/ws carries any number of
+replies, for any of the user's conversations, as JSON messages. The JWT is
+checked once per connection (and again only when it expires) and
+conversation ownership is cached per connection for WS_OWNERSHIP_TTL seconds,
+instead of per POST /stream request.
+
+Client -> server (`ref` is an optional client id echoed in replies):
+    {"type": "auth", "token": "<jwt>"}                   first message; again after "token_expired"
+    {"type": "send", "ref": 1, "conversation_id": 3, "content": "...", "model": "...", "render_markdown": false}
+        (optional "parent_id": fork at that assistant message, or null for a new first message; see POST /stream)
+    {"type": "cancel", "generation_id": "..."}
+    {"type": "subscribe", "ref": 2, "conversation_id": 3, "generation_id": "...", "from": 0}
+    {"type": "ping"}
+Server -> client:
+    {"type": "ready", "user_id": 1}
+    {"type": "started", "ref", "conversation_id", "generation_id"}
+    {"type": "event", "ref", "conversation_id", "generation_id", "seq", "data": {"chunk": ...}}
+        (data is any event of the SSE stream: chunk, block, tool, error, cancelled)
+    {"type": "done", "ref", "conversation_id", "generation_id", "usage": {"day": {...}, "month": {...}}}
+    {"type": "title", "conversation_id", "title"}        when one of the conversations used on this connection
+                                                         is titled automatically (after its first reply)
+    {"type": "error", "ref", "error": "...", "code": "...", "retry_after": 3}
+    {"type": "pong"}
+"""
+import json
+import logging
+import threading
+import time
+
+from flask import current_app
+from flask_jwt_extended import decode_token
+
+from app.config.models import DEFAULT_MODEL
+from app.models.conversation import Conversation
+from app.models.message import Message
+from app.services.scheduler import SchedulerTimeout
+from app.services.stream_broker import StreamTimeout, get_stream_broker
+from app.services.title_service import add_title_listener, remove_title_listener
+from app.services.usage import get_usage_tracker
+from app.utils.metrics import metrics
+from app.utils.rate_limit import RateLimitExceeded
+
+try:
+    from flask_sock import Sock
+    from simple_websocket import ConnectionClosed
+except ImportError:  # Optional dependency
+    Sock = None
+
+logger = logging.getLogger(__name__)
+
+
+class ChatConnection:
+    """One client's WebSocket session."""
+
+    def __init__(self, ws, app):
+        self.ws = ws
+        self.app = app
+        self.user_id = None
+        self.expires_at = 0
+        self.ownership_ttl = app.config.get('WS_OWNERSHIP_TTL', 30.0)
+        self._owned = {}        # conversation_id -> monotonic time the ownership was checked
+        self._generations = {}  # generation_id -> future of generations started on this connection
+        self._send_lock = threading.Lock()
+        self.closed = False
+
+    def send(self, message):
+        """Send a JSON message (thread-safe); returns False once the connection is gone."""
+        if self.closed:
+            return False
+        try:
+            with self._send_lock:
+                self.ws.send(json.dumps(message))
+            return True
+        except Exception:  # ConnectionClosed or a broken socket
+            self.closed = True
+            return False
+
+    def serve(self):
+        """Handle messages until the client disconnects."""
+        auth_timeout = self.app.config.get('WS_AUTH_TIMEOUT', 10.0)
+        metrics.incr('ws.connections')
+        add_title_listener(self.app, self._on_title)
+        try:
+            while not self.closed:
+                raw = self.ws.receive(timeout=None if self.user_id else auth_timeout)
+                if raw is None:
+                    if self.user_id is None:
+                        self.send({'type': 'error', 'code': 'auth_timeout', 'error': 'Authentication required'})
+                        break
+                    continue
+                try:
+                    message = json.loads(raw)
+                    if not isinstance(message, dict):
+                        raise ValueError("message must be a JSON object")
+                except ValueError as e:
+                    self.send({'type': 'error', 'code': 'bad_request', 'error': f"Invalid message: {e}"})
+                    continue
+                self.handle(message)
+        except Exception as e:
+            if Sock is None or not isinstance(e, ConnectionClosed):
+                logger.error(f"[WS] Connection error: {e}", exc_info=True)
+        finally:
+            # Generations keep running (and are saved); the client can resubscribe from a new connection
+            self.closed = True
+            remove_title_listener(self.app, self._on_title)
+            logger.info(f"[WS] Connection closed: user={self.user_id}, generations={len(self._generations)}")
+
+    def handle(self, message):
+        kind = message.get('type')
+        ref = message.get('ref')
+        if kind == 'ping':
+            self.send({'type': 'pong'})
+            return
+        if kind == 'auth':
+            self._authenticate(message.get('token'), ref)
+            return
+        if self.user_id is None or time.time() >= self.expires_at:
+            self.send({'type': 'error', 'ref': ref, 'code': 'token_expired' if self.user_id else 'unauthenticated',
+                       'error': 'Authentication required'})
+            return
+        handler = {'send': self._send_message, 'cancel': self._cancel, 'subscribe': self._subscribe}.get(kind)
+        if handler is None:
+            self.send({'type': 'error', 'ref': ref, 'code': 'bad_request', 'error': f"Unknown message type {kind!r}"})
+            return
+        try:
+            handler(message, ref)
+        except RateLimitExceeded as e:  # Also QuotaExceeded
+            self.send({'type': 'error', 'ref': ref, 'code': 'rate_limited', 'error': str(e),
+                       'retry_after': e.retry_after})
+        except SchedulerTimeout:
+            self.send({'type': 'error', 'ref': ref, 'code': 'busy', 'error': 'The model is busy, please retry shortly'})
+        except KeyError as e:  # A required field is missing
+            self.send({'type': 'error', 'ref': ref, 'code': 'bad_request', 'error': f"Missing field {e}"})
+        except (TypeError, ValueError) as e:
+            self.send({'type': 'error', 'ref': ref, 'code': 'bad_request', 'error': str(e)})
+
+    def _authenticate(self, token, ref):
+        try:
+            claims = decode_token(token)
+            if claims.get('type') != 'access':  # Long-lived refresh tokens can't open a chat socket
+                raise ValueError(f"{claims.get('type')} token used for authentication")
+            user_id = int(claims[self.app.config.get('JWT_IDENTITY_CLAIM', 'sub')])
+        except Exception as e:
+            logger.warning(f"[WS] Authentication failed: {e}")
+            self.send({'type': 'error', 'ref': ref, 'code': 'unauthenticated', 'error': 'Invalid or expired token'})
+            return
+        if self.user_id is not None and user_id != self.user_id:
+            self.send({'type': 'error', 'ref': ref, 'code': 'bad_request', 'error': 'A connection serves one user'})
+            return
+        self.user_id = user_id
+        self.expires_at = claims.get('exp', float('inf'))
+        self.send({'type': 'ready', 'ref': ref, 'user_id': user_id})
+
+    def _on_title(self, conversation_id, title):
+        # Called from the thread that stored the title; only conversations this user used here
+        if self.user_id is not None and conversation_id in self._owned:
+            self.send({'type': 'title', 'conversation_id': conversation_id, 'title': title})
+
+    def _owns(self, conversation_id):
+        checked = self._owned.get(conversation_id)
+        if checked is not None and time.monotonic() - checked < self.ownership_ttl:
+            return True
+        if Conversation.get_owner_id(conversation_id) != self.user_id:
+            self._owned.pop(conversation_id, None)
+            return False
+        self._owned[conversation_id] = time.monotonic()
+        return True
+
+    def _send_message(self, message, ref):
+        started_at = time.monotonic()
+        conversation_id = int(message['conversation_id'])
+        content = message.get('content')
+        if not content:
+            raise ValueError("Message content is required")
+        if not self._owns(conversation_id):
+            self.send({'type': 'error', 'ref': ref, 'code': 'not_found', 'error': 'Conversation not found or unauthorized'})
+            return
+        parent_id = message.get('parent_id', Message.ACTIVE)
+        if parent_id not in (Message.ACTIVE, None):
+            parent = Conversation.find_message(conversation_id, parent_id)
+            if not parent or parent.role != 'assistant':
+                raise ValueError("parent_id must be an assistant message of this conversation")
+        from app.services.chat_service import start_stream  # Imported on first chat use
+        generation_id, future = start_stream(self.app, self.user_id, conversation_id, content,
+                                             message.get('model') or DEFAULT_MODEL,
+                                             bool(message.get('render_markdown')), started_at, parent_id=parent_id)
+        self._generations[generation_id] = future
+        future.add_done_callback(lambda _: self._generations.pop(generation_id, None))
+        self.send({'type': 'started', 'ref': ref, 'conversation_id': conversation_id, 'generation_id': generation_id})
+        self._relay(ref, conversation_id, generation_id)
+        metrics.incr('ws.messages')
+
+    def _cancel(self, message, ref):
+        future = self._generations.get(message.get('generation_id'))
+        if future is None:
+            self.send({'type': 'error', 'ref': ref, 'code': 'not_found', 'error': 'No such running generation'})
+            return
+        future.cancel()  # The reply ends with a {"cancelled": true} event
+
+    def _subscribe(self, message, ref):
+        conversation_id = int(message['conversation_id'])
+        broker = get_stream_broker(self.app)
+        generation_id = message.get('generation_id') or broker.latest(conversation_id)
+        info = broker.info(generation_id) if generation_id else None
+        if not self._owns(conversation_id) or not info or info['user_id'] != self.user_id \
+                or info['conversation_id'] != conversation_id:
+            self.send({'type': 'error', 'ref': ref, 'code': 'not_found', 'error': 'No reply is being generated'})
+            return
+        self._relay(ref, conversation_id, generation_id, int(message.get('from') or 0))
+
+    def _relay(self, ref, conversation_id, generation_id, after=0):
+        """Forward a generation's events to this connection from a background thread."""
+        def relay():
+            header = {'ref': ref, 'conversation_id': conversation_id, 'generation_id': generation_id}
+            try:
+                for seq, item in get_stream_broker(self.app).subscribe(generation_id, after):
+                    # Items are SSE formatted ("data: {...}\n\n") for the HTTP transport
+                    if not self.send({'type': 'event', **header, 'seq': seq, 'data': json.loads(item[len('data:'):])}):
+                        return  # Disconnected; the generation carries on
+            except (KeyError, StreamTimeout):
+                self.send({'type': 'error', **header, 'code': 'gone', 'error': 'The reply stream is no longer available'})
+                return
+            with self.app.app_context():
+                usage = get_usage_tracker(self.app).remaining(self.user_id)  # Quotas are None when unset
+            self.send({'type': 'done', **header, 'usage': usage})
+
+        threading.Thread(target=relay, name=f'ws-relay-{generation_id[:8]}', daemon=True).start()
+
+
+def init_app(app):
+    """Register the /api/chat/ws endpoint if flask-sock is installed."""
+    if Sock is None:
+        logger.info("[WS] flask-sock is not installed; the WebSocket transport is disabled")
+        return
+    sock = Sock(app)
+
+    @sock.route('/api/chat/ws')
+    def chat_socket(ws):
+        ChatConnection(ws, current_app._get_current_object()).serve()
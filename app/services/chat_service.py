@@ -1,5 +1,6 @@
 # app/services/chat_service.py
 import asyncio
+import dataclasses
 from typing import Dict, List, Any, AsyncGenerator
 
 # Import specific types mentioned in docs if needed elsewhere, maybe not here
@@ -7,11 +8,13 @@ from typing import Dict, List, Any, AsyncGenerator
 
 # Import necessary components from the agents library
 # Ensure correct types for hints if desired
-from agents import Agent, Runner, OpenAIChatCompletionsModel, RunResultStreaming, StreamEvent
+from agents import Agent, Runner, OpenAIChatCompletionsModel, RunResultStreaming, StreamEvent, ModelSettings
 
-# REMOVE flask import if not needed elsewhere after change
-# from flask import current_app
+from flask import current_app
+import functools
+import inspect
 import logging
+import time
 import traceback
 import json
 import queue      # For type hinting the queue parameter
@@ -19,14 +22,109 @@ import queue      # For type hinting the queue parameter
 
 from app.models.conversation import Conversation
 from app.models.message import Message
-from app.config.models import get_model_config, DEFAULT_MODEL
+from app.config.models import MODELS, get_model_config, DEFAULT_MODEL, supports_prompt_cache_key
+from app.services.scheduler import get_scheduler, SchedulerTimeout
+from app.services.stream_broker import get_stream_broker
+from app.services.jobs import enqueue
+from app.services.title_service import needs_title, title_after_stream
+from app.services.upstream import get_upstream
+from app.services.usage import check_quota, get_usage_tracker
+from app.tools.context import ToolContext
+from app.tools.runtime import guard_tool, sse_emitter
+from app.tools.sandbox import get_shell_sandbox
+from app.tools.shell_tool import execute_shell_command
+from app.utils import markdown_render
+from app.utils.metrics import metrics
+from app.utils.rate_limit import admit_generation
 from load_client import load_client, isClientLoaded, get_client
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# --- Prompt layout (prefix-stable for provider prompt caching) ---
+@functools.lru_cache(maxsize=None)
+def stable_instructions(model_name):
+    """The model's system prompt, normalized once so it is byte-identical on every request."""
+    return inspect.cleandoc(get_model_config(model_name)["instructions"])
+
+
+def build_agent_input(history, user_message):
+    """
+    Build the model input as an append-only transcript of stored messages.
+    Each turn renders earlier turns exactly as before (same roles, content and
+    order, nothing per-request such as timestamps or ids), so the prompt for
+    turn N is a byte-identical prefix of turn N+1 and provider prompt caches hit.
+    """
+    items = [
+        {"role": "assistant" if msg.role == "assistant" else "user", "content": msg.content}
+        for msg in history
+    ]
+    # The routes save the user message before generating; don't send it twice
+    if not (history and history[-1].role == "user" and history[-1].content == user_message):
+        items.append({"role": "user", "content": user_message})
+    return items
+
+
+def model_settings(model_name, conversation_id=None):
+    """Per-request settings: usage reporting, plus a cache-routing hint for models that support it."""
+    extra_body = None
+    if conversation_id is not None and supports_prompt_cache_key(model_name):
+        # OpenAI-compatible providers route requests with the same key to the same prompt cache
+        extra_body = {"prompt_cache_key": f"conversation-{conversation_id}"}
+    return ModelSettings(include_usage=True, extra_body=extra_body)
+
+
+def record_usage(usage, model, app_instance=None, user_id=None, conversation_id=None, latency=None, streaming=False):
+    """
+    Record token usage (including prompt-cache hits) from an agent run in
+    metrics and, when `app_instance` is given, in the usage table (counted
+    against the user's quota). `latency` is the request's duration in seconds.
+    """
+    if usage is None or not usage.input_tokens:
+        return
+    details = getattr(usage, 'input_tokens_details', None)
+    cached = (getattr(details, 'cached_tokens', 0) or 0) if details is not None else 0
+    if app_instance is not None:
+        get_usage_tracker(app_instance).record(
+            user_id, model, usage.input_tokens, usage.output_tokens, cached_tokens=cached,
+            latency_ms=None if latency is None else latency * 1000,
+            conversation_id=conversation_id, streaming=streaming,
+        )
+    metrics.incr('llm.input_tokens', usage.input_tokens)
+    metrics.incr('llm.cached_input_tokens', cached)
+    metrics.incr('llm.output_tokens', usage.output_tokens)
+    metrics.incr(f'llm.cached_input_tokens.{model}', cached)
+    metrics.observe('llm.prompt_cache_hit_ratio', cached / usage.input_tokens)
+    logger.info(f"[SERVICE_USAGE] model={model} input={usage.input_tokens} cached={cached} output={usage.output_tokens}")
+
+
+def agent_tools(app_instance=None):
+    """
+    Tools enabled for agents of this app (the sandboxed shell tool with
+    SHELL_TOOL_ENABLED), each wrapped with per-call timeouts and progress events.
+    """
+    if app_instance is None:
+        return []
+    tools = []
+    if app_instance.config.get('SHELL_TOOL_ENABLED', False):
+        get_shell_sandbox(app_instance).start()  # Pre-spawns the worker pool (once per process)
+        tools.append(execute_shell_command)
+    call_timeout = app_instance.config.get('TOOL_CALL_TIMEOUT', 30.0)
+    return [guard_tool(tool, call_timeout) for tool in tools]
+
+
+def tool_context(app_instance, user_id=None, conversation_id=None, emit=None):
+    """Run context for an agent run: caller identity plus the per-turn tool limits."""
+    config = app_instance.config if app_instance is not None else {}
+    return ToolContext(
+        app_instance, user_id, conversation_id, emit=emit,
+        tool_budget=config.get('TOOL_TURN_BUDGET', 60.0),
+        max_parallel=config.get('TOOL_MAX_PARALLEL', 4),
+    )
+
+
 # --- EXISTING get_agent function (No changes needed from your last version) ---
-def get_agent(model_name=DEFAULT_MODEL):
+def get_agent(model_name=DEFAULT_MODEL, settings=None, tools=None):
     """Get or create an agent with the shell tool using configuration from models.py"""
     logger.info(f"[SERVICE_AGENT] Creating agent with model: {model_name}")
 
@@ -48,17 +146,23 @@ def get_agent(model_name=DEFAULT_MODEL):
     model_config = get_model_config(model_name)
     logger.info(f"[SERVICE_AGENT] Got model config: {model_config}")
 
+    settings = settings or ModelSettings()
+    if tools:
+        # Let the model request several tool calls per step; the SDK runs them concurrently
+        settings = dataclasses.replace(settings, parallel_tool_calls=True)
+
     # Create a general assistant agent with shell capabilities
     try:
         # Ensure OpenAIChatCompletionsModel is imported if used here
         agent = Agent(
             name="Assistant",
-            instructions=model_config["instructions"],
+            instructions=stable_instructions(model_name if model_name in MODELS else DEFAULT_MODEL),
             model=OpenAIChatCompletionsModel(
                 model=model_name,
                 openai_client=client # Pass the verified client instance
             ),
-            # tools=[execute_shell_command] # Keep commented out if not needed
+            model_settings=settings,
+            tools=tools or [], # See agent_tools()
         )
         logger.info(f"[SERVICE_AGENT] Agent created successfully")
         return agent
@@ -68,43 +172,55 @@ def get_agent(model_name=DEFAULT_MODEL):
         raise
 
 # --- EXISTING generate_response_async (non-streaming) function (No changes needed) ---
-async def generate_response_async(conversation_id: int, user_message: str, model=DEFAULT_MODEL) -> str:
-    """Generate a response using the Agents SDK (non-streaming)."""
+async def generate_response_async(conversation_id: int, user_message: str, model=DEFAULT_MODEL, user_id=None, app_instance=None) -> str:
+    """Generate a response using the Agents SDK (non-streaming).
+    When `app_instance` is given, the upstream call waits for a slot from its scheduler."""
     logger.info(f"[SERVICE_NONSTREAM] START: conv={conversation_id}, model={model}")
+    started_at = time.monotonic()
     try:
-        # Fetch conversation history
-        conversation = Conversation.get_by_id(conversation_id)
+        # Fetch conversation history (off the event loop when running on the shared upstream loop)
+        if app_instance is not None:
+            conversation = await get_upstream(app_instance).run_blocking(_load_conversation, app_instance, conversation_id)
+        else:
+            conversation = Conversation.get_by_id(conversation_id)
         if not conversation:
             logger.error(f"[SERVICE_NONSTREAM] Conversation {conversation_id} not found")
             raise ValueError(f"Conversation {conversation_id} not found")
 
         logger.info(f"[SERVICE_NONSTREAM] Found conversation with {len(conversation.messages)} messages")
 
-        # Format history for the agent
-        message_history = []
-        for msg in conversation.messages:
-            role = "assistant" if msg.role == "assistant" else "user"
-            message_history.append({"role": role, "content": msg.content})
-        message_history.append({"role": "user", "content": user_message})
+        # Format history for the agent (prefix-stable layout)
+        message_history = build_agent_input(conversation.messages, user_message)
         logger.info(f"[SERVICE_NONSTREAM] Prepared history with {len(message_history)} messages")
 
         # Get the agent
         logger.info(f"[SERVICE_NONSTREAM] Getting agent for model: {model}")
-        agent = get_agent(model)
+        agent = get_agent(model, model_settings(model, conversation_id), agent_tools(app_instance))
+        context = tool_context(app_instance, user_id, conversation_id)
 
-        # Run the agent
+        # Run the agent (non-streaming requests get priority in the scheduler queue)
         logger.info(f"[SERVICE_NONSTREAM] Running agent with history via 'input'")
         # Ensure 'input' is correct argument for non-streaming history if needed
-        result = await Runner.run(
-            agent,
-            input=message_history
-        )
+        if app_instance is not None:
+            async with get_scheduler(app_instance).slot(user_id, streaming=False):
+                result = await Runner.run(agent, input=message_history, context=context)
+        else:
+            result = await Runner.run(
+                agent,
+                input=message_history,
+                context=context
+            )
+
+        record_usage(result.context_wrapper.usage, model, app_instance, user_id, conversation_id,
+                     time.monotonic() - started_at)
 
         # Extract and return the final output
         final_output = result.final_output if hasattr(result, 'final_output') else str(result)
         logger.info(f"[SERVICE_NONSTREAM] Agent run completed, output length: {len(final_output) if final_output else 0}")
         return final_output
 
+    except SchedulerTimeout:
+        raise # Let the route answer 503 instead of storing an error as the reply
     except Exception as e:
         logger.error(f"[SERVICE_NONSTREAM] Error: {str(e)}")
         logger.error(traceback.format_exc())
@@ -114,69 +230,162 @@ async def generate_response_async(conversation_id: int, user_message: str, model
         logger.info(f"[SERVICE_NONSTREAM] END: conv={conversation_id}, model={model}")
 
 
+def _load_conversation(app_instance, conversation_id, leaf_id=Message.ACTIVE):
+    """Blocking DB read for coroutines on the shared upstream loop (use via run_blocking)."""
+    with app_instance.app_context():
+        return Conversation.get_by_id(conversation_id, leaf_id)
+
+
+def _save_user_message(app_instance, conversation_id, content, parent_id=Message.ACTIVE):
+    """Blocking DB write for coroutines on the shared upstream loop (use via run_blocking)."""
+    with app_instance.app_context():
+        message = Message.create(conversation_id, 'user', content, parent_id, active_if=Message.ALWAYS)
+        if not message: raise Exception("Message creation returned None")
+        return message
+
+
+def _save_assistant_message(app_instance, conversation_id, content, parent_id, active_if=Message.PARENT):
+    """Blocking DB write for coroutines on the shared upstream loop (use via run_blocking)."""
+    with app_instance.app_context():
+        if Conversation.get_owner_id(conversation_id) is None:
+            logger.warning(f"[SERVICE_STREAM_QUEUE] Conversation {conversation_id} is gone, dropping assistant message")
+            return None
+        message = Message.create(conversation_id, 'assistant', content, parent_id, active_if)
+        if markdown_render.enabled(app_instance):
+            enqueue('messages.cache_html', {'message_id': message.id}, app=app_instance)  # Off the reply's path
+        return message
+
+
+def _load_message(app_instance, message_id):
+    """Blocking DB read for coroutines on the shared upstream loop (use via run_blocking)."""
+    with app_instance.app_context():
+        message = Message.get_by_id(message_id)
+        if not message: raise Exception(f"Message {message_id} not found")
+        return message
+
+
 # --- MODIFIED STREAMING FUNCTION (Accepts app_instance, puts to queue) ---
-# Renamed with leading underscore convention for internal use by threaded helper
-async def _stream_response_async_to_queue(app_instance, conversation_id: int, user_message: str, model: str, result_queue: queue.Queue): # Added app_instance parameter FIRST
+# Renamed with leading underscore convention for internal use by the shared upstream loop
+async def _stream_response_async_to_queue(app_instance, conversation_id: int, user_message: str, model: str, result_queue: queue.Queue, user_id=None, started_at=None, render_markdown=False,
+                                          parent_id=Message.ACTIVE, reply_to=None): # Added app_instance parameter FIRST
     """
     Generate response using Agents SDK, stream SSE formatted chunks into a queue.
     Handles application context (passed in) for database operations.
+    `result_queue` is anything with a queue's `put` (the routes pass a stream
+    broker publisher, see app/services/stream_broker.py); None ends the stream.
+
+    Runs on the shared upstream loop. The user message is written concurrently
+    with the upstream call rather than before it, and time-to-first-token is
+    recorded per phase (`started_at` is the route's monotonic start time).
+    On the first exchange the conversation is titled after the stream has ended.
+    With `render_markdown`, rendered HTML blocks are sent as {"block": ...} events
+    next to the raw chunks (see app/utils/markdown_render.py).
+
+    The user message is added under `parent_id` (default: the active leaf) and
+    the history is the branch it continues. To regenerate, pass `reply_to`,
+    the id of an existing user message: nothing new is saved and the reply
+    becomes another version under it.
     """
     logger.info(f"[SERVICE_STREAM_QUEUE] START: conv={conversation_id}, model={model}")
+    upstream = get_upstream(app_instance)
+    started_at = started_at or time.monotonic()
+    phases = {}
+    mark = time.monotonic()
     full_ai_response = ""
     event_count = 0
     put_chunks_count = 0
     stream_task_completed_normally = False
-    # REMOVED: app_instance = current_app._get_current_object() # Cannot get context here
+    auto_title = False
+    user_saved = None
+    shown_leaf = Message.PARENT  # The reply is shown if the user still looks at the branch it continues
+    renderer = None
+    if render_markdown and markdown_render.enabled(app_instance):
+        renderer = markdown_render.IncrementalRenderer(app_instance.config.get('MARKDOWN_RENDER_INTERVAL', 0.1))
+
+    if reply_to is None:
+        # Save the user message in parallel with everything below; awaited before the reply is saved
+        save_task = asyncio.ensure_future(upstream.run_blocking(
+            _save_user_message, app_instance, conversation_id, user_message, parent_id))
+        leaf_id = parent_id
+    else:
+        # Regenerating: the user message is already stored and ends the history
+        save_task = asyncio.ensure_future(upstream.run_blocking(_load_message, app_instance, reply_to))
+        leaf_id = reply_to
 
     try:
-        # Prepare input
-        current_input = user_message
-        # IMPORTANT: If get_agent needs app_context, it must be called within a context block here too!
-        # This might mean wrapping the agent = get_agent(model) call below in app_instance.app_context()
-        # if get_agent relies on current_app internally. For now, assuming it doesn't.
+        # Prepare input: the branch's history in the same prefix-stable layout as the non-streaming path.
+        # The concurrent save may or may not be visible yet; build_agent_input copes with both.
+        conversation = await upstream.run_blocking(_load_conversation, app_instance, conversation_id, leaf_id)
+        history = conversation.messages if conversation else []
+        if reply_to is not None and conversation is not None:
+            shown_leaf = conversation.active_message_id  # The version being replaced, or wherever the user is
+        auto_title = conversation is not None and needs_title(conversation.title, history, app_instance)
+        current_input = build_agent_input(history, user_message)
         logger.info(f"[SERVICE_STREAM_QUEUE] Getting agent for model: {model}")
-        agent = get_agent(model) # Ensure get_agent is defined correctly above
-
-        # Use Runner.run_streamed()
-        logger.info(f"[SERVICE_STREAM_QUEUE] Calling Runner.run_streamed...")
-        # Add history here if needed by your agent: chat_history=[...]
-        stream_result: RunResultStreaming = Runner.run_streamed(
-            agent,
-            input=current_input
-        )
-        logger.info(f"[SERVICE_STREAM_QUEUE] Runner.run_streamed returned type: {type(stream_result)}")
-
-        # Iterate through the stream events
-        logger.info(f"[SERVICE_STREAM_QUEUE] Iterating stream events...")
-        async for event in stream_result.stream_events():
-            event_count += 1
-            # (Keep detailed logging from previous version if desired)
-            logger.debug(f"[SERVICE_STREAM_QUEUE] Event #{event_count}: Type={event.type}")
-
-            sse_data_payload = None
-            delta_content = None
-
-            # --- Corrected Extraction Logic ---
-            if event.type == "raw_response_event" and hasattr(event, 'data'):
-                if hasattr(event.data, 'delta'):
-                    delta_content = event.data.delta
-                    if delta_content:
-                         delta_content = str(delta_content)
-                         put_chunks_count += 1
-                         full_ai_response += delta_content
-                         sse_data_payload = {"chunk": delta_content}
-
-            # Put data into queue only if we extracted a chunk
-            if sse_data_payload:
-                sse_string = f"data: {json.dumps(sse_data_payload)}\n\n"
-                logger.debug(f"[SERVICE_STREAM_QUEUE] Putting chunk #{put_chunks_count} into queue.")
-                result_queue.put(sse_string)
-            # else: logger.debug(f"[SERVICE_STREAM_QUEUE] No SSE payload generated for event type {event.type}")
+        agent = get_agent(model, model_settings(model, conversation_id), agent_tools(app_instance))
+        phases['prepare'] = time.monotonic() - mark
+
+        # Hold an upstream slot for the whole stream; waits fairly if at capacity
+        mark = time.monotonic()
+        async with get_scheduler(app_instance).slot(user_id, streaming=True):
+            phases['queue'] = time.monotonic() - mark
+            mark = time.monotonic()
+            # Use Runner.run_streamed()
+            logger.info(f"[SERVICE_STREAM_QUEUE] Calling Runner.run_streamed...")
+            stream_result: RunResultStreaming = Runner.run_streamed(
+                agent,
+                input=current_input,
+                context=tool_context(app_instance, user_id, conversation_id, sse_emitter(result_queue))
+            )
+            logger.info(f"[SERVICE_STREAM_QUEUE] Runner.run_streamed returned type: {type(stream_result)}")
+
+            # Iterate through the stream events
+            logger.info(f"[SERVICE_STREAM_QUEUE] Iterating stream events...")
+            async for event in stream_result.stream_events():
+                event_count += 1
+                # (Keep detailed logging from previous version if desired)
+                logger.debug(f"[SERVICE_STREAM_QUEUE] Event #{event_count}: Type={event.type}")
+
+                sse_data_payload = None
+                delta_content = None
+
+                # --- Corrected Extraction Logic ---
+                if event.type == "raw_response_event" and hasattr(event, 'data'):
+                    if hasattr(event.data, 'delta'):
+                        delta_content = event.data.delta
+                        if delta_content:
+                             delta_content = str(delta_content)
+                             put_chunks_count += 1
+                             full_ai_response += delta_content
+                             sse_data_payload = {"chunk": delta_content}
+
+                # Put data into queue only if we extracted a chunk
+                if sse_data_payload:
+                    if put_chunks_count == 1:
+                        phases['upstream'] = time.monotonic() - mark
+                        _record_ttft(phases, time.monotonic() - started_at, conversation_id)
+                    sse_string = f"data: {json.dumps(sse_data_payload)}\n\n"
+                    logger.debug(f"[SERVICE_STREAM_QUEUE] Putting chunk #{put_chunks_count} into queue.")
+                    result_queue.put(sse_string)
+                    if renderer:
+                        for block in renderer.feed(delta_content):
+                            result_queue.put(f"data: {json.dumps({'block': block})}\n\n")
+                # else: logger.debug(f"[SERVICE_STREAM_QUEUE] No SSE payload generated for event type {event.type}")
 
         # If the loop completes without errors
         stream_task_completed_normally = True
+        if renderer:
+            for block in renderer.finish():
+                result_queue.put(f"data: {json.dumps({'block': block})}\n\n")
+        record_usage(stream_result.context_wrapper.usage, model, app_instance, user_id, conversation_id,
+                     time.monotonic() - started_at, streaming=True)
         logger.info(f"[SERVICE_STREAM_QUEUE] Finished iterating events normally. Total: {event_count}, Put Chunks: {put_chunks_count}.")
 
+    except asyncio.CancelledError:
+        logger.info(f"[SERVICE_STREAM_QUEUE] Generation cancelled: conv={conversation_id}")
+        result_queue.put(f'data: {json.dumps({"cancelled": True})}\n\n')
+        raise
+
     except Exception as e:
         logger.error(f"[SERVICE_STREAM_QUEUE] Error during agent run/streaming: {str(e)}")
         logger.error(traceback.format_exc())
@@ -187,24 +396,28 @@ async def _stream_response_async_to_queue(app_instance, conversation_id: int, us
 
     finally:
         logger.info(f"[SERVICE_STREAM_QUEUE] Finally block. Full response length: {len(full_ai_response)}")
-        # Save the accumulated AI response *only if* the stream completed normally and we got content
-        if stream_task_completed_normally and full_ai_response:
-             # --- Use the passed app_instance to create context ---
-             with app_instance.app_context():
-                  logger.info(f"[SERVICE_STREAM_QUEUE] App context pushed for DB save.")
-                  try:
-                      logger.info(f"[SERVICE_STREAM_QUEUE] Saving full AI response ({len(full_ai_response)} chars) to DB...")
-                      # Ensure Message.create is defined and works within context
-                      ai_message = Message.create(conversation_id, 'assistant', full_ai_response)
-                      if not ai_message: raise Exception("AI Message creation returned None")
-                      logger.info(f"[SERVICE_STREAM_QUEUE] Full AI response saved: id={ai_message.id}")
-                  except Exception as db_save_err:
-                      logger.error(f"[SERVICE_STREAM_QUEUE] Failed to save full AI response (within context): {db_save_err}", exc_info=True)
-                      # Put DB save error into queue AFTER trying to save
-                      err_save_sse = f'data: {json.dumps({"error": f"Failed to save full response: {db_save_err!s}"})}\n\n'
-                      result_queue.put(err_save_sse)
-             # --- Context is automatically popped when 'with' block exits ---
-             logger.info(f"[SERVICE_STREAM_QUEUE] App context popped after DB save attempt.")
+        # The reply must be stored after the user message, so wait for that write first
+        try:
+            user_saved = await save_task
+            logger.info(f"[SERVICE_STREAM_QUEUE] User message saved: id={user_saved.id}")
+        except Exception as db_err:
+            logger.error(f"[SERVICE_STREAM_QUEUE] DB Error saving user msg: {db_err}", exc_info=True)
+            result_queue.put(f'data: {json.dumps({"error": "Failed to save user message"})}\n\n')
+
+        # Save the accumulated AI response *only if* the stream completed normally and we got content.
+        # Written before the stream ends so a reload or the next turn sees it; only HTML caching is deferred.
+        if user_saved and stream_task_completed_normally and full_ai_response:
+             try:
+                 ai_saved = await upstream.run_blocking(
+                     _save_assistant_message, app_instance, conversation_id, full_ai_response, user_saved.id, shown_leaf)
+                 if ai_saved:
+                     logger.info(f"[SERVICE_STREAM_QUEUE] AI response saved: id={ai_saved.id} ({len(full_ai_response)} chars).")
+             except Exception as db_save_err:
+                 logger.error(f"[SERVICE_STREAM_QUEUE] DB Error saving AI response: {db_save_err}", exc_info=True)
+                 err_save_sse = f'data: {json.dumps({"error": f"Failed to save full response: {db_save_err!s}"})}\n\n'
+                 result_queue.put(err_save_sse)
+        elif stream_task_completed_normally and full_ai_response:
+             logger.warning("[SERVICE_STREAM_QUEUE] User message was not saved, skipping DB save of the reply.")
         elif stream_task_completed_normally:
              logger.warning("[SERVICE_STREAM_QUEUE] Stream completed normally but no AI response content generated/accumulated.")
         else:
@@ -213,18 +426,70 @@ async def _stream_response_async_to_queue(app_instance, conversation_id: int, us
         # Signal the end of generation by putting None in the queue
         logger.info("[SERVICE_STREAM_QUEUE] Putting None sentinel into queue.")
         result_queue.put(None)
+
+        # Title the conversation only now, in its own task, so it never delays the reply or holds its lease
+        if auto_title and user_saved and stream_task_completed_normally and full_ai_response:
+             title_after_stream(app_instance, conversation_id, user_message, full_ai_response)
         logger.info("[SERVICE_STREAM_QUEUE] END")
 
 
+def start_stream(app_instance, user_id, conversation_id, content, model, render_markdown=False, started_at=None,
+                 parent_id=Message.ACTIVE, reply_to=None):
+    """
+    Admit and start a streamed reply (the caller has checked ownership, and
+    that `parent_id` / `reply_to` belong to the conversation).
+    Raises QuotaExceeded / RateLimitExceeded before anything is written.
+    Returns (generation_id, future): subscribe to the generation with the
+    stream broker; cancelling the future stops the generation.
+    """
+    check_quota(user_id)
+    lease = admit_generation(user_id, model)  # Held until the generation finishes
+    handed_off = False
+    try:
+        broker = get_stream_broker(app_instance)
+        generation_id = broker.register(user_id, conversation_id)
+        logger.info(f"[SERVICE_STREAM_QUEUE] Starting generation {generation_id}: conv={conversation_id}, model={model}")
+        try:
+            future = get_upstream(app_instance).submit(_stream_response_async_to_queue(
+                app_instance, conversation_id, content, model, broker.publisher(generation_id),
+                user_id,     # For fair scheduling
+                started_at,  # For time-to-first-token metrics
+                render_markdown,
+                parent_id, reply_to,
+            ))
+        except BaseException:
+            broker.close(generation_id)
+            raise
+        future.add_done_callback(lambda _: lease.release())  # Free the stream slot when generation ends
+        handed_off = True
+    finally:
+        if not handed_off:
+            lease.release()  # Nothing was started, so no callback will release it
+    return generation_id, future
+
+
+def _record_ttft(phases, total, conversation_id):
+    """Record time-to-first-token and its phases (route/admission, prepare, queue, upstream)."""
+    phases['route'] = max(0.0, total - sum(phases.values()))
+    metrics.observe('stream.ttft_seconds', total)
+    for phase, seconds in phases.items():
+        metrics.observe(f'stream.ttft_phase_seconds.{phase}', seconds)
+    logger.info(f"[SERVICE_STREAM_QUEUE] TTFT {total * 1000:.0f}ms for conv={conversation_id} "
+                + ' '.join(f"{phase}={seconds * 1000:.0f}ms" for phase, seconds in phases.items()))
+
+
 # --- EXISTING generate_response (sync wrapper for non-streaming) function (No changes needed) ---
-def generate_response(conversation_id: int, user_message: str, model=DEFAULT_MODEL) -> str:
+def generate_response(conversation_id: int, user_message: str, model=DEFAULT_MODEL, user_id=None) -> str:
     """Synchronous wrapper for the async non-streaming response generator."""
     logger.info(f"[SERVICE_SYNC_WRAP] START: conv={conversation_id}, model={model}")
+    app_instance = current_app._get_current_object()
     try:
-        # Uses asyncio.run to call the non-streaming async function
-        response = asyncio.run(generate_response_async(conversation_id, user_message, model))
+        # Runs on the shared upstream loop so the gateway connection pool stays warm
+        response = get_upstream(app_instance).run(generate_response_async(conversation_id, user_message, model, user_id, app_instance))
         logger.info(f"[SERVICE_SYNC_WRAP] Response received, length: {len(response) if response else 0}")
         return response
+    except SchedulerTimeout:
+        raise
     except Exception as e:
         logger.error(f"[SERVICE_SYNC_WRAP] Error: {str(e)}")
         logger.error(traceback.format_exc())
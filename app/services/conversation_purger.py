@@ -0,0 +1,94 @@
+# app/services/conversation_purger.py
+"""
+Background removal of soft-deleted conversations.
+
+Deleting a conversation only sets `conversations.deleted_at`; the rows are
+removed afterwards by a background job, `chunk_size` rows per transaction
+with a short pause in between, so purging a large history never holds the
+writer lock for long.
+"""
+import logging
+import time
+
+import click
+from flask import current_app
+
+from app.services.jobs import job, enqueue
+from app.utils.db import get_db
+
+logger = logging.getLogger(__name__)
+
+
+def purge_deleted_conversations(chunk_size=500, pause=0.05):
+    """Remove soft-deleted conversations and their messages in chunks. Returns (conversations, messages) removed."""
+    db = get_db()
+    removed_messages = removed_conversations = 0
+
+    # Messages first, so the final cascading delete of each conversation is small
+    while True:
+        cursor = db.execute(
+            'DELETE FROM messages WHERE id IN ('
+            ' SELECT m.id FROM messages m JOIN conversations c ON c.id = m.conversation_id'
+            ' WHERE c.deleted_at IS NOT NULL LIMIT ?)',
+            (chunk_size,)
+        )
+        db.commit()
+        if cursor.rowcount <= 0:
+            break
+        removed_messages += cursor.rowcount
+        time.sleep(pause)
+
+    while True:
+        rows = db.execute(
+            'SELECT id, archived_at FROM conversations WHERE deleted_at IS NOT NULL ORDER BY id LIMIT ?',
+            (chunk_size,)
+        ).fetchall()
+        if not rows:
+            break
+        ids = [row['id'] for row in rows]
+        archived = [row['id'] for row in rows if row['archived_at']]
+        if archived:
+            from app.utils.archive import attach_archive
+            attach_archive(db)
+        try:
+            if archived:
+                db.execute(
+                    f'DELETE FROM archive.archived_conversations '
+                    f'WHERE conversation_id IN ({", ".join("?" * len(archived))})', archived
+                )
+            # Cascades to any message written after the first pass
+            db.execute(f'DELETE FROM conversations WHERE id IN ({", ".join("?" * len(ids))})', ids)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        removed_conversations += len(ids)
+        time.sleep(pause)
+
+    if removed_conversations or removed_messages:
+        logger.info(f"[PURGE] Removed {removed_conversations} conversations and {removed_messages} messages")
+    return removed_conversations, removed_messages
+
+
+@job('conversations.purge')
+def purge_job(chunk_size=500, pause=0.05):
+    purge_deleted_conversations(chunk_size, pause)
+
+
+def schedule_purge(app=None):
+    """Queue a purge pass (at most one is queued at a time)."""
+    app = app or current_app._get_current_object()
+    enqueue('conversations.purge', {
+        'chunk_size': app.config.get('CONVERSATION_PURGE_CHUNK_SIZE', 500),
+        'pause': app.config.get('CONVERSATION_PURGE_PAUSE', 0.05),
+    }, unique=True, app=app)
+
+
+def init_app(app):
+    """Register the `flask purge-conversations` command."""
+
+    @app.cli.command('purge-conversations')
+    @click.option('--chunk-size', default=500)
+    def purge_conversations_command(chunk_size):
+        conversations, messages = purge_deleted_conversations(chunk_size)
+        click.echo(f"Purged {conversations} conversations ({messages} messages)")
@@ -0,0 +1,197 @@
+# app/services/health.py
+"""
+Readiness checks for load balancers.
+
+A per-process monitor thread refreshes the dependency probes every
+HEALTH_PROBE_INTERVAL seconds; `/health/ready` only reads the cached
+results, so health checks never touch the database or the gateway
+themselves.
+
+  - database: latency of a query that reads a table (so a locked SQLite file fails it)
+  - client:   whether this process has an OpenAI client; the monitor loads it
+              in the background, which also imports the chat stack ahead of
+              the first chat
+  - upstream: the latest keep-alive probe of the upstream loop
+              (UPSTREAM_KEEPALIVE_INTERVAL); only fails readiness with
+              HEALTH_REQUIRE_UPSTREAM, since an unreachable gateway affects
+              every worker alike
+  - load:     streams admitted vs MAX_CONCURRENT_STREAMS and upstream slots in
+              use; at HEALTH_SHED_UTILIZATION the worker reports itself
+              overloaded so the balancer sends new chats elsewhere
+
+Results older than HEALTH_STALE_AFTER seconds (a hung probe) count as failed.
+The monitor starts on the first readiness request, i.e. after the fork.
+"""
+import logging
+import os
+import threading
+import time
+
+from flask import current_app
+
+from app.services.scheduler import get_scheduler
+from app.services.upstream import get_upstream
+from app.utils.db import get_db
+from app.utils.metrics import metrics
+from app.utils.rate_limit import get_rate_limiter
+from load_client import isClientLoaded, load_client
+
+logger = logging.getLogger(__name__)
+
+
+class HealthMonitor:
+    def __init__(self, app, interval=2.0, stale_after=10.0, client_retry=30.0, shed_utilization=1.0,
+                 require_upstream=False):
+        self.app = app
+        self.interval = interval
+        self.stale_after = stale_after
+        self.client_retry = client_retry
+        self.shed_utilization = shed_utilization
+        self.require_upstream = require_upstream
+        self._results = {}  # probe name -> result dict with 'at' (epoch seconds)
+        self._client_attempt = 0.0
+        self._lock = threading.Lock()
+        self._pid = None
+
+    def start(self):
+        # The thread doesn't survive fork; start one per process
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._results = {}  # Inherited results describe the parent
+        threading.Thread(target=self._run, name='health-monitor', daemon=True).start()
+        logger.info(f"[HEALTH] Started monitor (pid {self._pid})")
+
+    def _run(self):
+        while True:
+            for probe in (self._probe_database, self._probe_load, self._probe_client):
+                try:
+                    probe()
+                except Exception as e:
+                    logger.error(f"[HEALTH] {probe.__name__} crashed: {e}", exc_info=True)
+            time.sleep(self.interval)
+
+    def _record(self, name, **result):
+        result['at'] = time.time()
+        with self._lock:
+            self._results[name] = result
+
+    # --- Probes (monitor thread) ---
+
+    def _probe_database(self):
+        started = time.monotonic()
+        try:
+            with self.app.app_context():
+                get_db().execute('SELECT version FROM schema_version').fetchone()
+        except Exception as e:
+            self._record('database', ok=False, latency=time.monotonic() - started, error=str(e))
+            logger.warning(f"[HEALTH] Database probe failed: {e}")
+            return
+        latency = time.monotonic() - started
+        metrics.observe('health.db_latency_seconds', latency)
+        self._record('database', ok=True, latency=latency, error=None)
+
+    def _probe_load(self):
+        limiter = get_rate_limiter(self.app)
+        # With a shared RATE_LIMIT_STORAGE this counts every worker's streams (a store round trip)
+        self._record('streams', active=limiter.active_streams() if limiter.enabled else 0,
+                     capacity=limiter.max_streams)
+
+    def _probe_client(self):
+        if isClientLoaded():
+            self._record('client', ok=True, error=None)
+            get_upstream(self.app).start()  # Keep-alive probes measure the upstream
+            return
+        if time.monotonic() - self._client_attempt < self.client_retry and 'client' in self._results:
+            return
+        self._client_attempt = time.monotonic()
+        try:
+            load_client()
+        except Exception as e:
+            self._record('client', ok=False, error=str(e))
+            return
+        self._record('client', ok=True, error=None)
+        get_upstream(self.app).start()
+
+    # --- Report (request thread; no I/O) ---
+
+    def _fresh(self, result, now, stale_after=None):
+        return result is not None and now - result['at'] <= (stale_after or self.stale_after)
+
+    def report(self):
+        """(ready, body) from the cached probe results and the in-process scheduler."""
+        now = time.time()
+        with self._lock:
+            results = dict(self._results)
+        checks, failing = {}, []
+
+        database = results.get('database')
+        checks['database'] = {
+            'ok': self._fresh(database, now) and database['ok'],
+            'latency_ms': round(database['latency'] * 1000, 2) if database else None,
+            'age_s': round(now - database['at'], 1) if database else None,
+            'error': database['error'] if database else 'not probed yet',
+        }
+        if not checks['database']['ok']:
+            failing.append('database')
+
+        client = results.get('client')
+        checks['client'] = {'ok': bool(client and client['ok']), 'loaded': isClientLoaded(),
+                            'error': client['error'] if client else 'not probed yet'}
+        if not checks['client']['ok']:
+            failing.append('client')
+
+        upstream_loop = get_upstream(self.app)
+        upstream = upstream_loop.last_probe
+        upstream_stale = max(self.stale_after, 2 * upstream_loop.keepalive_interval)
+        checks['upstream'] = {
+            'ok': upstream['ok'] if self._fresh(upstream, now, upstream_stale) else None,  # None: not probed (recently)
+            'latency_ms': round(upstream['latency'] * 1000, 2) if upstream else None,
+            'age_s': round(now - upstream['at'], 1) if upstream else None,
+            'error': upstream['error'] if upstream else None,
+        }
+        if self.require_upstream and not checks['upstream']['ok']:
+            failing.append('upstream')
+
+        streams = results.get('streams') or {'active': 0, 'capacity': 0}
+        slots = get_scheduler(self.app).stats()
+        utilization = max(streams['active'] / streams['capacity'] if streams['capacity'] else 0.0,
+                          (slots['active'] + slots['queued']) / slots['max_concurrency'])
+        load = {
+            'streams': {'active': streams['active'], 'capacity': streams['capacity']},
+            'upstream_slots': {'active': slots['active'], 'queued': slots['queued'],
+                               'capacity': slots['max_concurrency']},
+            'utilization': round(utilization, 3),
+        }
+
+        if 'database' not in results or 'client' not in results:
+            status = 'starting'
+        elif failing:
+            status = 'unavailable'
+        elif self.shed_utilization and utilization >= self.shed_utilization:
+            status = 'overloaded'
+        else:
+            status = 'ready'
+        body = {'status': status, 'pid': os.getpid(), 'checks': checks, 'load': load}
+        if failing:
+            body['failing'] = failing
+        return status == 'ready', body
+
+
+def get_health_monitor(app=None):
+    """Return the app's health monitor, creating it on first use."""
+    app = app or current_app._get_current_object()
+    monitor = app.extensions.get('health_monitor')
+    if monitor is None:
+        monitor = app.extensions.setdefault('health_monitor', HealthMonitor(
+            app,
+            interval=app.config.get('HEALTH_PROBE_INTERVAL', 2.0),
+            stale_after=app.config.get('HEALTH_STALE_AFTER', 10.0),
+            client_retry=app.config.get('HEALTH_CLIENT_RETRY', 30.0),
+            shed_utilization=app.config.get('HEALTH_SHED_UTILIZATION', 1.0),
+            require_upstream=app.config.get('HEALTH_REQUIRE_UPSTREAM', False),
+        ))
+    return monitor
@@ -0,0 +1,231 @@
+# app/services/jobs.py
+"""
+Small persistent job queue for work that can happen after the response.
+
+Jobs are rows in the `jobs` table (so they survive restarts and, with a shared
+database, are spread across worker processes). Each process runs JOBS_WORKERS
+threads that claim due jobs with a conditional UPDATE, run the registered
+handler inside an app context and delete the row on success. Failures are
+retried with exponential backoff up to `max_attempts`, then kept as 'failed'.
+
+Handlers are registered by name:
+
+    @job('conversations.purge')
+    def purge(chunk_size=500): ...
+
+    enqueue('conversations.purge', {'chunk_size': 500})
+"""
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+import click
+from flask import current_app, has_app_context
+
+from app.utils.db import get_db
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_handlers = {}
+
+
+def job(name):
+    """Register the decorated function as the handler for jobs called `name`."""
+    def decorator(func):
+        _handlers[name] = func
+        return func
+    return decorator
+
+
+class JobRunner:
+    def __init__(self, app, workers=2, poll_interval=5.0, max_attempts=5, backoff_base=2.0,
+                 backoff_max=300.0, lease_seconds=300.0):
+        self.app = app
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.lease_seconds = lease_seconds  # running jobs of a crashed process become claimable after this
+        self._wake = threading.Condition()
+        self._pending_wakeups = 0
+        self._lock = threading.Lock()
+        self._threads = []
+        self._pid = None
+
+    def start(self):
+        """Start the worker threads in this process (idempotent, fork-safe)."""
+        if self.workers <= 0 or (self._pid == os.getpid() and self._threads):
+            return
+        with self._lock:
+            if self._pid == os.getpid() and self._threads:
+                return
+            self._pid = os.getpid()
+            self._threads = [
+                threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+                for i in range(self.workers)
+            ]
+            for thread in self._threads:
+                thread.start()
+            logger.info(f"[JOBS] Started {self.workers} workers (pid {self._pid})")
+
+    def enqueue(self, name, payload=None, delay=0, max_attempts=None, unique=False):
+        """
+        Persist a job and wake a worker. With `unique`, nothing is added if a job
+        with the same name is already queued. Returns the job id (None if deduplicated).
+        """
+        if name not in _handlers:
+            raise KeyError(f"No handler registered for job '{name}'")
+        if self.workers <= 0:
+            # Inline mode (tests / single-threaded tools): run now and let errors propagate
+            if has_app_context():
+                self._call(name, payload or {})
+            else:
+                with self.app.app_context():
+                    self._call(name, payload or {})
+            return None
+        if has_app_context():
+            return self._insert(get_db(), name, payload, delay, max_attempts, unique)
+        with self.app.app_context():
+            return self._insert(get_db(), name, payload, delay, max_attempts, unique)
+
+    def _insert(self, db, name, payload, delay, max_attempts, unique):
+        if unique and db.execute(
+            "SELECT 1 FROM jobs WHERE name = ? AND status = 'queued' LIMIT 1", (name,)
+        ).fetchone():
+            return None
+        cursor = db.execute(
+            'INSERT INTO jobs (name, payload, max_attempts, run_at) VALUES (?, ?, ?, ?)',
+            (name, json.dumps(payload or {}), max_attempts or self.max_attempts, time.time() + delay)
+        )
+        db.commit()
+        metrics.incr(f'jobs.enqueued.{name}')
+        self.start()
+        if delay <= 0:
+            with self._wake:
+                self._pending_wakeups += 1
+                self._wake.notify()
+        return cursor.lastrowid
+
+    def _claim(self, db):
+        """Claim the next due job (or a job whose lease expired). Returns its row, or None."""
+        now = time.time()
+        while True:
+            row = db.execute(
+                "SELECT * FROM jobs WHERE (status = 'queued' AND run_at <= ?) "
+                "OR (status = 'running' AND locked_until < ?) ORDER BY run_at, id LIMIT 1",
+                (now, now)
+            ).fetchone()
+            if row is None:
+                return None
+            # Another worker (or process) may have claimed it in between
+            cursor = db.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, locked_until = ? "
+                "WHERE id = ? AND status = ? AND attempts = ?",
+                (now + self.lease_seconds, row['id'], row['status'], row['attempts'])
+            )
+            db.commit()
+            if cursor.rowcount == 1:
+                return row
+
+    def _next_due_in(self, db):
+        row = db.execute("SELECT MIN(run_at) AS run_at FROM jobs WHERE status = 'queued'").fetchone()
+        if row is None or row['run_at'] is None:
+            return self.poll_interval
+        return min(self.poll_interval, max(0.0, row['run_at'] - time.time()))
+
+    def _call(self, name, payload):
+        return _handlers[name](**payload)
+
+    def _run_one(self, db, row):
+        name, attempts = row['name'], row['attempts'] + 1
+        started = time.monotonic()
+        try:
+            self._call(name, json.loads(row['payload']))
+        except Exception as e:
+            db.rollback()  # Drop whatever the handler left half-written on the shared connection
+            if attempts >= row['max_attempts']:
+                logger.error(f"[JOBS] Job {row['id']} ({name}) failed permanently after {attempts} attempts: {e}",
+                             exc_info=True)
+                db.execute("UPDATE jobs SET status = 'failed', last_error = ? WHERE id = ?", (str(e), row['id']))
+                metrics.incr(f'jobs.failed.{name}')
+            else:
+                delay = min(self.backoff_max, self.backoff_base ** attempts) * random.uniform(0.5, 1.0)
+                logger.warning(f"[JOBS] Job {row['id']} ({name}) attempt {attempts} failed, retrying in {delay:.1f}s: {e}")
+                db.execute(
+                    "UPDATE jobs SET status = 'queued', run_at = ?, last_error = ? WHERE id = ?",
+                    (time.time() + delay, str(e), row['id'])
+                )
+                metrics.incr(f'jobs.retried.{name}')
+            db.commit()
+            return
+        db.execute('DELETE FROM jobs WHERE id = ?', (row['id'],))
+        db.commit()
+        metrics.observe(f'jobs.run_seconds.{name}', time.monotonic() - started)
+
+    def _work(self):
+        while True:
+            try:
+                with self.app.app_context():
+                    db = get_db()
+                    while True:
+                        row = self._claim(db)
+                        if row is None:
+                            break
+                        if row['name'] not in _handlers:
+                            # Enqueued by a newer deployment; leave it for a process that knows it
+                            db.execute("UPDATE jobs SET status = 'queued', run_at = ? WHERE id = ?",
+                                       (time.time() + self.poll_interval, row['id']))
+                            db.commit()
+                            continue
+                        self._run_one(db, row)
+                    timeout = self._next_due_in(db)
+            except Exception as e:
+                logger.error(f"[JOBS] Worker error: {e}", exc_info=True)
+                timeout = self.poll_interval
+            with self._wake:
+                if self._pending_wakeups == 0:
+                    self._wake.wait(timeout)
+                self._pending_wakeups = max(0, self._pending_wakeups - 1)
+
+
+def get_job_runner(app=None):
+    """Return the app's JobRunner, creating it on first use."""
+    app = app or current_app._get_current_object()
+    runner = app.extensions.get('job_runner')
+    if runner is None:
+        runner = app.extensions.setdefault('job_runner', JobRunner(
+            app,
+            workers=app.config.get('JOBS_WORKERS', 2),
+            poll_interval=app.config.get('JOBS_POLL_INTERVAL', 5.0),
+            max_attempts=app.config.get('JOBS_MAX_ATTEMPTS', 5),
+            backoff_base=app.config.get('JOBS_BACKOFF_BASE', 2.0),
+            backoff_max=app.config.get('JOBS_BACKOFF_MAX', 300.0),
+        ))
+    return runner
+
+
+def enqueue(name, payload=None, delay=0, max_attempts=None, unique=False, app=None):
+    """Enqueue a job on the current (or given) app's runner."""
+    return get_job_runner(app).enqueue(name, payload, delay=delay, max_attempts=max_attempts, unique=unique)
+
+
+def init_app(app):
+    """Start workers with the first request and register `flask jobs-retry-failed`."""
+
+    @app.before_request
+    def start_job_workers():
+        # Picks up jobs persisted before a restart; a no-op after the first call per process
+        get_job_runner(app).start()
+
+    @app.cli.command('jobs-retry-failed')
+    def retry_failed_command():
+        db = get_db()
+        cursor = db.execute("UPDATE jobs SET status = 'queued', attempts = 0, run_at = ? WHERE status = 'failed'",
+                            (time.time(),))
+        db.commit()
+        click.echo(f"Requeued {cursor.rowcount} failed jobs")
@@ -0,0 +1,50 @@
+# app/services/message_jobs.py
+"""
+Background jobs for messages. Kept apart from chat_service so that every
+worker registers them without importing the agents/openai stack.
+
+Replies themselves are written by the stream before it ends (a reload or the
+next turn must see them); only derived data such as cached HTML is left to jobs.
+"""
+import logging
+
+from flask import current_app
+
+from app.models.conversation import Conversation
+from app.models.message import Message
+from app.services.jobs import job
+from app.utils import markdown_render
+from app.utils.db import get_db
+
+logger = logging.getLogger(__name__)
+
+
+@job('messages.cache_html')
+def cache_message_html(message_id):
+    """Job: render an assistant reply once so history loads are served from the cache."""
+    if not markdown_render.enabled(current_app):
+        return
+    message = Message.get_by_id(message_id)
+    if message is None:
+        return  # Deleted meanwhile
+    db = get_db()
+    try:
+        markdown_render.store_html(db, [(message.id, markdown_render.render(message.content))])
+    except Exception:
+        db.rollback()
+        raise
+
+
+@job('messages.save_assistant')
+def save_assistant_message(conversation_id, content, parent_id=Message.ACTIVE):
+    """
+    Job: persist a streamed assistant reply. Only drains jobs queued by
+    earlier versions, which saved replies in the background.
+    """
+    if Conversation.get_owner_id(conversation_id) is None:
+        logger.warning(f"[SERVICE_JOBS] Conversation {conversation_id} is gone, dropping assistant message")
+        return
+    ai_message = Message.create(conversation_id, 'assistant', content, parent_id)
+    logger.info(f"[SERVICE_JOBS] Assistant message saved: id={ai_message.id}")
+    if markdown_render.enabled(current_app):
+        cache_message_html(ai_message.id)
@@ -0,0 +1,176 @@
+# app/services/scheduler.py
+"""
+Fair admission scheduler for upstream model calls.
+
+At most `max_concurrency` agent runs talk to the upstream at once. When the cap
+is reached, waiting requests are granted slots in this order:
+  1. short non-streaming requests before streams (waiters older than half the
+     max wait are promoted, so streams cannot starve),
+  2. users with the least recent upstream usage (slot-seconds, exponentially decayed),
+  3. arrival order.
+Requests that wait longer than `max_wait` seconds fail with SchedulerTimeout.
+"""
+import asyncio
+import contextlib
+import itertools
+import logging
+import math
+import threading
+import time
+
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class SchedulerTimeout(Exception):
+    """Raised when a request waited longer than the scheduler's max wait."""
+
+    def __init__(self, waited):
+        super().__init__(f"Timed out after {waited:.1f}s waiting for an upstream slot")
+        self.waited = waited
+
+
+class _Waiter:
+    __slots__ = ('user_id', 'streaming', 'seq', 'enqueued_at', 'granted')
+
+    def __init__(self, user_id, streaming, seq):
+        self.user_id = user_id
+        self.streaming = streaming
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+        self.granted = False
+
+
+class Ticket:
+    """A granted upstream slot. Use as a context manager or call release()."""
+
+    def __init__(self, scheduler, user_id):
+        self._scheduler = scheduler
+        self.user_id = user_id
+        self.started_at = time.monotonic()
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._scheduler._release(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+class GenerationScheduler:
+    def __init__(self, max_concurrency=16, max_wait=30.0, usage_half_life=300.0):
+        self.max_concurrency = max_concurrency
+        self.max_wait = max_wait
+        self.usage_half_life = usage_half_life
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiters = []
+        self._usage = {}  # user_id -> (decayed slot-seconds, last update)
+        self._seq = itertools.count()
+
+    # --- usage accounting ---
+
+    def _decayed_usage(self, user_id, now):
+        usage, updated = self._usage.get(user_id, (0.0, now))
+        return usage * math.pow(0.5, (now - updated) / self.usage_half_life)
+
+    def _charge(self, user_id, seconds):
+        now = time.monotonic()
+        self._usage[user_id] = (self._decayed_usage(user_id, now) + seconds, now)
+        if len(self._usage) > 10000:
+            # Drop users whose usage has decayed to nothing
+            self._usage = {u: v for u, v in self._usage.items() if self._decayed_usage(u, now) > 0.01}
+
+    # --- dispatch ---
+
+    def _priority(self, waiter, now):
+        promoted = (now - waiter.enqueued_at) > self.max_wait / 2
+        klass = 1 if waiter.streaming and not promoted else 0
+        return (klass, self._decayed_usage(waiter.user_id, now), waiter.seq)
+
+    def _dispatch(self):
+        """Grant free slots to the best waiters. Caller holds the lock."""
+        granted = False
+        while self._active < self.max_concurrency and self._waiters:
+            now = time.monotonic()
+            best = min(self._waiters, key=lambda w: self._priority(w, now))
+            self._waiters.remove(best)
+            best.granted = True
+            self._active += 1
+            granted = True
+        if granted:
+            self._cond.notify_all()
+        metrics.set_gauge('scheduler.active', self._active)
+        metrics.set_gauge('scheduler.queued', len(self._waiters))
+
+    def acquire(self, user_id, streaming=True, timeout=None):
+        """Block until an upstream slot is granted. Raises SchedulerTimeout."""
+        timeout = self.max_wait if timeout is None else timeout
+        with self._cond:
+            waiter = _Waiter(user_id, streaming, next(self._seq))
+            self._waiters.append(waiter)
+            self._dispatch()
+            deadline = waiter.enqueued_at + timeout
+            while not waiter.granted:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._waiters.remove(waiter)
+                    metrics.set_gauge('scheduler.queued', len(self._waiters))
+                    metrics.incr('scheduler.timeouts')
+                    logger.warning(f"[SCHEDULER] User {user_id} timed out after {timeout:.1f}s in queue")
+                    raise SchedulerTimeout(timeout)
+                self._cond.wait(remaining)
+
+        waited = time.monotonic() - waiter.enqueued_at
+        kind = 'stream' if streaming else 'request'
+        metrics.observe(f'scheduler.queue_wait_seconds.{kind}', waited)
+        if waited > 0.5:
+            logger.info(f"[SCHEDULER] User {user_id} waited {waited:.2f}s for a {kind} slot")
+        return Ticket(self, user_id)
+
+    def _release(self, ticket):
+        with self._cond:
+            self._active -= 1
+            self._charge(ticket.user_id, time.monotonic() - ticket.started_at)
+            self._dispatch()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, user_id, streaming=True):
+        """Async context manager that holds an upstream slot without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(None, self.acquire, user_id, streaming)
+        try:
+            ticket = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # The slot may still be granted after we stop waiting; hand it straight back
+            def _release_late(f):
+                if not f.cancelled() and f.exception() is None:
+                    f.result().release()
+            future.add_done_callback(_release_late)
+            raise
+        try:
+            yield ticket
+        finally:
+            ticket.release()
+
+    def stats(self):
+        with self._cond:
+            return {'active': self._active, 'queued': len(self._waiters), 'max_concurrency': self.max_concurrency}
+
+
+def get_scheduler(app):
+    """Return the app's scheduler, creating it on first use."""
+    scheduler = app.extensions.get('generation_scheduler')
+    if scheduler is None:
+        scheduler = app.extensions.setdefault('generation_scheduler', GenerationScheduler(
+            max_concurrency=app.config.get('UPSTREAM_MAX_CONCURRENCY', 16),
+            max_wait=app.config.get('SCHEDULER_MAX_WAIT', 30.0),
+            usage_half_life=app.config.get('SCHEDULER_USAGE_HALF_LIFE', 300.0),
+        ))
+    return scheduler
@@ -0,0 +1,321 @@
+# app/services/stream_broker.py
+"""
+Pub/sub for streamed generations.
+
+A generation (one streamed reply) gets an id when it starts. The generating
+coroutine publishes its SSE events through a `StreamPublisher`, which has the
+`put(item)` interface of the queue it replaces (`None` ends the stream).
+Any request can subscribe by generation id and receives `(seq, event)` pairs,
+starting after a given sequence number, so a reconnecting client resumes
+where it left off and a second tab replays the reply so far. Finished
+generations are kept for STREAM_RETENTION seconds.
+
+Brokers (STREAM_BROKER):
+  - 'local': in-process only. Subscribers must reach the worker that runs
+    the generation.
+  - 'database': events are also written, in batches every
+    STREAM_FLUSH_INTERVAL seconds, to the `stream_events` table, and
+    subscribers on other processes poll it every STREAM_POLL_INTERVAL seconds.
+    With a shared database (DATABASE_URL=postgresql://...) this spans hosts.
+    Subscribers in the generating process are still served from memory.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+import uuid
+
+from flask import current_app
+
+from app.utils.db import get_db
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class StreamTimeout(Exception):
+    """Raised to a subscriber when a generation produces nothing for STREAM_SUBSCRIBE_TIMEOUT seconds."""
+
+
+class StreamPublisher:
+    """Queue-like handle the generating coroutine writes SSE events to; `put(None)` ends the stream."""
+
+    def __init__(self, broker, generation_id):
+        self.broker = broker
+        self.generation_id = generation_id
+
+    def put(self, item):
+        if item is None:
+            self.broker.close(self.generation_id)
+        else:
+            self.broker.publish(self.generation_id, item)
+
+
+class _Stream:
+    __slots__ = ('user_id', 'conversation_id', 'created_at', 'finished_at', 'events', 'changed')
+
+    def __init__(self, user_id, conversation_id, lock):
+        self.user_id = user_id
+        self.conversation_id = conversation_id
+        self.created_at = time.time()
+        self.finished_at = None
+        self.events = []
+        self.changed = threading.Condition(lock)
+
+
+class LocalStreamBroker:
+    def __init__(self, retention=120.0, subscribe_timeout=300.0):
+        self.retention = retention
+        self.subscribe_timeout = subscribe_timeout
+        self._lock = threading.Lock()
+        self._streams = {}  # generation id -> _Stream
+
+    # --- Publishing ---
+
+    def register(self, user_id, conversation_id):
+        """Start a generation and return its id."""
+        generation_id = uuid.uuid4().hex
+        with self._lock:
+            self._expire(time.time())
+            self._streams[generation_id] = _Stream(user_id, conversation_id, self._lock)
+        return generation_id
+
+    def publisher(self, generation_id):
+        return StreamPublisher(self, generation_id)
+
+    def publish(self, generation_id, item):
+        """Append an event; returns its sequence number."""
+        with self._lock:
+            stream = self._streams[generation_id]
+            stream.events.append(item)
+            stream.changed.notify_all()
+            seq = len(stream.events)
+        metrics.incr('stream.broker.events')
+        return seq
+
+    def close(self, generation_id):
+        with self._lock:
+            stream = self._streams[generation_id]
+            stream.finished_at = time.time()
+            stream.changed.notify_all()
+
+    def _expire(self, now):
+        # Called with the lock held
+        for generation_id in [generation_id for generation_id, stream in self._streams.items()
+                              if stream.finished_at is not None and now - stream.finished_at > self.retention]:
+            del self._streams[generation_id]
+
+    # --- Subscribing ---
+
+    def info(self, generation_id):
+        """{'user_id', 'conversation_id', 'finished'} of a generation, or None if unknown."""
+        with self._lock:
+            stream = self._streams.get(generation_id)
+            if stream is None:
+                return None
+            return {'user_id': stream.user_id, 'conversation_id': stream.conversation_id,
+                    'finished': stream.finished_at is not None}
+
+    def latest(self, conversation_id):
+        """Id of the conversation's newest unfinished generation, or None."""
+        with self._lock:
+            running = [(stream.created_at, generation_id) for generation_id, stream in self._streams.items()
+                       if stream.conversation_id == conversation_id and stream.finished_at is None]
+        return max(running)[1] if running else None
+
+    def subscribe(self, generation_id, after=0):
+        """
+        Yield (seq, event) for events after `after` until the generation ends.
+        Raises KeyError for unknown generations and StreamTimeout if it stalls.
+        """
+        with self._lock:
+            stream = self._streams[generation_id]
+        metrics.incr('stream.broker.subscriptions')
+        while True:
+            with self._lock:
+                while len(stream.events) <= after and stream.finished_at is None:
+                    if not stream.changed.wait(self.subscribe_timeout):
+                        raise StreamTimeout(f"Generation {generation_id} stalled")
+                batch = stream.events[after:]
+                finished = stream.finished_at is not None
+            for item in batch:
+                after += 1
+                yield after, item
+            if finished:
+                return
+
+
+class DatabaseStreamBroker(LocalStreamBroker):
+    """Local broker whose events are also shared through the database (see module docstring)."""
+
+    def __init__(self, app, retention=120.0, subscribe_timeout=300.0, flush_interval=0.05, poll_interval=0.05):
+        super().__init__(retention, subscribe_timeout)
+        self.app = app
+        self.flush_interval = flush_interval
+        self.poll_interval = poll_interval
+        self._pending_generations = []
+        self._pending_events = []  # (generation_id, seq, data); data None marks the end
+        self._pending_finished = []
+        self._flush_lock = threading.Lock()
+        self._last_cleanup = 0.0
+        self._pid = None
+
+    def register(self, user_id, conversation_id):
+        generation_id = super().register(user_id, conversation_id)
+        with self._lock:
+            self._pending_generations.append((generation_id, user_id, conversation_id, time.time()))
+        self._start()
+        return generation_id
+
+    def publish(self, generation_id, item):
+        seq = super().publish(generation_id, item)
+        with self._lock:
+            self._pending_events.append((generation_id, seq, item))
+        return seq
+
+    def close(self, generation_id):
+        super().close(generation_id)
+        with self._lock:
+            seq = len(self._streams[generation_id].events) + 1
+            self._pending_events.append((generation_id, seq, None))
+            self._pending_finished.append((time.time(), generation_id))
+
+    # --- Writer thread ---
+
+    def _start(self):
+        # The writer thread doesn't survive fork; start one per process
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name='stream-broker-writer', daemon=True).start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            try:
+                self.flush()
+                if time.time() - self._last_cleanup > self.retention / 2:
+                    self._cleanup()
+            except Exception as e:
+                logger.error(f"[STREAM_BROKER] Writer error: {e}", exc_info=True)
+
+    def flush(self):
+        """Write buffered generations and events to the database."""
+        with self._flush_lock:
+            with self._lock:
+                generations, self._pending_generations = self._pending_generations, []
+                events, self._pending_events = self._pending_events, []
+                finished, self._pending_finished = self._pending_finished, []
+            if not (generations or events or finished):
+                return
+            with self.app.app_context():
+                db = get_db()
+                try:
+                    if generations:
+                        db.executemany('INSERT INTO stream_generations (id, user_id, conversation_id, created_at) '
+                                       'VALUES (?, ?, ?, ?)', generations)
+                    if events:
+                        db.executemany('INSERT INTO stream_events (generation_id, seq, data) VALUES (?, ?, ?)', events)
+                    if finished:
+                        db.executemany('UPDATE stream_generations SET finished_at = ? WHERE id = ?', finished)
+                    db.commit()
+                except Exception:
+                    db.rollback()
+                    # Put everything back (in order) for the next flush
+                    with self._lock:
+                        self._pending_generations[:0] = generations
+                        self._pending_events[:0] = events
+                        self._pending_finished[:0] = finished
+                    raise
+            metrics.observe('stream.broker.flush_events', len(events))
+
+    def _cleanup(self):
+        self._last_cleanup = time.time()
+        cutoff = self._last_cleanup - self.retention
+        with self.app.app_context():
+            db = get_db()
+            # Unfinished generations older than the subscribe timeout belong to a process that died
+            stale = 'finished_at < ? OR (finished_at IS NULL AND created_at < ?)'
+            params = (cutoff, cutoff - self.subscribe_timeout)
+            db.execute(f'DELETE FROM stream_events WHERE generation_id IN '
+                       f'(SELECT id FROM stream_generations WHERE {stale})', params)
+            db.execute(f'DELETE FROM stream_generations WHERE {stale}', params)
+            db.commit()
+
+    # --- Subscribing from other processes ---
+
+    def info(self, generation_id):
+        local = super().info(generation_id)
+        if local is not None:
+            return local
+        with self.app.app_context():
+            row = get_db().execute(
+                'SELECT user_id, conversation_id, finished_at FROM stream_generations WHERE id = ?', (generation_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {'user_id': row['user_id'], 'conversation_id': row['conversation_id'],
+                'finished': row['finished_at'] is not None}
+
+    def latest(self, conversation_id):
+        local = super().latest(conversation_id)
+        if local is not None:
+            return local
+        with self.app.app_context():
+            row = get_db().execute(
+                'SELECT id FROM stream_generations WHERE conversation_id = ? AND finished_at IS NULL '
+                'AND created_at > ? ORDER BY created_at DESC LIMIT 1',
+                (conversation_id, time.time() - self.subscribe_timeout)
+            ).fetchone()
+        return row['id'] if row else None
+
+    def subscribe(self, generation_id, after=0):
+        with self._lock:
+            local = generation_id in self._streams
+        if local:
+            yield from super().subscribe(generation_id, after)
+            return
+        metrics.incr('stream.broker.remote_subscriptions')
+        idle_since = time.monotonic()
+        while True:
+            with self.app.app_context():
+                rows = get_db().execute(
+                    'SELECT seq, data FROM stream_events WHERE generation_id = ? AND seq > ? ORDER BY seq',
+                    (generation_id, after)
+                ).fetchall()
+            for row in rows:
+                if row['data'] is None:
+                    return
+                after = row['seq']
+                yield after, row['data']
+            if rows:
+                idle_since = time.monotonic()
+            elif time.monotonic() - idle_since > self.subscribe_timeout:
+                raise StreamTimeout(f"Generation {generation_id} stalled")
+            time.sleep(self.poll_interval)
+
+
+def get_stream_broker(app=None):
+    """Return the app's stream broker (STREAM_BROKER), creating it on first use."""
+    app = app or current_app._get_current_object()
+    broker = app.extensions.get('stream_broker')
+    if broker is None:
+        kind = app.config.get('STREAM_BROKER', 'local')
+        options = {
+            'retention': app.config.get('STREAM_RETENTION', 120.0),
+            'subscribe_timeout': app.config.get('STREAM_SUBSCRIBE_TIMEOUT', 300.0),
+        }
+        if kind == 'database':
+            broker = DatabaseStreamBroker(app, flush_interval=app.config.get('STREAM_FLUSH_INTERVAL', 0.05),
+                                          poll_interval=app.config.get('STREAM_POLL_INTERVAL', 0.05), **options)
+        elif kind == 'local':
+            broker = LocalStreamBroker(**options)
+        else:
+            raise ValueError(f"Unknown STREAM_BROKER {kind!r} (expected 'local' or 'database')")
+        broker = app.extensions.setdefault('stream_broker', broker)
+    return broker
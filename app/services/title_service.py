@@ -0,0 +1,222 @@
+# app/services/title_service.py
+"""
+Automatic conversation titles.
+
+After the first exchange of a conversation still called "New Conversation",
+a short title is generated with TITLE_MODEL (a cheap model from MODELS):
+  - streaming: once the reply has been fully streamed (and the stream has
+    ended), if the upstream has a free slot, the title is generated right away
+    in a task of its own; HTTP clients see it through the conversation's
+    ETag, WebSocket clients get a `title` message (see `add_title_listener`);
+  - otherwise (upstream busy, non-streaming requests, failures): the
+    conversation is flagged `title_pending` and a deduplicated background job
+    titles all pending conversations in one batched upstream call.
+"""
+import asyncio
+import json
+import logging
+import re
+
+from flask import current_app
+
+from app.config.models import TITLE_MODEL
+from app.services.jobs import job, enqueue, get_job_runner
+from app.services.scheduler import get_scheduler
+from app.services.upstream import get_upstream
+from app.models.message import Message
+from app.utils.db import get_db
+from load_client import load_client, isClientLoaded, get_client
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TITLE = "New Conversation"
+SYSTEM_USER_ID = 0  # Scheduler usage bucket for background title batches
+
+_title_tasks = set()  # Strong references to detached title tasks (the loop only keeps weak ones)
+
+_PROMPT = (
+    "Write a short title (at most 6 words, no quotes or trailing punctuation) for each "
+    "numbered conversation below. Reply only with a JSON object mapping each number to its title.\n\n"
+)
+
+
+def _clip(text, limit=600):
+    return text if len(text) <= limit else text[:limit] + '...'
+
+
+def _clean(title):
+    title = (title or '').strip().strip('"\'').strip()
+    title = re.sub(r'\s+', ' ', title).rstrip('.')
+    return title[:80] or None
+
+
+def _parse_titles(text, count):
+    """Extract `count` titles from the model's reply (JSON, or one per line as a fallback)."""
+    match = re.search(r'\{.*\}', text or '', re.S)
+    if match:
+        try:
+            data = json.loads(match.group(0))
+            return [_clean(str(data.get(str(i + 1), ''))) for i in range(count)]
+        except (ValueError, AttributeError):
+            pass
+    lines = [re.sub(r'^\s*\d+[.):\-]\s*', '', line) for line in (text or '').splitlines() if line.strip()]
+    return [_clean(lines[i]) if i < len(lines) else None for i in range(count)]
+
+
+async def generate_titles_async(exchanges):
+    """
+    Title several (user_message, assistant_message) exchanges with one upstream call.
+    Returns a list of titles (None where the model gave nothing usable).
+    """
+    client = get_client() if isClientLoaded() else load_client()
+    body = '\n\n'.join(
+        f"{i + 1}.\nUser: {_clip(user)}\nAssistant: {_clip(assistant)}"
+        for i, (user, assistant) in enumerate(exchanges)
+    )
+    response = await client.chat.completions.create(
+        model=TITLE_MODEL,
+        messages=[{"role": "user", "content": _PROMPT + body}],
+        max_tokens=24 * len(exchanges) + 16,
+        temperature=0.2,
+    )
+    return _parse_titles(response.choices[0].message.content, len(exchanges))
+
+
+def needs_title(title, history, app=None):
+    """True if a conversation with this title and message history has had no reply yet and should be titled."""
+    config = (app or current_app).config
+    return (config.get('AUTO_TITLE_ENABLED', True) and title == DEFAULT_TITLE
+            and not any(message.role == 'assistant' for message in history))
+
+
+def _set_title(db, conversation_id, title):
+    # Only replace the default title: the user may have renamed it meanwhile
+    cursor = db.execute(
+        'UPDATE conversations SET title = ?, title_pending = 0 WHERE id = ? AND title = ?',
+        (title, conversation_id, DEFAULT_TITLE)
+    )
+    db.commit()
+    return cursor.rowcount == 1
+
+
+def add_title_listener(app, callback):
+    """Call `callback(conversation_id, title)` whenever this process titles a conversation."""
+    app.extensions.setdefault('title_listeners', set()).add(callback)
+
+
+def remove_title_listener(app, callback):
+    app.extensions.get('title_listeners', set()).discard(callback)
+
+
+def _notify_title(app, conversation_id, title):
+    for callback in list(app.extensions.get('title_listeners', ())):
+        try:
+            callback(conversation_id, title)
+        except Exception as e:
+            logger.warning(f"[TITLES] Title listener failed for conversation {conversation_id}: {e}")
+
+
+def schedule_title(conversation_id, app=None):
+    """Flag the conversation and queue the batched title job."""
+    app = app or current_app._get_current_object()
+    with app.app_context():
+        db = get_db()
+        db.execute('UPDATE conversations SET title_pending = 1 WHERE id = ?', (conversation_id,))
+        db.commit()
+        # Inside the fresh context: callers on the upstream loop inherit the request's context (and its connection)
+        enqueue('conversations.generate_titles', delay=app.config.get('TITLE_BATCH_DELAY', 10.0),
+                unique=True, app=app)
+
+
+def _store_title(app, conversation_id, title):
+    with app.app_context():
+        stored = _set_title(get_db(), conversation_id, title)
+    if stored:
+        _notify_title(app, conversation_id, title)
+    return stored
+
+
+def title_after_stream(app_instance, conversation_id, user_message, assistant_message):
+    """
+    Called on the upstream loop once a streamed reply is complete and its stream
+    has ended. Titles the conversation in a detached task, so neither the stream
+    nor its admission lease waits for the title; if it can't be generated right
+    away, the batched job is scheduled instead.
+    """
+    task = asyncio.ensure_future(_title_now(app_instance, conversation_id, user_message, assistant_message))
+    _title_tasks.add(task)
+    task.add_done_callback(_title_tasks.discard)
+    return task
+
+
+async def _title_now(app_instance, conversation_id, user_message, assistant_message):
+    scheduler = get_scheduler(app_instance)
+    upstream = get_upstream(app_instance)
+    stats = scheduler.stats()
+    try:
+        if stats['queued'] or stats['active'] >= stats['max_concurrency']:
+            logger.info(f"[TITLES] Upstream busy, batching title for conversation {conversation_id}")
+        else:
+            async with scheduler.slot(SYSTEM_USER_ID, streaming=False):
+                titles = await asyncio.wait_for(
+                    generate_titles_async([(user_message, assistant_message)]),
+                    timeout=app_instance.config.get('TITLE_TIMEOUT', 10.0)
+                )
+            title = titles[0]
+            if title:
+                # DB writes (and inline jobs, which call back into this loop) run off the loop
+                if await upstream.run_blocking(_store_title, app_instance, conversation_id, title):
+                    logger.info(f"[TITLES] Conversation {conversation_id} titled '{title}'")
+                return title
+    except Exception as e:
+        logger.warning(f"[TITLES] Immediate title failed for conversation {conversation_id}: {e}")
+    try:
+        await upstream.run_blocking(schedule_title, conversation_id, app_instance)
+    except Exception as e:
+        logger.error(f"[TITLES] Failed to schedule title for conversation {conversation_id}: {e}", exc_info=True)
+    return None
+
+
+@job('conversations.generate_titles')
+def generate_pending_titles():
+    """Job: title every pending conversation, TITLE_BATCH_SIZE per upstream call."""
+    app = current_app._get_current_object()
+    db = get_db()
+    batch_size = app.config.get('TITLE_BATCH_SIZE', 20)
+    last_id, waiting = 0, False
+    while True:
+        rows = db.execute(
+            'SELECT id FROM conversations WHERE title_pending = 1 AND deleted_at IS NULL AND id > ? '
+            'ORDER BY id LIMIT ?',
+            (last_id, batch_size)
+        ).fetchall()
+        if not rows:
+            break
+        last_id = rows[-1]['id']
+        exchanges, ids = [], []
+        for row in rows:
+            # The first exchange of the branch being shown (ids alone ignore regenerated versions)
+            messages = Message.get_branch(row['id'])[:2]
+            if len(messages) < 2:
+                waiting = True  # Reply not saved yet
+                continue
+            exchanges.append((messages[0].content, messages[1].content))
+            ids.append(row['id'])
+        if not ids:
+            continue
+
+        # Waits for a slot like any other request; SchedulerTimeout makes the job retry later
+        with get_scheduler(app).acquire(SYSTEM_USER_ID, streaming=False):
+            titles = get_upstream(app).run(generate_titles_async(exchanges))
+        for conversation_id, title in zip(ids, titles):
+            if title and _set_title(db, conversation_id, title):
+                _notify_title(app, conversation_id, title)
+        # Clear flags even when the model gave nothing usable, so a bad reply isn't retried forever
+        db.execute(
+            f'UPDATE conversations SET title_pending = 0 WHERE id IN ({", ".join("?" * len(ids))})', ids
+        )
+        db.commit()
+        logger.info(f"[TITLES] Titled {sum(1 for t in titles if t)}/{len(ids)} conversations in one batch")
+
+    if waiting and get_job_runner(app).workers > 0:  # Inline runners would recurse here
+        enqueue('conversations.generate_titles', delay=app.config.get('TITLE_BATCH_DELAY', 10.0), unique=True)
@@ -0,0 +1,105 @@
+# app/services/upstream.py
+"""
+Shared event loop for upstream model calls.
+
+All agent runs in a process execute on one long-lived asyncio loop in a
+daemon thread, instead of a fresh thread + loop per request. This keeps the
+AsyncOpenAI client's HTTP connection pool on a single loop, so connections
+to the gateway (DNS, TCP and TLS already done) are reused across requests. A
+periodic keep-alive probe stops the pool's idle connections from expiring
+between bursts of traffic.
+
+Blocking work that coroutines need (DB reads/writes) goes through
+`run_blocking`, which uses a small dedicated thread pool so it never competes
+with scheduler waits for executor threads.
+"""
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from load_client import isClientLoaded, get_client
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class UpstreamLoop:
+    def __init__(self, executor_threads=64, db_threads=8, keepalive_interval=30.0):
+        self.executor_threads = executor_threads
+        self.db_threads = db_threads
+        self.keepalive_interval = keepalive_interval
+        self._lock = threading.Lock()
+        self._loop = None
+        self._pid = None
+        self._db_executor = None
+        self.last_probe = None  # {'ok', 'latency', 'at' (epoch), 'error'} of the latest keep-alive probe
+
+    def _ensure_started(self):
+        # Threads don't survive fork (e.g. gunicorn workers); start one loop per process
+        if self._loop is not None and self._pid == os.getpid():
+            return self._loop
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                # Scheduler waits block an executor thread each; size for the admission caps
+                loop.set_default_executor(ThreadPoolExecutor(self.executor_threads, thread_name_prefix='upstream-wait'))
+                self._db_executor = ThreadPoolExecutor(self.db_threads, thread_name_prefix='upstream-db')
+                threading.Thread(target=self._run, args=(loop,), name='upstream-loop', daemon=True).start()
+                self._loop = loop
+                self._pid = os.getpid()
+                logger.info(f"[UPSTREAM] Started shared event loop (pid {self._pid})")
+        return self._loop
+
+    def _run(self, loop):
+        asyncio.set_event_loop(loop)
+        if self.keepalive_interval > 0:
+            loop.create_task(self._keepalive())
+        loop.run_forever()
+
+    async def _keepalive(self):
+        """Warm the connection pool now, then touch it periodically so idle connections stay open."""
+        while True:
+            if isClientLoaded():
+                started = time.monotonic()
+                try:
+                    await asyncio.wait_for(get_client().models.list(), timeout=10)
+                    latency = time.monotonic() - started
+                    metrics.observe('upstream.keepalive_seconds', latency)
+                    self.last_probe = {'ok': True, 'latency': latency, 'at': time.time(), 'error': None}
+                except Exception as e:
+                    metrics.incr('upstream.keepalive_errors')
+                    logger.debug(f"[UPSTREAM] Keep-alive probe failed: {e}")
+                    self.last_probe = {'ok': False, 'latency': time.monotonic() - started, 'at': time.time(),
+                                       'error': str(e) or type(e).__name__}
+            await asyncio.sleep(self.keepalive_interval)
+
+    def start(self):
+        """Start the loop (and its keep-alive probes) now rather than on the first submit."""
+        self._ensure_started()
+
+    def submit(self, coro):
+        """Schedule a coroutine on the shared loop. Returns a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_started())
+
+    def run(self, coro, timeout=None):
+        """Run a coroutine on the shared loop and block the calling thread for its result."""
+        return self.submit(coro).result(timeout)
+
+    async def run_blocking(self, func, *args):
+        """Await a blocking call (e.g. DB access) without stalling the shared loop."""
+        return await asyncio.get_running_loop().run_in_executor(self._db_executor, func, *args)
+
+
+def get_upstream(app):
+    """Return the app's shared upstream loop, creating it on first use."""
+    upstream = app.extensions.get('upstream_loop')
+    if upstream is None:
+        upstream = app.extensions.setdefault('upstream_loop', UpstreamLoop(
+            executor_threads=app.config.get('UPSTREAM_EXECUTOR_THREADS', 64),
+            db_threads=app.config.get('UPSTREAM_DB_THREADS', 8),
+            keepalive_interval=app.config.get('UPSTREAM_KEEPALIVE_INTERVAL', 30.0),
+        ))
+    return upstream
@@ -0,0 +1,207 @@
+# app/services/usage.py
+"""
+Token usage accounting and per-user quotas.
+
+Every agent run records its token usage (prompt, cached prompt and completion
+tokens), latency and model. Records are buffered in memory and written to the
+`usage` table in batches by a flusher thread, every USAGE_FLUSH_INTERVAL
+seconds or once USAGE_FLUSH_BATCH records are waiting.
+
+Quotas (USAGE_DAILY_TOKEN_QUOTA / USAGE_MONTHLY_TOKEN_QUOTA, input + output
+tokens per UTC day / month; 0 disables) are checked before a request is
+dispatched, against per-user counters cached for USAGE_QUOTA_CACHE_TTL
+seconds. Local usage is added to the cached counters as it is recorded, so a
+single process enforces quotas exactly; usage from other processes is picked
+up when the cache entry expires.
+"""
+import atexit
+import datetime
+import logging
+import os
+import threading
+import time
+
+from flask import current_app, has_app_context
+
+from app.models.usage import Usage
+from app.utils.metrics import metrics
+from app.utils.rate_limit import RateLimitExceeded
+
+logger = logging.getLogger(__name__)
+
+
+class QuotaExceeded(RateLimitExceeded):
+    """Raised when a user has used up their daily or monthly token quota (answered with 429)."""
+
+
+def _utc_now():
+    return datetime.datetime.now(datetime.timezone.utc)
+
+
+def _seconds_until(moment, now):
+    return max(1.0, (moment - now).total_seconds())
+
+
+class UsageTracker:
+    def __init__(self, app, daily_quota=0, monthly_quota=0, flush_interval=2.0, flush_batch=200, cache_ttl=30.0):
+        self.app = app
+        self.daily_quota = daily_quota
+        self.monthly_quota = monthly_quota
+        self.flush_interval = flush_interval
+        self.flush_batch = flush_batch
+        self.cache_ttl = cache_ttl
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()  # One batch write at a time; quota reads wait for it
+        self._wake = threading.Event()
+        self._pending = []
+        self._totals = {}  # user_id -> [day, loaded_at, day_tokens, month_tokens]
+        self._pid = None
+
+    @property
+    def quotas_enabled(self):
+        return bool(self.daily_quota or self.monthly_quota)
+
+    # --- Recording ---
+
+    def record(self, user_id, model, input_tokens, output_tokens, cached_tokens=0, latency_ms=None,
+               conversation_id=None, streaming=False):
+        """Buffer one request's usage and count it against the user's cached quota totals."""
+        now = _utc_now()
+        day = now.strftime('%Y-%m-%d')
+        tokens = input_tokens + output_tokens
+        record = {
+            'user_id': user_id, 'conversation_id': conversation_id, 'model': model,
+            'input_tokens': input_tokens, 'cached_tokens': cached_tokens, 'output_tokens': output_tokens,
+            'latency_ms': None if latency_ms is None else int(latency_ms), 'streaming': int(bool(streaming)),
+            'day': day, 'created_at': now.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        with self._lock:
+            self._pending.append(record)
+            pending = len(self._pending)
+            totals = self._totals.get(user_id)
+            if totals is not None and totals[0] == day:
+                totals[2] += tokens
+                totals[3] += tokens
+        metrics.incr(f'usage.tokens.{model}', tokens)
+
+        if self.flush_interval <= 0:
+            self.flush()  # Synchronous mode (tests / tools)
+        else:
+            self._start()
+            if pending >= self.flush_batch:
+                self._wake.set()
+
+    def flush(self):
+        """Write buffered records to the usage table. Returns how many were written."""
+        with self._flush_lock:
+            with self._lock:
+                batch, self._pending = self._pending, []
+            if not batch:
+                return 0
+            try:
+                if has_app_context():
+                    Usage.insert_many(batch)
+                else:
+                    with self.app.app_context():
+                        Usage.insert_many(batch)
+            except Exception as e:
+                # Put the batch back so it is retried with the next flush
+                logger.error(f"[USAGE] Failed to write {len(batch)} usage records: {e}", exc_info=True)
+                metrics.incr('usage.flush_errors')
+                with self._lock:
+                    self._pending[:0] = batch
+                return 0
+            metrics.observe('usage.flush_batch_size', len(batch))
+            return len(batch)
+
+    def _start(self):
+        # The flusher thread doesn't survive fork; start one per process
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+        threading.Thread(target=self._run, name='usage-flusher', daemon=True).start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    # --- Quotas ---
+
+    def _user_totals(self, user_id, day, month_start):
+        """(day_tokens, month_tokens) for the user, from the cache or the usage table."""
+        with self._lock:
+            totals = self._totals.get(user_id)
+            if totals is not None and totals[0] == day and time.monotonic() - totals[1] < self.cache_ttl:
+                return totals[2], totals[3]
+        # Under the flush lock no batch is on its way from _pending to the table, so each record is counted once
+        with self._flush_lock:
+            day_tokens, month_tokens = Usage.user_totals(user_id, day, month_start)
+            with self._lock:
+                # Records not in the table yet
+                for record in self._pending:
+                    if record['user_id'] == user_id and record['day'] >= month_start:
+                        tokens = record['input_tokens'] + record['output_tokens']
+                        month_tokens += tokens
+                        if record['day'] == day:
+                            day_tokens += tokens
+                self._totals[user_id] = [day, time.monotonic(), day_tokens, month_tokens]
+        metrics.incr('usage.quota_cache_misses')
+        return day_tokens, month_tokens
+
+    def check_quota(self, user_id):
+        """Raise QuotaExceeded if the user has no daily or monthly tokens left."""
+        if not self.quotas_enabled:
+            return
+        now = _utc_now()
+        today = now.date()
+        month_start = today.replace(day=1)
+        day_tokens, month_tokens = self._user_totals(user_id, today.isoformat(), month_start.isoformat())
+
+        if self.daily_quota and day_tokens >= self.daily_quota:
+            tomorrow = datetime.datetime.combine(today + datetime.timedelta(days=1), datetime.time(),
+                                                 datetime.timezone.utc)
+            metrics.incr('usage.quota_rejections.daily')
+            raise QuotaExceeded("Daily token quota exceeded", _seconds_until(tomorrow, now))
+        if self.monthly_quota and month_tokens >= self.monthly_quota:
+            next_month = (month_start + datetime.timedelta(days=32)).replace(day=1)
+            next_month = datetime.datetime.combine(next_month, datetime.time(), datetime.timezone.utc)
+            metrics.incr('usage.quota_rejections.monthly')
+            raise QuotaExceeded("Monthly token quota exceeded", _seconds_until(next_month, now))
+
+    def remaining(self, user_id):
+        """Tokens used and left today / this month (None where no quota is set)."""
+        today = _utc_now().date()
+        day_tokens, month_tokens = self._user_totals(user_id, today.isoformat(), today.replace(day=1).isoformat())
+        return {
+            'day': {'used': day_tokens, 'quota': self.daily_quota or None,
+                    'remaining': max(0, self.daily_quota - day_tokens) if self.daily_quota else None},
+            'month': {'used': month_tokens, 'quota': self.monthly_quota or None,
+                      'remaining': max(0, self.monthly_quota - month_tokens) if self.monthly_quota else None},
+        }
+
+
+def get_usage_tracker(app=None):
+    """Return the app's UsageTracker, creating it on first use."""
+    app = app or current_app._get_current_object()
+    tracker = app.extensions.get('usage_tracker')
+    if tracker is None:
+        tracker = app.extensions.setdefault('usage_tracker', UsageTracker(
+            app,
+            daily_quota=app.config.get('USAGE_DAILY_TOKEN_QUOTA', 0),
+            monthly_quota=app.config.get('USAGE_MONTHLY_TOKEN_QUOTA', 0),
+            flush_interval=app.config.get('USAGE_FLUSH_INTERVAL', 2.0),
+            flush_batch=app.config.get('USAGE_FLUSH_BATCH', 200),
+            cache_ttl=app.config.get('USAGE_QUOTA_CACHE_TTL', 30.0),
+        ))
+    return tracker
+
+
+def check_quota(user_id):
+    """Reject the request (QuotaExceeded -> 429) if the current user is over quota."""
+    get_usage_tracker().check_quota(user_id)
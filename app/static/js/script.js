@@ -43,6 +43,11 @@ let markdownWorker = null; // Initialize worker state
 let currentBotMessageIdForStreaming = null;
 let currentBotMarkdownContent = '';
 const THROTTLE_DELAY_MS = 150; // Adjust as needed (milliseconds)
+const MAX_STREAM_RECONNECTS = 3; // Resume attempts when a streamed reply's connection drops
+const DEFAULT_TITLE = 'New Conversation';
+const TITLE_POLL_INTERVAL_MS = 1500; // Titles are generated after the stream ends; poll the conversation's ETag
+const TITLE_POLL_ATTEMPTS = 10;
+const conversationTitles = {}; // conversation id -> last known title
 
 // --- Core Functions (Authentication, Model Loading, Conversation Management) ---
 
@@ -129,6 +134,7 @@ async function loadOrCreateConversation() {
             const data = await response.json();
             if (data.conversations && data.conversations.length > 0) {
                 currentConversationId = data.conversations[0].id; // Use most recent
+                setConversationTitle(currentConversationId, data.conversations[0].title);
                 console.log(`Loaded existing conversation ID: ${currentConversationId}`);
                 // TODO: Optionally load messages for this conversation here
                 // await loadMessagesForConversation(currentConversationId);
@@ -150,6 +156,7 @@ async function loadOrCreateConversation() {
         if (createResponse.ok) {
             const createData = await createResponse.json();
             currentConversationId = createData.conversation.id;
+            setConversationTitle(currentConversationId, createData.conversation.title);
             console.log(`Created new conversation ID: ${currentConversationId}`);
             return currentConversationId;
         } else {
@@ -164,6 +171,52 @@ async function loadOrCreateConversation() {
     }
 }
 
+// --- Conversation Titles (sidebar + document title) ---
+
+function setConversationTitle(conversationId, title) {
+    conversationTitles[conversationId] = title;
+    const list = document.getElementById('conversationList');
+    if (list) {
+        let item = list.querySelector(`.conversation-item[data-id="${conversationId}"]`);
+        if (!item) {
+            item = document.createElement('div');
+            item.className = 'conversation-item';
+            item.dataset.id = conversationId;
+            list.prepend(item);
+        }
+        item.textContent = title;
+        list.querySelectorAll('.conversation-item').forEach(el => {
+            el.classList.toggle('active', el.dataset.id === String(currentConversationId));
+        });
+    }
+    if (conversationId === currentConversationId) document.title = title;
+}
+
+async function refreshConversationTitle(conversationId) {
+    // Only untitled conversations get an automatic title; unchanged polls are 304s
+    if (conversationTitles[conversationId] !== DEFAULT_TITLE) return;
+    let etag = null;
+    for (let attempt = 0; attempt < TITLE_POLL_ATTEMPTS; attempt++) {
+        await new Promise(resolve => setTimeout(resolve, TITLE_POLL_INTERVAL_MS));
+        const headers = { 'Authorization': `Bearer ${getAccessToken()}` };
+        if (etag) headers['If-None-Match'] = etag;
+        try {
+            const response = await fetch(`/api/chat/conversations/${conversationId}`, { headers });
+            if (response.status === 304) continue;
+            if (!response.ok) return;
+            etag = response.headers.get('ETag');
+            const title = (await response.json()).conversation.title;
+            if (title && title !== DEFAULT_TITLE) {
+                setConversationTitle(conversationId, title);
+                return;
+            }
+        } catch (error) {
+            console.warn('[TITLE] Failed to refresh conversation title:', error);
+            return;
+        }
+    }
+}
+
 // --- Markdown Worker Integration ---
 
 function initializeMarkdownWorker() {
@@ -332,6 +385,57 @@ function hideTypingIndicator() {
     }
 }
 
+// Shows tool-call progress ({"tool": {id, name, status, seconds}} events) under a streaming reply
+function renderToolStatus(messageDiv, tool) {
+    if (!messageDiv) return;
+    let statusEl = messageDiv.querySelector('.tool-status');
+    if (!statusEl) {
+        statusEl = document.createElement('small');
+        statusEl.classList.add('tool-status');
+        statusEl.style.display = 'block';
+        statusEl.style.opacity = '0.7';
+        messageDiv.querySelector('.message-content').appendChild(statusEl);
+    }
+    let line = statusEl.querySelector(`[data-tool-id="${tool.id}"]`);
+    if (!line) {
+        line = document.createElement('div');
+        line.dataset.toolId = tool.id;
+        statusEl.appendChild(line);
+    }
+    const seconds = tool.seconds != null ? ` (${tool.seconds.toFixed(1)}s)` : '';
+    line.textContent = `${tool.name}: ${tool.status}${seconds}`;
+}
+
+// Shows server-rendered HTML ({"block": {index, html, final}} events) of a streaming reply.
+// Blocks go in their own container; the worker-rendered <p> is hidden once they arrive.
+function renderServerBlock(messageDiv, block) {
+    if (!messageDiv) return;
+    const contentDiv = messageDiv.querySelector('.message-content');
+    let container = contentDiv.querySelector('.server-render');
+    if (!container) {
+        container = document.createElement('div');
+        container.classList.add('server-render');
+        contentDiv.querySelector('p').style.display = 'none';
+        contentDiv.insertBefore(container, contentDiv.firstChild.nextSibling);
+    }
+    let blockEl = container.querySelector(`[data-block="${block.index}"]`);
+    if (!blockEl) {
+        blockEl = document.createElement('div');
+        blockEl.dataset.block = block.index;
+        container.appendChild(blockEl);
+    }
+    blockEl.innerHTML = block.html; // Sanitised server-side (raw HTML escaped, unsafe URLs dropped)
+    scrollToBottom();
+}
+
+// Falls back to the worker-rendered <p>, e.g. when an error is appended to a server-rendered reply
+function dropServerBlocks(messageDiv) {
+    if (!messageDiv) return;
+    const container = messageDiv.querySelector('.server-render');
+    if (container) container.remove();
+    messageDiv.querySelector('.message-content p').style.display = '';
+}
+
 function scrollToBottom() {
     const chatbox = document.getElementById('chatbox'); if (!chatbox) return;
     // Add small delay to allow DOM to render before scrolling, especially after innerHTML changes
@@ -425,6 +529,7 @@ async function startNewChat() {
         if (createResponse.ok) {
             const createData = await createResponse.json();
             currentConversationId = createData.conversation.id;
+            setConversationTitle(currentConversationId, createData.conversation.title);
             console.log(`[NEW CHAT] Created and set new conversation ID: ${currentConversationId}`);
         } else {
             const errorText = await createResponse.text();
@@ -486,7 +591,8 @@ async function streamMessageWithFetch(conversationId, messageText, model) {
             },
             body: JSON.stringify({
                 content: messageText,
-                model: model
+                model: model,
+                render_markdown: true // Ask for HTML blocks; ignored if the server can't render
             }),
             signal: signal
         });
@@ -531,19 +637,39 @@ async function streamMessageWithFetch(conversationId, messageText, model) {
         }
 
         // Process the stream
-        const reader = response.body.getReader();
+        let reader = response.body.getReader();
         const decoder = new TextDecoder();
         let buffer = '';
+        let serverRendered = false; // Set once the server sends HTML blocks; the worker is skipped then
+        let generationId = response.headers.get('X-Generation-Id');
+        let lastEventId = 0;  // Id of the last event handled, to resume after a dropped connection
+        let reconnects = 0;
 
         console.log("[STREAM] Starting to read stream...");
 
         while (true) {
-            const { value, done } = await reader.read();
+            let value, done;
+            try {
+                ({ value, done } = await reader.read());
+            } catch (readError) {
+                // Connection dropped mid-reply: reattach to the generation (served by any worker)
+                if (readError.name === 'AbortError' || !generationId || reconnects >= MAX_STREAM_RECONNECTS) throw readError;
+                reconnects++;
+                console.warn(`[STREAM] Connection lost, resuming generation ${generationId} after event ${lastEventId}`);
+                const resumed = await fetch(`/api/chat/conversations/${conversationId}/stream?generation=${generationId}&from=${lastEventId}`, {
+                    headers: { 'Authorization': `Bearer ${getAuthToken()}` },
+                    signal: signal
+                });
+                if (!resumed.ok) throw readError;
+                reader = resumed.body.getReader();
+                buffer = '';
+                continue;
+            }
 
             if (done) {
                 console.log("[STREAM] Stream finished.");
                  // Ensure final accumulated content is sent for parsing
-                 if (currentBotMessageIdForStreaming && currentBotMarkdownContent != null) {
+                 if (currentBotMessageIdForStreaming && currentBotMarkdownContent != null && !serverRendered) {
                      if (markdownWorker) {
                          console.log("[STREAM] Sending final accumulated markdown to worker.");
                          try {
@@ -566,9 +692,15 @@ async function streamMessageWithFetch(conversationId, messageText, model) {
             // Process Server-Sent Events (SSE)
             let eolIndex;
             while ((eolIndex = buffer.indexOf('\n\n')) >= 0) {
-                const message = buffer.substring(0, eolIndex);
+                let message = buffer.substring(0, eolIndex);
                 buffer = buffer.substring(eolIndex + 2); // Consume the message + \n\n
 
+                if (message.startsWith('id:')) { // Event id line, followed by the data line
+                    const lineEnd = message.indexOf('\n');
+                    lastEventId = parseInt(message.substring(3, lineEnd), 10) || lastEventId;
+                    message = message.substring(lineEnd + 1);
+                }
+
                 if (message.startsWith('data:')) {
                     const jsonData = message.substring(5).trim();
                     try {
@@ -577,15 +709,23 @@ async function streamMessageWithFetch(conversationId, messageText, model) {
                         if (data.error) {
                             console.error('[STREAM] Received error event:', data.error);
                             currentBotMarkdownContent += `\n\n**Error:** ${data.error}\n`;
+                            if (serverRendered) { serverRendered = false; dropServerBlocks(botMessageDiv); }
                             throttledParseAndRenderMarkdown(); // Trigger UI update with error
                             // Decide if you want to break the loop on error
+                        } else if (data.started) {
+                            generationId = data.generation_id || generationId;
+                        } else if (data.tool) {
+                            renderToolStatus(botMessageDiv, data.tool);
+                        } else if (data.block) {
+                            serverRendered = true;
+                            renderServerBlock(botMessageDiv, data.block);
                         } else if (data.complete) {
                             console.log('[STREAM] Received explicit completion event.');
                             // The 'done' flag from reader.read() is the primary signal, but this can be useful
                             // Don't break here, let the 'done' flag handle loop exit naturally
                         } else if (data.chunk) {
                             currentBotMarkdownContent += data.chunk;
-                            throttledParseAndRenderMarkdown(); // Trigger potential parse/render
+                            if (!serverRendered) throttledParseAndRenderMarkdown(); // Trigger potential parse/render
                         } else {
                              // console.warn("[STREAM] Received data event with unknown format:", data);
                         }
@@ -622,6 +762,7 @@ async function streamMessageWithFetch(conversationId, messageText, model) {
         console.log("[STREAM] Fetch stream processing finished or aborted.");
         hideTypingIndicator();
         toggleSendButton(false); // Re-enable send button
+        refreshConversationTitle(conversationId); // Titled after the first reply, once the stream has ended
         // Don't refocus input automatically, might interrupt user
         eventSourceController = null; // Clear the controller
 
@@ -0,0 +1,39 @@
+# app/tools/context.py
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+
+@dataclass
+class ToolContext:
+    """
+    Run context passed to the agent runner; tools read the app and caller from it.
+
+    It also carries the per-turn tool limits (see app/tools/runtime.py):
+    `tool_budget` seconds of wall-clock time shared by all tool calls of the
+    run, at most `max_parallel` calls at once, and an optional `emit`
+    callback that receives tool progress events.
+    """
+    app: Any
+    user_id: Optional[int] = None
+    conversation_id: Optional[int] = None
+    emit: Optional[Callable[[dict], None]] = None
+    tool_budget: Optional[float] = None
+    max_parallel: Optional[int] = None
+    _deadline: Optional[float] = field(default=None, init=False, repr=False)
+    _semaphore: Optional[asyncio.Semaphore] = field(default=None, init=False, repr=False)
+
+    def time_left(self, limit):
+        """Seconds a tool call may take: `limit`, capped by what is left of the turn's budget."""
+        if self.tool_budget is None:
+            return limit
+        if self._deadline is None:
+            self._deadline = time.monotonic() + self.tool_budget  # Budget starts with the first call
+        return min(limit, self._deadline - time.monotonic())
+
+    def slot(self):
+        """Async context manager limiting how many tool calls of this run execute at once."""
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_parallel or 1_000_000)
+        return self._semaphore
@@ -0,0 +1,80 @@
+# app/tools/runtime.py
+"""
+Timeouts, budgets and progress events around agent tool calls.
+
+The Agents SDK already runs the function-tool calls of one model step as
+concurrent tasks, and the models are asked for parallel tool calls whenever
+tools are enabled. `guard_tool` wraps a FunctionTool so each call also:
+  - runs for at most TOOL_CALL_TIMEOUT seconds, and only while the turn's
+    shared TOOL_TURN_BUDGET lasts (the model gets an error result instead)
+  - waits for one of the run's TOOL_MAX_PARALLEL slots
+  - reports `{"tool": {...}}` progress events (running once it has a slot,
+    then done / error / timeout) through the run's ToolContext; streaming
+    requests forward them to the SSE client
+"""
+import asyncio
+import dataclasses
+import json
+import logging
+import time
+
+from app.utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _emit(context, event):
+    if getattr(context, 'emit', None) is None:
+        return
+    try:
+        context.emit(event)
+    except Exception as e:
+        logger.warning(f"[TOOLS] Failed to emit progress event: {e}")
+
+
+def guard_tool(tool, call_timeout=30.0):
+    """Return a copy of FunctionTool `tool` whose calls are time-limited, throttled and reported."""
+    invoke_tool = tool.on_invoke_tool
+
+    async def on_invoke_tool(ctx, arguments):
+        context = ctx.context
+        call_id = getattr(ctx, 'tool_call_id', None)
+        event = {'id': call_id, 'name': tool.name}
+        timeout = context.time_left(call_timeout) if hasattr(context, 'time_left') else call_timeout
+        if timeout <= 0:
+            metrics.incr(f'tools.budget_exhausted.{tool.name}')
+            _emit(context, {**event, 'status': 'timeout', 'seconds': 0})
+            return f"Error: the time budget for tool calls in this turn is used up; {tool.name} was not run"
+
+        async def run():
+            if not hasattr(context, 'slot'):
+                _emit(context, {**event, 'status': 'running'})
+                return await invoke_tool(ctx, arguments)
+            async with context.slot():
+                _emit(context, {**event, 'status': 'running'})
+                return await invoke_tool(ctx, arguments)
+
+        started = time.monotonic()
+        status = 'done'
+        try:
+            # Time spent waiting for a slot counts against the call's timeout
+            return await asyncio.wait_for(run(), timeout)
+        except asyncio.TimeoutError:
+            status = 'timeout'
+            logger.warning(f"[TOOLS] {tool.name} call {call_id} timed out after {timeout:.1f}s")
+            return f"Error: {tool.name} did not finish within {timeout:.1f} seconds"
+        except Exception:
+            status = 'error'
+            raise
+        finally:
+            seconds = time.monotonic() - started
+            metrics.observe(f'tools.call_seconds.{tool.name}', seconds)
+            metrics.incr(f'tools.calls.{tool.name}.{status}')
+            _emit(context, {**event, 'status': status, 'seconds': round(seconds, 3)})
+
+    return dataclasses.replace(tool, on_invoke_tool=on_invoke_tool)
+
+
+def sse_emitter(result_queue):
+    """`ToolContext.emit` callback that forwards progress events into a streaming response's queue."""
+    return lambda event: result_queue.put(f"data: {json.dumps({'tool': event})}\n\n")
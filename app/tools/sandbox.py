@@ -0,0 +1,363 @@
+# app/tools/sandbox.py
+"""
+Sandboxed, pooled execution of shell commands for agent tools.
+
+Commands run in a small pool of pre-spawned worker processes (started from a
+fork server, as the app's threads are already running), so the agent's event
+loop only awaits a future and never blocks on a subprocess. Each command gets
+its own shell, started by a worker with:
+  - rlimits on CPU time, address space, written file size and open files
+  - a private mount namespace in which the server's code, configuration, keys
+    and databases (`hidden_paths`) are covered by empty read-only mounts
+  - a separate unprivileged uid (SHELL_TOOL_USER) when the server runs as
+    root; otherwise the server's uid inside a user namespace, with no
+    capabilities left once the shell starts
+  - a private network namespace (no interfaces but loopback)
+  - a scratch working directory and a minimal environment (no API keys)
+  - a wall-clock timeout that kills the whole process group
+Isolation is fail-closed: if a namespace, mount or uid switch fails, the
+command is refused.
+Output is read up to `max_output` bytes; anything beyond is dropped and the
+command is killed.
+
+Concurrency is capped per user and in total; requests over the caps are
+refused immediately rather than queued behind long-running commands.
+"""
+import asyncio
+import ctypes
+import logging
+import os
+import selectors
+import shutil
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from flask import current_app
+
+from app.utils.metrics import metrics
+from app.utils.process_pool import pool_context
+
+logger = logging.getLogger(__name__)
+
+_CLONE_NEWNS = 0x00020000
+_CLONE_NEWUSER = 0x10000000
+_CLONE_NEWNET = 0x40000000
+_MS_RDONLY, _MS_NOSUID, _MS_NODEV, _MS_NOEXEC = 0x1, 0x2, 0x4, 0x8
+_MS_BIND = 0x1000
+_MS_REC = 0x4000
+_MS_PRIVATE = 0x40000
+_SAFE_ENV = {'PATH': '/usr/local/bin:/usr/bin:/bin', 'LANG': 'C.UTF-8'}
+
+
+class SandboxBusy(Exception):
+    """Raised when the user (or the whole process) already runs the maximum number of commands."""
+
+
+# --- Worker side (runs in the pool processes) ---
+
+def _libc_call(name, *args):
+    if getattr(ctypes.CDLL(None, use_errno=True), name)(*args) != 0:
+        errno = ctypes.get_errno()
+        raise OSError(errno, f"{name}: {os.strerror(errno)}")
+
+
+def _unshare(flags):
+    unshare = getattr(os, 'unshare', None)  # Python 3.12+
+    if unshare is not None:
+        unshare(flags)
+    else:
+        _libc_call('unshare', flags)
+
+
+def _mount(source, target, fstype, flags, data=None):
+    encode = lambda value: value.encode() if value is not None else None
+    _libc_call('mount', encode(source), encode(target), encode(fstype), flags, encode(data))
+
+
+def _write(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def _enter_namespaces(isolate_network):
+    """Move the calling process into private mount (and network) namespaces. Raises OSError if not permitted."""
+    flags = _CLONE_NEWNS | (_CLONE_NEWNET if isolate_network else 0)
+    if os.geteuid() == 0:
+        _unshare(flags)
+        return
+    # Unprivileged servers need a user namespace too. Only our own ids are mapped (not root),
+    # so the shell has no capabilities after exec and can't remove the mounts below
+    uid, gid = os.geteuid(), os.getegid()
+    _unshare(_CLONE_NEWUSER | flags)
+    _write('/proc/self/setgroups', 'deny')
+    _write('/proc/self/uid_map', f'{uid} {uid} 1')
+    _write('/proc/self/gid_map', f'{gid} {gid} 1')
+
+
+def _hide_paths(paths):
+    """Cover each path with an empty read-only mount (in this mount namespace only)."""
+    _mount(None, '/', None, _MS_REC | _MS_PRIVATE)  # Keep the mounts below out of the host's namespace
+    for path in paths:
+        if os.path.isdir(path):
+            _mount('tmpfs', path, 'tmpfs', _MS_RDONLY | _MS_NOSUID | _MS_NODEV | _MS_NOEXEC, 'size=4k,mode=755')
+        elif os.path.exists(path):
+            _mount('/dev/null', path, None, _MS_BIND)
+
+
+def _account(limits):
+    """(uid, gid) of SHELL_TOOL_USER when the worker runs as root, else None. Raises if it can't be used."""
+    if os.geteuid() != 0:
+        return None
+    import pwd
+    try:
+        entry = pwd.getpwnam(limits['user'] or '')
+    except KeyError:
+        raise OSError(f"user {limits['user']!r} does not exist") from None
+    if entry.pw_uid == 0:
+        raise OSError(f"user {limits['user']!r} is root")
+    return entry.pw_uid, entry.pw_gid
+
+
+def _limit_child(limits, hidden_paths, account):
+    """preexec_fn: applied in the forked child just before the shell is exec'd."""
+    import resource
+    cpu = limits['cpu_seconds']
+    resource.setrlimit(resource.RLIMIT_CPU, (cpu, cpu + 1))
+    resource.setrlimit(resource.RLIMIT_AS, (limits['memory_bytes'],) * 2)
+    resource.setrlimit(resource.RLIMIT_FSIZE, (limits['file_bytes'],) * 2)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (limits['open_files'],) * 2)
+    resource.setrlimit(resource.RLIMIT_CORE, (0, 0))
+    if limits['max_processes']:
+        resource.setrlimit(resource.RLIMIT_NPROC, (limits['max_processes'],) * 2)
+    _enter_namespaces(limits['isolate_network'])
+    _hide_paths(hidden_paths)
+    if account is not None:
+        uid, gid = account
+        os.setgroups([])
+        os.setgid(gid)
+        os.setuid(uid)
+
+
+def _exited(process):
+    """True once the shell has exited (without reaping it)."""
+    return os.waitid(os.P_PID, process.pid, os.WEXITED | os.WNOHANG | os.WNOWAIT) is not None
+
+
+def _finish(process, grace):
+    """Give the shell `grace` seconds to exit, then kill its whole process group and reap it."""
+    deadline = time.monotonic() + grace
+    # WNOWAIT leaves the shell unreaped, so its group id can't be reused before the kill
+    while not _exited(process):
+        if time.monotonic() >= deadline:
+            break
+        time.sleep(0.01)
+    try:
+        os.killpg(process.pid, signal.SIGKILL)  # Also removes background children left behind
+    except ProcessLookupError:
+        pass
+    return process.wait()
+
+
+def run_command(command, timeout, limits):
+    """
+    Run `command` in a limited shell. Returns a dict with returncode, stdout,
+    stderr, truncated and timed_out. Executed inside a pool worker.
+    """
+    workdir = tempfile.mkdtemp(prefix='sandbox-')
+    # Directories holding the scratch directory stay visible, or the command couldn't use it
+    hidden_paths = [path for path in limits['hidden_paths']
+                    if os.path.commonpath([path, workdir]) != path]
+    try:
+        account = _account(limits)
+        if account is not None:
+            os.chown(workdir, *account)
+        process = subprocess.Popen(
+            command, shell=True, cwd=workdir, env={**_SAFE_ENV, 'HOME': workdir, 'TMPDIR': workdir},
+            stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            preexec_fn=lambda: _limit_child(limits, hidden_paths, account), start_new_session=True,
+        )
+    except (OSError, subprocess.SubprocessError) as e:  # SubprocessError: raised from preexec_fn
+        shutil.rmtree(workdir, ignore_errors=True)
+        return {'returncode': None, 'stdout': '', 'stderr': f'Sandbox setup failed: {e}',
+                'truncated': False, 'timed_out': False}
+
+    budget = limits['max_output']
+    output = {process.stdout: bytearray(), process.stderr: bytearray()}
+    truncated = timed_out = False
+    deadline = time.monotonic() + timeout
+    with selectors.DefaultSelector() as selector:
+        for stream in output:
+            selector.register(stream, selectors.EVENT_READ)
+        while selector.get_map():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                timed_out = True
+                break
+            events = selector.select(min(remaining, 0.1))
+            if not events and _exited(process):
+                break  # Background children may hold the pipes open; the command itself is done
+            for key, _ in events:
+                chunk = os.read(key.fd, 65536)
+                if not chunk:
+                    selector.unregister(key.fileobj)
+                    continue
+                used = sum(len(buffer) for buffer in output.values())
+                output[key.fileobj] += chunk[:max(0, budget - used)]
+                if used + len(chunk) > budget:
+                    truncated = True
+            if truncated:
+                break
+    returncode = _finish(process, 0 if timed_out or truncated else 1.0)
+    process.stdout.close()
+    process.stderr.close()
+    shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        'returncode': returncode,
+        'stdout': output[process.stdout].decode('utf-8', 'replace'),
+        'stderr': output[process.stderr].decode('utf-8', 'replace'),
+        'truncated': truncated,
+        'timed_out': timed_out,
+    }
+
+
+def _ready():
+    return os.getpid()
+
+
+# --- App side ---
+
+class ShellSandbox:
+    def __init__(self, workers=2, max_per_user=1, max_pending=None, max_timeout=30, cpu_seconds=None,
+                 memory_mb=512, file_mb=16, open_files=256, max_processes=0, max_output=64 * 1024,
+                 isolate_network=True, user='nobody', hidden_paths=()):
+        self.workers = workers
+        self.max_per_user = max_per_user
+        self.max_pending = max_pending or workers * 2
+        self.max_timeout = max_timeout
+        self.limits = {
+            'cpu_seconds': cpu_seconds or max_timeout,
+            'memory_bytes': memory_mb * 1024 * 1024,
+            'file_bytes': file_mb * 1024 * 1024,
+            'open_files': open_files,
+            'max_processes': max_processes,
+            'max_output': max_output,
+            'isolate_network': isolate_network,
+            'user': user,
+            'hidden_paths': sorted(set(hidden_paths)),
+        }
+        self._lock = threading.Lock()
+        self._running = {}  # user_id -> commands in flight
+        self._total = 0
+        self._executor = None
+        self._pid = None
+
+    def _get_executor(self):
+        # Pools don't survive fork (e.g. gunicorn workers); build one per process
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                context = pool_context(__name__)
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+                self._pid = os.getpid()
+                # Start every worker now, rather than on the first commands
+                for _ in range(self.workers):
+                    self._executor.submit(_ready)
+                logger.info(f"[SANDBOX] Started pool with {self.workers} workers (pid {self._pid})")
+            return self._executor
+
+    def start(self):
+        self._get_executor()
+
+    def _admit(self, user_id):
+        with self._lock:
+            if self._total >= self.max_pending:
+                raise SandboxBusy("Too many commands are running, try again shortly")
+            if self._running.get(user_id, 0) >= self.max_per_user:
+                raise SandboxBusy("A command is already running for this user")
+            self._running[user_id] = self._running.get(user_id, 0) + 1
+            self._total += 1
+
+    def _release(self, user_id):
+        with self._lock:
+            self._total -= 1
+            if self._running.get(user_id, 0) <= 1:
+                self._running.pop(user_id, None)
+            else:
+                self._running[user_id] -= 1
+
+    async def run(self, command, timeout=10, user_id=None):
+        """Run a command in the pool without blocking the event loop. Raises SandboxBusy."""
+        timeout = max(1, min(int(timeout or 10), self.max_timeout))
+        self._admit(user_id)
+        started = time.monotonic()
+        executor = None
+        try:
+            executor = self._get_executor()
+            future = executor.submit(run_command, command, timeout, self.limits)
+            # The slot is held until the worker is done with the command, even if the caller stops
+            # waiting (timeout or cancellation only drop the command while it is still queued)
+            future.add_done_callback(lambda _: self._release(user_id))
+        except BaseException as e:
+            self._release(user_id)
+            if isinstance(e, BrokenProcessPool):
+                self._discard(executor)
+            raise
+        try:
+            # The worker enforces the timeout; the margin covers queueing behind other commands
+            result = await asyncio.wait_for(asyncio.wrap_future(future), timeout * 2 + 5)
+        except BrokenProcessPool:
+            self._discard(executor)
+            raise
+        metrics.observe('sandbox.run_seconds', time.monotonic() - started)
+        if result['timed_out']:
+            metrics.incr('sandbox.timeouts')
+        return result
+
+    def _discard(self, executor):
+        # A worker died (e.g. killed by the OOM killer); start a fresh pool for the next command
+        logger.error("[SANDBOX] Worker pool broke, restarting it")
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def _server_paths(app):
+    """Paths commands must not see: the code, instance folder, working directory, home and databases."""
+    paths = [os.path.dirname(app.root_path), app.instance_path, os.getcwd(), os.path.expanduser('~')]
+    for key in ('DATABASE_PATH', 'ARCHIVE_DATABASE_PATH'):
+        path = app.config.get(key)
+        if path and path != ':memory:':
+            paths.append(os.path.dirname(os.path.abspath(path)))
+    paths.extend(app.config.get('SHELL_TOOL_HIDDEN_PATHS') or [])
+    return {os.path.realpath(path) for path in paths if path and os.path.realpath(path) != '/'}
+
+
+def get_shell_sandbox(app=None):
+    """Return the app's ShellSandbox, creating it on first use."""
+    app = app or current_app._get_current_object()
+    sandbox = app.extensions.get('shell_sandbox')
+    if sandbox is None:
+        sandbox = app.extensions.setdefault('shell_sandbox', ShellSandbox(
+            workers=app.config.get('SHELL_TOOL_WORKERS', 2),
+            max_per_user=app.config.get('SHELL_TOOL_MAX_PER_USER', 1),
+            max_pending=app.config.get('SHELL_TOOL_MAX_PENDING'),
+            max_timeout=app.config.get('SHELL_TOOL_MAX_TIMEOUT', 30),
+            memory_mb=app.config.get('SHELL_TOOL_MEMORY_MB', 512),
+            file_mb=app.config.get('SHELL_TOOL_FILE_MB', 16),
+            max_processes=app.config.get('SHELL_TOOL_MAX_PROCESSES', 0),
+            max_output=app.config.get('SHELL_TOOL_MAX_OUTPUT', 64 * 1024),
+            isolate_network=app.config.get('SHELL_TOOL_ISOLATE_NETWORK', True),
+            user=app.config.get('SHELL_TOOL_USER', 'nobody'),
+            hidden_paths=_server_paths(app),
+        ))
+    return sandbox
@@ -1,10 +1,30 @@
 # app/tools/shell_tool.py
-import subprocess
+import logging
 from typing import Optional
-from agents import function_tool
+from agents import function_tool, RunContextWrapper
+
+from app.tools.context import ToolContext
+from app.tools.sandbox import get_shell_sandbox, SandboxBusy
+
+logger = logging.getLogger(__name__)
+
+
+def format_result(result):
+    """Turn a sandbox result into the text returned to the model."""
+    if result['returncode'] is None:
+        return f"Error: {result['stderr']}"
+    note = ''
+    if result['timed_out']:
+        note = '\n[Command timed out and was killed]'
+    elif result['truncated']:
+        note = '\n[Output truncated]'
+    if result['returncode'] != 0 and not result['timed_out']:
+        return f"Error (exit code {result['returncode']}):\n{result['stderr'] or result['stdout']}{note}"
+    return (result['stdout'] or "[Command executed successfully with no output]") + note
+
 
 @function_tool
-def execute_shell_command(command: str, timeout: Optional[int] = 10) -> str:
+async def execute_shell_command(ctx: RunContextWrapper[ToolContext], command: str, timeout: Optional[int] = 10) -> str:
     """
     Execute a shell command and return its output.
     
@@ -15,21 +35,12 @@ def execute_shell_command(command: str, timeout: Optional[int] = 10) -> str:
     Returns:
         Output from the command execution.
     """
+    # Runs in a sandboxed worker process; only awaits here, so the event loop stays free
     try:
-        # Set up safe execution environment
-        process = subprocess.run(
-            command,
-            shell=True,
-            capture_output=True,
-            text=True,
-            timeout=timeout
-        )
-        
-        if process.returncode != 0:
-            return f"Error (exit code {process.returncode}):\n{process.stderr}"
-        
-        return process.stdout or "[Command executed successfully with no output]"
-    except subprocess.TimeoutExpired:
-        return f"Error: Command timed out after {timeout} seconds"
+        result = await get_shell_sandbox(ctx.context.app).run(command, timeout, user_id=ctx.context.user_id)
+        return format_result(result)
+    except SandboxBusy as e:
+        return f"Error: {e}"
     except Exception as e:
+        logger.error(f"[SHELL_TOOL] Error executing command: {e}", exc_info=True)
         return f"Error executing command: {str(e)}"
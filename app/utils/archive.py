@@ -0,0 +1,176 @@
+# app/utils/archive.py
+"""
+Cold storage for idle conversations.
+
+Conversations untouched for ARCHIVE_IDLE_DAYS have their messages moved out of
+the hot `messages` table into a separate SQLite file (ARCHIVE_DATABASE_PATH,
+ATTACHed as `archive`), stored as one compressed payload per conversation.
+The `conversations` row stays in the hot database with `archived_at` set, so
+listings and ownership checks are unaffected; `Conversation.get_by_id`
+restores the messages on first access.
+
+A background job (`conversations.archive_idle`) sweeps for idle conversations
+every ARCHIVE_INTERVAL seconds; `flask archive-conversations` runs a sweep
+manually.
+"""
+import datetime
+import json
+import logging
+
+import click
+from flask import current_app
+
+from app.services.jobs import enqueue, job
+from app.utils.db import get_db, get_backend
+from app.utils.compression import compress_payload, decompress_payload, compress_text, row_content
+
+logger = logging.getLogger(__name__)
+
+
+def attach_archive(db=None):
+    """
+    Make the `archive` namespace available on this connection (an ATTACHed file
+    on SQLite, a schema on PostgreSQL) and make sure its table exists.
+    """
+    db = db or get_db()
+    if get_backend().attach_archive(db, current_app.config['ARCHIVE_DATABASE_PATH']):
+        db.execute('''
+        CREATE TABLE IF NOT EXISTS archive.archived_conversations (
+            conversation_id INTEGER PRIMARY KEY,
+            payload BLOB NOT NULL,
+            encoding TEXT NOT NULL,
+            message_count INTEGER NOT NULL,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''')
+        db.commit()
+    return db
+
+
+def archive_conversation(db, conversation_id):
+    """Move one conversation's messages into the archive. Caller commits."""
+    rows = db.execute(
+        'SELECT * FROM messages WHERE conversation_id = ? ORDER BY id ASC', (conversation_id,)
+    ).fetchall()
+    payload = json.dumps([
+        {'id': row['id'], 'role': row['role'], 'content': row_content(row), 'created_at': row['created_at'],
+         'parent_id': row['parent_id']}
+        for row in rows
+    ]).encode('utf-8')
+    algorithm = current_app.config.get('MESSAGE_COMPRESSION')
+    blob, encoding = compress_payload(payload, algorithm if algorithm in ('zstd', 'zlib') else 'zlib')
+    db.execute('DELETE FROM archive.archived_conversations WHERE conversation_id = ?', (conversation_id,))
+    db.execute(
+        'INSERT INTO archive.archived_conversations (conversation_id, payload, encoding, message_count) '
+        'VALUES (?, ?, ?, ?)',
+        (conversation_id, blob, encoding, len(rows))
+    )
+    db.execute('DELETE FROM messages WHERE conversation_id = ?', (conversation_id,))
+    db.execute('UPDATE conversations SET archived_at = CURRENT_TIMESTAMP WHERE id = ?', (conversation_id,))
+    return len(rows)
+
+
+def restore_conversation(conversation_id):
+    """Move an archived conversation's messages back into the hot table."""
+    db = attach_archive()
+    row = db.execute(
+        'SELECT payload, encoding FROM archive.archived_conversations WHERE conversation_id = ?',
+        (conversation_id,)
+    ).fetchone()
+    try:
+        if row is not None:
+            messages = json.loads(decompress_payload(row['payload'], row['encoding']))
+            rows = []
+            previous_id = None
+            for m in messages:
+                blob, encoding = compress_text(m['content'])
+                # Payloads archived before message trees are linear: each message follows the previous one
+                parent_id = m['parent_id'] if 'parent_id' in m else previous_id
+                rows.append((m['id'], conversation_id, m['role'], m['content'] if encoding is None else '',
+                             blob, encoding, m['created_at'], parent_id))
+                previous_id = m['id']
+            # Original ids are kept so message ordering (ORDER BY id) and parent links are preserved
+            db.executemany(
+                'INSERT OR IGNORE INTO messages (id, conversation_id, role, content, content_blob, content_encoding, '
+                'created_at, parent_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                rows
+            )
+            db.execute('DELETE FROM archive.archived_conversations WHERE conversation_id = ?', (conversation_id,))
+            if previous_id is not None:
+                db.execute('UPDATE conversations SET active_message_id = ? WHERE id = ? AND active_message_id IS NULL',
+                           (previous_id, conversation_id))
+        # Restoring counts as activity, so the idle sweep doesn't archive it again straight away
+        db.execute('UPDATE conversations SET archived_at = NULL, updated_at = CURRENT_TIMESTAMP WHERE id = ?',
+                   (conversation_id,))
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    logger.info(f"[ARCHIVE] Restored conversation {conversation_id}")
+
+
+def archive_idle_conversations(idle_days=None, batch_size=100, max_batches=None):
+    """
+    Archive conversations idle for more than `idle_days`, one transaction per
+    batch so the writer lock is released regularly. Returns the number archived.
+    """
+    idle_days = current_app.config.get('ARCHIVE_IDLE_DAYS', 90) if idle_days is None else idle_days
+    db = attach_archive()
+    # Timestamps are stored as UTC 'YYYY-MM-DD HH:MM:SS'
+    cutoff = (datetime.datetime.utcnow() - datetime.timedelta(days=idle_days)).strftime('%Y-%m-%d %H:%M:%S')
+    archived = batches = 0
+    while max_batches is None or batches < max_batches:
+        ids = [row['id'] for row in db.execute(
+            'SELECT id FROM conversations WHERE archived_at IS NULL AND deleted_at IS NULL AND updated_at < ? '
+            'ORDER BY updated_at LIMIT ?',
+            (cutoff, batch_size)
+        ).fetchall()]
+        if not ids:
+            break
+        try:
+            for conversation_id in ids:
+                archive_conversation(db, conversation_id)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        archived += len(ids)
+        batches += 1
+    if archived:
+        logger.info(f"[ARCHIVE] Archived {archived} conversations idle > {idle_days} days")
+    return archived
+
+
+@job('conversations.archive_idle')
+def archive_job(batch_size=100):
+    try:
+        archive_idle_conversations(batch_size=batch_size)
+    finally:
+        schedule_archive()  # The next sweep, whether or not this one failed
+
+
+def schedule_archive(app=None, delay=None):
+    """Queue the next idle sweep in ARCHIVE_INTERVAL seconds (or `delay`); at most one is queued at a time."""
+    app = app or current_app._get_current_object()
+    interval = app.config.get('ARCHIVE_INTERVAL', 24 * 3600)
+    if interval <= 0 or app.config.get('JOBS_WORKERS', 2) <= 0:
+        return  # Disabled, or jobs run inline (the sweep would reschedule itself at once)
+    enqueue('conversations.archive_idle', {'batch_size': app.config.get('ARCHIVE_BATCH_SIZE', 100)},
+            delay=interval if delay is None else delay, unique=True, app=app)
+
+
+def init_app(app):
+    """Schedule the idle sweep with the first request and register the `flask archive-conversations` command."""
+
+    @app.before_request
+    def schedule_first_sweep():
+        # Once per process; the job reschedules itself, and the queued job survives restarts
+        if not app.extensions.get('archive_scheduled'):
+            app.extensions['archive_scheduled'] = True
+            schedule_archive(app, delay=60)
+
+    @app.cli.command('archive-conversations')
+    @click.option('--idle-days', type=int, default=None, help='Defaults to ARCHIVE_IDLE_DAYS.')
+    @click.option('--batch-size', default=100)
+    def archive_conversations_command(idle_days, batch_size):
+        click.echo(f"Archived {archive_idle_conversations(idle_days, batch_size)} conversations")
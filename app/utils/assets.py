@@ -0,0 +1,145 @@
+# app/utils/assets.py
+"""
+Fingerprinted, pre-compressed static assets.
+
+`flask build-assets` copies every CSS/JS file under static/ to
+static/<ASSETS_DIST>/ with a content hash in its name (js/script.js ->
+dist/js/script.3f2a9c1b0d.js), next to .gz and (with the optional `brotli`
+package) .br variants compressed at maximum level, and writes a manifest
+mapping logical names to built ones. Literal `/static/<name>` references
+between assets (e.g. the Markdown worker loading marked.min.js) are rewritten
+to the built names first, so a change to a dependency changes its dependents'
+hashes too.
+
+Templates link assets with `asset_url('js/script.js')`, which resolves through
+the manifest (and falls back to the plain file when nothing was built). Built
+files are served with the best pre-compressed variant the client accepts and
+`Cache-Control: public, max-age=ASSETS_MAX_AGE, immutable`.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import shutil
+
+import click
+from flask import current_app, request, send_file, url_for
+from werkzeug.security import safe_join
+
+try:
+    import brotli
+except ImportError:  # Optional dependency; only .gz variants are built without it
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+EXTENSIONS = ('.css', '.js')
+MANIFEST = 'manifest.json'
+_ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _sources(static_folder, dist):
+    for root, dirs, files in os.walk(static_folder):
+        dirs[:] = sorted(d for d in dirs if os.path.join(root, d) != os.path.join(static_folder, dist))
+        for name in sorted(files):
+            if name.endswith(EXTENSIONS):
+                yield os.path.relpath(os.path.join(root, name), static_folder).replace(os.sep, '/')
+
+
+def build_assets(static_folder, dist='dist', static_url='/static'):
+    """Build fingerprinted, compressed copies of all CSS/JS assets. Returns the manifest."""
+    out = os.path.join(static_folder, dist)
+    shutil.rmtree(out, ignore_errors=True)
+    os.makedirs(out)
+    contents = {}
+    for name in _sources(static_folder, dist):
+        with open(os.path.join(static_folder, name), 'rb') as f:
+            contents[name] = f.read()
+
+    # Dependencies first: an asset is built once the assets it references are
+    references = {
+        name: {other for other in contents if other != name and f'{static_url}/{other}'.encode() in data}
+        for name, data in contents.items()
+    }
+    manifest = {}
+    while len(manifest) < len(contents):
+        ready = [name for name in contents if name not in manifest and references[name] <= manifest.keys()]
+        if not ready:  # Reference cycle; build the rest without rewriting those references
+            ready = [name for name in contents if name not in manifest]
+        for name in ready:
+            data = contents[name]
+            for other in references[name] & manifest.keys():
+                data = data.replace(f'{static_url}/{other}'.encode(), f'{static_url}/{manifest[other]}'.encode())
+            stem, extension = os.path.splitext(name)
+            built = f'{dist}/{stem}.{hashlib.sha256(data).hexdigest()[:10]}{extension}'
+            path = os.path.join(static_folder, built)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(data)
+            with open(path + '.gz', 'wb') as f:
+                # mtime=0 keeps the output byte-identical across builds
+                f.write(gzip.compress(data, compresslevel=9, mtime=0))
+            if brotli is not None:
+                with open(path + '.br', 'wb') as f:
+                    f.write(brotli.compress(data, quality=11))
+            manifest[name] = built
+
+    with open(os.path.join(out, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    logger.info(f"[ASSETS] Built {len(manifest)} assets into {out} (brotli: {brotli is not None})")
+    return manifest
+
+
+def get_manifest(app=None):
+    """The app's asset manifest ({} if assets were not built or ASSETS_MANIFEST is off), loaded once."""
+    app = app or current_app._get_current_object()
+    manifest = app.extensions.get('assets_manifest')
+    if manifest is None:
+        manifest = {}
+        path = os.path.join(app.static_folder, app.config.get('ASSETS_DIST', 'dist'), MANIFEST)
+        if app.config.get('ASSETS_MANIFEST', True) and os.path.exists(path):
+            with open(path) as f:
+                manifest = json.load(f)
+            logger.info(f"[ASSETS] Serving {len(manifest)} fingerprinted assets")
+        manifest = app.extensions.setdefault('assets_manifest', manifest)
+    return manifest
+
+
+def asset_url(filename):
+    """URL of a static asset: its fingerprinted build if there is one, else the plain file."""
+    return url_for('static', filename=get_manifest().get(filename, filename))
+
+
+def init_app(app):
+    """Serve built assets pre-compressed and immutable; register `asset_url` and `flask build-assets`."""
+    dist = app.config.get('ASSETS_DIST', 'dist')
+    app.jinja_env.globals['asset_url'] = asset_url
+
+    def static(filename):
+        if not filename.startswith(f'{dist}/'):
+            return app.send_static_file(filename)
+        path = safe_join(os.path.join(app.static_folder, dist), filename[len(dist) + 1:])  # Stays inside dist/
+        if path is None or not os.path.isfile(path):
+            return app.send_static_file(filename)  # 404
+        # The name changes with the content, so clients never need to revalidate
+        max_age = app.config.get('ASSETS_MAX_AGE', 365 * 24 * 3600)
+        for encoding, suffix in _ENCODINGS:
+            if encoding in request.accept_encodings and os.path.isfile(path + suffix):
+                response = send_file(path + suffix, mimetype=mimetypes.guess_type(filename)[0], max_age=max_age)
+                response.headers['Content-Encoding'] = encoding
+                break
+        else:
+            response = send_file(path, max_age=max_age)
+        response.headers.pop('Content-Disposition', None)
+        response.cache_control.immutable = True
+        response.vary.add('Accept-Encoding')
+        return response
+
+    app.view_functions['static'] = static
+
+    @app.cli.command('build-assets')
+    def build_assets_command():
+        manifest = build_assets(app.static_folder, dist, app.static_url_path)
+        click.echo(f"Built {len(manifest)} assets into {os.path.join(app.static_folder, dist)}")
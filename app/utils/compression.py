@@ -0,0 +1,214 @@
+# app/utils/compression.py
+"""
+Transparent compression for long message content.
+
+Messages shorter than MESSAGE_COMPRESSION_THRESHOLD bytes are stored as plain
+TEXT. Longer ones are compressed into `messages.content_blob` and tagged in
+`messages.content_encoding`:
+  - 'zlib'          stdlib zlib
+  - 'zstd'          zstandard (optional dependency)
+  - 'zstd:<id>'     zstandard with the trained dictionary `compression_dictionaries.id`
+Compression is only kept when it actually saves space.
+"""
+import logging
+import threading
+import time
+import zlib
+
+import click
+from flask import current_app
+
+from app.utils.db import get_backend, get_db
+
+try:
+    import zstandard
+except ImportError:  # Optional dependency
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+# Trained dictionaries are immutable once stored, so they can be cached per process
+_dictionaries = {}
+_dictionaries_lock = threading.Lock()
+_ACTIVE_DICTIONARY_TTL = 60  # seconds; a dictionary trained by another process is picked up after this
+
+
+def _load_dictionary(dict_id):
+    with _dictionaries_lock:
+        cached = _dictionaries.get(dict_id)
+    if cached is not None:
+        return cached
+    row = get_db().execute(
+        'SELECT data FROM compression_dictionaries WHERE id = ?', (dict_id,)
+    ).fetchone()
+    if row is None:
+        raise LookupError(f"Compression dictionary {dict_id} not found")
+    dictionary = zstandard.ZstdCompressionDict(bytes(row['data']))
+    with _dictionaries_lock:
+        _dictionaries[dict_id] = dictionary
+    return dictionary
+
+
+def _active_dictionary_id():
+    # Looked up on every compressed write, so cached per app (train_dictionary updates it)
+    cached = current_app.extensions.get('compression_dictionary')
+    if cached is not None and time.monotonic() - cached[1] < _ACTIVE_DICTIONARY_TTL:
+        return cached[0]
+    row = get_db().execute('SELECT MAX(id) AS id FROM compression_dictionaries').fetchone()
+    dict_id = row['id'] if row else None
+    current_app.extensions['compression_dictionary'] = (dict_id, time.monotonic())
+    return dict_id
+
+
+def _byte_length(column):
+    """SQL for the UTF-8 size of a text column; length() counts characters, the threshold is in bytes."""
+    if get_backend().dialect == 'sqlite':
+        return f'length(CAST({column} AS BLOB))'
+    return f'octet_length({column})'
+
+
+def _settings():
+    config = current_app.config
+    algorithm = (config.get('MESSAGE_COMPRESSION') or 'none').lower()
+    if algorithm == 'zstd' and zstandard is None:
+        algorithm = 'zlib'  # Fall back rather than failing writes
+    return algorithm, config.get('MESSAGE_COMPRESSION_THRESHOLD', 1024), config.get('MESSAGE_COMPRESSION_LEVEL', 6)
+
+
+def compress_payload(raw, algorithm=None):
+    """Compress bytes unconditionally with the configured (or given) algorithm. Returns (blob, encoding)."""
+    default_algorithm, _, level = _settings()
+    algorithm = algorithm or default_algorithm
+    if algorithm == 'zstd' and zstandard is None:
+        algorithm = 'zlib'  # Callers may ask for zstd explicitly (e.g. the archive); fall back like _settings
+    if algorithm == 'zstd':
+        dict_id = _active_dictionary_id() if current_app.config.get('MESSAGE_COMPRESSION_USE_DICTIONARY', True) else None
+        if dict_id is not None:
+            compressor = zstandard.ZstdCompressor(level=level, dict_data=_load_dictionary(dict_id))
+            return compressor.compress(raw), f'zstd:{dict_id}'
+        return zstandard.ZstdCompressor(level=level).compress(raw), 'zstd'
+    return zlib.compress(raw, level), 'zlib'
+
+
+def decompress_payload(blob, encoding):
+    """Inverse of compress_payload. Returns bytes."""
+    blob = bytes(blob)
+    if encoding == 'zlib':
+        return zlib.decompress(blob)
+    if encoding.startswith('zstd'):
+        if zstandard is None:
+            raise RuntimeError("zstandard is required to read zstd-compressed data")
+        if ':' in encoding:
+            dictionary = _load_dictionary(int(encoding.split(':', 1)[1]))
+            return zstandard.ZstdDecompressor(dict_data=dictionary).decompress(blob)
+        return zstandard.ZstdDecompressor().decompress(blob)
+    raise ValueError(f"Unknown content encoding: {encoding}")
+
+
+def compress_text(text, algorithm=None):
+    """
+    Compress `text` if it is long enough and compressible.
+    Returns (blob, encoding), or (None, None) to store it as plain text.
+    """
+    default_algorithm, threshold, _ = _settings()
+    algorithm = algorithm or default_algorithm
+    raw = text.encode('utf-8')
+    if algorithm == 'none' or len(raw) < threshold:
+        return None, None
+
+    blob, encoding = compress_payload(raw, algorithm)
+    # Not worth it for content that barely shrinks
+    if len(blob) > len(raw) * 0.9:
+        return None, None
+    return blob, encoding
+
+
+def decompress_text(blob, encoding):
+    """Inverse of compress_text."""
+    return decompress_payload(blob, encoding).decode('utf-8')
+
+
+def row_content(row):
+    """Return the message text for a messages row, decompressing if needed."""
+    if row['content_encoding']:
+        return decompress_text(row['content_blob'], row['content_encoding'])
+    return row['content']
+
+
+def train_dictionary(sample_limit=5000, dict_size=112640):
+    """Train a zstd dictionary on recent long messages and make it the active one. Returns its id."""
+    if zstandard is None:
+        raise RuntimeError("zstandard is required to train a dictionary")
+    db = get_db()
+    _, threshold, _ = _settings()
+    rows = db.execute(
+        'SELECT content, content_blob, content_encoding FROM messages '
+        f'WHERE {_byte_length("content")} >= ? OR content_encoding IS NOT NULL ORDER BY id DESC LIMIT ?',
+        (threshold, sample_limit)
+    ).fetchall()
+    samples = [row_content(row).encode('utf-8') for row in rows]
+    if len(samples) < 10:
+        raise ValueError("Not enough long messages to train a dictionary")
+    dictionary = zstandard.train_dictionary(dict_size, samples)
+    cursor = db.execute(
+        "INSERT INTO compression_dictionaries (algorithm, data) VALUES ('zstd', ?)",
+        (dictionary.as_bytes(),)
+    )
+    db.commit()
+    current_app.extensions['compression_dictionary'] = (cursor.lastrowid, time.monotonic())
+    logger.info(f"[COMPRESSION] Trained dictionary {cursor.lastrowid} from {len(samples)} samples")
+    return cursor.lastrowid
+
+
+def migrate_messages(batch_size=500, recompress=False):
+    """
+    Compress existing plain messages above the threshold (and, with
+    `recompress`, re-encode compressed ones with the current settings).
+    Commits per batch so the writer lock is never held for long. Returns the number of rows changed.
+    """
+    db = get_db()
+    _, threshold, _ = _settings()
+    condition = f'content_encoding IS NULL AND {_byte_length("content")} >= ?'
+    if recompress:
+        condition = f'({condition}) OR content_encoding IS NOT NULL'
+    changed = 0
+    last_id = 0
+    while True:
+        rows = db.execute(
+            f'SELECT id, content, content_blob, content_encoding FROM messages '
+            f'WHERE id > ? AND ({condition}) ORDER BY id LIMIT ?',
+            (last_id, threshold, batch_size)
+        ).fetchall()
+        if not rows:
+            break
+        updates = []
+        for row in rows:
+            blob, encoding = compress_text(row_content(row))
+            if encoding is not None and encoding != row['content_encoding']:
+                updates.append(('', blob, encoding, row['id']))
+            elif encoding is None and row['content_encoding']:
+                updates.append((row_content(row), None, None, row['id']))
+        db.executemany(
+            'UPDATE messages SET content = ?, content_blob = ?, content_encoding = ? WHERE id = ?',
+            updates
+        )
+        db.commit()
+        changed += len(updates)
+        last_id = rows[-1]['id']
+    logger.info(f"[COMPRESSION] Migrated {changed} messages")
+    return changed
+
+
+def init_app(app):
+    """Register compression maintenance commands (`flask compress-messages`, `flask train-compression-dict`)."""
+
+    @app.cli.command('compress-messages')
+    @click.option('--batch-size', default=500)
+    @click.option('--recompress', is_flag=True, help='Also re-encode already compressed messages.')
+    def compress_messages_command(batch_size, recompress):
+        click.echo(f"Compressed {migrate_messages(batch_size, recompress)} messages")
+
+    @app.cli.command('train-compression-dict')
+    @click.option('--samples', default=5000)
+    def train_dictionary_command(samples):
+        click.echo(f"Trained dictionary {train_dictionary(samples)}")
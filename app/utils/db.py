@@ -1,32 +1,166 @@
 # app/utils/db.py
+"""
+Database access. `get_db()` returns a per-request DB-API connection from the
+configured backend:
+  - SQLite (default): a file at DATABASE_PATH
+  - PostgreSQL: DATABASE_URL=postgresql://..., pooled (see app/utils/db_postgres.py)
+Models write SQLite-flavoured SQL; the PostgreSQL backend translates it.
+"""
 import sqlite3
 import os
+import click
 from flask import g, current_app
 
+
+class SQLiteBackend:
+    dialect = 'sqlite'
+
+    def __init__(self, path):
+        self.path = path
+
+    def connect(self):
+        # Ensure the instance directory exists
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        db = sqlite3.connect(self.path)
+        db.row_factory = sqlite3.Row  # Return rows as dict-like objects
+        db.execute('PRAGMA foreign_keys = ON')  # Off by default in SQLite; needed for ON DELETE CASCADE
+        return db
+
+    def release(self, db):
+        db.close()
+
+    def column_names(self, db, table):
+        schema, _, name = table.rpartition('.')
+        prefix = f'{schema}.' if schema else ''
+        return [row[1] for row in db.execute(f'PRAGMA {prefix}table_info({name})').fetchall()]
+
+    def attach_archive(self, db, path):
+        """ATTACH the archive file as `archive` on this connection; False if already attached."""
+        if 'archive' in [row[1] for row in db.execute('PRAGMA database_list').fetchall()]:
+            return False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        db.execute('ATTACH DATABASE ? AS archive', (path,))
+        return True
+
+    def close(self):
+        pass
+
+
+def create_backend(config):
+    """Build the storage backend selected by DATABASE_URL (SQLite at DATABASE_PATH if unset)."""
+    url = config.get('DATABASE_URL')
+    if url and url.startswith(('postgres://', 'postgresql://')):
+        from app.utils.db_postgres import PostgresBackend
+        return PostgresBackend(url, min_size=config.get('DB_POOL_MIN_SIZE', 1),
+                               max_size=config.get('DB_POOL_MAX_SIZE', 10))
+    if url and not url.startswith('sqlite:///'):
+        raise ValueError(f"Unsupported DATABASE_URL: {url}")
+    return SQLiteBackend(url[len('sqlite:///'):] if url else config['DATABASE_PATH'])
+
+
+def get_backend(app=None):
+    """Return the app's storage backend, creating it on first use."""
+    app = app or current_app._get_current_object()
+    backend = app.extensions.get('db_backend')
+    if backend is None:
+        backend = app.extensions.setdefault('db_backend', create_backend(app.config))
+    return backend
+
 def get_db():
-    """Get a connection to the SQLite database."""
+    """Get a database connection for the current request/app context."""
     if 'db' not in g:
-        # Ensure the instance directory exists
-        db_path = current_app.config['DATABASE_PATH']
-        os.makedirs(os.path.dirname(db_path), exist_ok=True)
-        
-        # Connect to the database
-        g.db = sqlite3.connect(db_path)
-        g.db.row_factory = sqlite3.Row  # Return rows as dict-like objects
+        g.db = get_backend().connect()
     
     return g.db
 
 def close_db(e=None):
-    """Close the database connection at the end of request."""
+    """Close (or return to the pool) the database connection at the end of request."""
     db = g.pop('db', None)
     if db is not None:
-        db.close()
+        get_backend().release(db)
+
+def ensure_column(db, table, column, definition):
+    """Add a column to an existing table if it is missing (lightweight migration)."""
+    if column not in get_backend().column_names(db, table):
+        db.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
 
 # app/utils/db.py (update init_db function)
 
-def init_db():
-    """Initialize the database tables."""
+MESSAGES_DDL = '''
+    CREATE TABLE {if_not_exists} {table} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        conversation_id INTEGER NOT NULL,
+        role TEXT NOT NULL,
+        content TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        content_blob BLOB,
+        content_encoding TEXT,
+        parent_id INTEGER,
+        FOREIGN KEY (conversation_id) REFERENCES conversations (id) ON DELETE CASCADE
+    )
+    '''
+MESSAGES_COLUMNS = 'id, conversation_id, role, content, created_at, content_blob, content_encoding, parent_id'
+
+def _migrate_messages_cascade(db):
+    """Rebuild a pre-existing SQLite messages table whose foreign key lacks ON DELETE CASCADE."""
+    foreign_keys = db.execute('PRAGMA foreign_key_list(messages)').fetchall()
+    if all(row['on_delete'] == 'CASCADE' for row in foreign_keys):
+        return
+    db.commit()
+    # SQLite can't alter a constraint; copy into a new table (foreign key checks off while swapping)
+    db.execute('PRAGMA foreign_keys = OFF')
+    try:
+        db.execute('DROP TABLE IF EXISTS messages_new')  # Left over from an interrupted migration
+        db.execute(MESSAGES_DDL.format(table='messages_new', if_not_exists=''))
+        db.execute(f'INSERT INTO messages_new ({MESSAGES_COLUMNS}) SELECT {MESSAGES_COLUMNS} FROM messages')
+        db.execute('DROP TABLE messages')
+        db.execute('ALTER TABLE messages_new RENAME TO messages')
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.execute('PRAGMA foreign_keys = ON')
+
+def _migrate_messages_cascade_postgres(db):
+    """Recreate a pre-existing PostgreSQL messages foreign key that lacks ON DELETE CASCADE."""
+    rows = db.execute(
+        "SELECT con.conname FROM pg_constraint con "
+        "JOIN pg_class rel ON rel.oid = con.conrelid "
+        "JOIN pg_namespace ns ON ns.oid = rel.relnamespace "
+        "WHERE ns.nspname = current_schema() AND rel.relname = 'messages' AND con.contype = 'f' "
+        "AND con.confrelid = 'conversations'::regclass AND con.confdeltype <> 'c'"
+    ).fetchall()
+    if not rows:
+        return
+    try:
+        # One statement, so the table is never left without the constraint
+        drops = ', '.join(f'DROP CONSTRAINT "{row["conname"]}"' for row in rows)
+        db.execute(f'ALTER TABLE messages {drops}, ADD CONSTRAINT messages_conversation_id_fkey '
+                   f'FOREIGN KEY (conversation_id) REFERENCES conversations (id) ON DELETE CASCADE')
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+# Bump whenever init_db() changes so existing databases run it once more on the next start
+SCHEMA_VERSION = 2  # 2: message trees (parent_id, active_message_id)
+
+def schema_version(db):
+    """Version recorded by the last completed init_db(), or None (new or older database)."""
+    try:
+        row = db.execute('SELECT version FROM schema_version').fetchone()
+    except Exception:  # No such table
+        db.rollback()  # PostgreSQL aborts the transaction on any error
+        return None
+    return row['version'] if row else None
+
+def init_db(force=False):
+    """Initialize the database tables. Skipped (returns False) when the schema is already current."""
     db = get_db()
+    version = schema_version(db)
+    if not force and version is not None and version >= SCHEMA_VERSION:  # >=: a newer deployment got here first
+        return False
     
     # Create users table (without email)
     db.execute('''
@@ -60,25 +194,148 @@ def init_db():
         title TEXT NOT NULL,
         created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
         updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        archived_at TIMESTAMP,
+        deleted_at TIMESTAMP,
+        title_pending INTEGER DEFAULT 0,
+        active_message_id INTEGER,
         FOREIGN KEY (user_id) REFERENCES users (id)
     )
     ''')
     
-    # Create messages table (unchanged)
+    # Create messages table; deleting a conversation deletes its messages
+    db.execute(MESSAGES_DDL.format(table='messages', if_not_exists='IF NOT EXISTS'))
+    # Databases created before the archive tier / message compression / soft delete / auto titles / branching
+    ensure_column(db, 'conversations', 'archived_at', 'TIMESTAMP')
+    ensure_column(db, 'conversations', 'deleted_at', 'TIMESTAMP')
+    ensure_column(db, 'conversations', 'title_pending', 'INTEGER DEFAULT 0')
+    ensure_column(db, 'conversations', 'active_message_id', 'INTEGER')
+    ensure_column(db, 'messages', 'content_blob', 'BLOB')
+    ensure_column(db, 'messages', 'content_encoding', 'TEXT')
+    ensure_column(db, 'messages', 'parent_id', 'INTEGER')
+    if get_backend().dialect == 'sqlite':
+        _migrate_messages_cascade(db)
+    else:
+        _migrate_messages_cascade_postgres(db)
+    
+    # Shared zstd dictionaries for message compression (see app/utils/compression.py)
     db.execute('''
-    CREATE TABLE IF NOT EXISTS messages (
+    CREATE TABLE IF NOT EXISTS compression_dictionaries (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
-        conversation_id INTEGER NOT NULL,
-        role TEXT NOT NULL,
+        algorithm TEXT NOT NULL,
+        data BLOB NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    
+    # Rendered HTML of assistant messages (see app/utils/markdown_render.py); a cache, safe to drop
+    db.execute('''
+    CREATE TABLE IF NOT EXISTS message_html (
+        message_id INTEGER PRIMARY KEY,
+        version INTEGER NOT NULL,
         content TEXT NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (conversation_id) REFERENCES conversations (id)
+        content_blob BLOB,
+        content_encoding TEXT,
+        FOREIGN KEY (message_id) REFERENCES messages (id) ON DELETE CASCADE
     )
     ''')
     
+    # Persistent background jobs (see app/services/jobs.py); times are epoch seconds
+    db.execute('''
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued',
+        attempts INTEGER NOT NULL DEFAULT 0,
+        max_attempts INTEGER NOT NULL DEFAULT 5,
+        run_at DOUBLE PRECISION NOT NULL,
+        locked_until DOUBLE PRECISION,
+        last_error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status_run_at ON jobs (status, run_at)')
+    
+    # Streamed generations shared across processes (STREAM_BROKER='database', see
+    # app/services/stream_broker.py); short-lived, times are epoch seconds
+    db.execute('''
+    CREATE TABLE IF NOT EXISTS stream_generations (
+        id TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        conversation_id INTEGER NOT NULL,
+        created_at DOUBLE PRECISION NOT NULL,
+        finished_at DOUBLE PRECISION
+    )
+    ''')
+    db.execute('''
+    CREATE TABLE IF NOT EXISTS stream_events (
+        generation_id TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        data TEXT,
+        PRIMARY KEY (generation_id, seq)
+    )
+    ''')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_stream_generations_conversation '
+               'ON stream_generations (conversation_id, created_at)')
+    
+    # Token usage per upstream request (see app/services/usage.py); `day` is the UTC date, 'YYYY-MM-DD'
+    db.execute('''
+    CREATE TABLE IF NOT EXISTS usage (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        conversation_id INTEGER,
+        model TEXT NOT NULL,
+        input_tokens INTEGER NOT NULL DEFAULT 0,
+        cached_tokens INTEGER NOT NULL DEFAULT 0,
+        output_tokens INTEGER NOT NULL DEFAULT 0,
+        latency_ms INTEGER,
+        streaming INTEGER NOT NULL DEFAULT 0,
+        day TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    # Quota lookups (one user, current month) and per-day reports
+    db.execute('CREATE INDEX IF NOT EXISTS idx_usage_user_day ON usage (user_id, day)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_usage_day ON usage (day)')
+    
+    # Indexes for the admin key listing filters (pagination itself walks the primary key)
+    db.execute('CREATE INDEX IF NOT EXISTS idx_registration_keys_is_used ON registration_keys (is_used, id)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_registration_keys_created_at ON registration_keys (created_at)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_registration_keys_used_by ON registration_keys (used_by)')
+    # Finds idle conversations for archival
+    db.execute('CREATE INDEX IF NOT EXISTS idx_conversations_updated_at ON conversations (updated_at)')
+    # Per-user listings, message loads and cascading deletes
+    db.execute('CREATE INDEX IF NOT EXISTS idx_conversations_user_id ON conversations (user_id, updated_at)')
+    db.execute('CREATE INDEX IF NOT EXISTS idx_messages_conversation_id ON messages (conversation_id, id)')
+    # Children of a message (branch switching, sibling lists); roots are parent_id IS NULL
+    db.execute('CREATE INDEX IF NOT EXISTS idx_messages_parent ON messages (conversation_id, parent_id, id)')
+    if version is None or version < 2:
+        # Conversations from before branching are a single branch: chain each message to the previous one
+        db.execute('UPDATE messages SET parent_id = (SELECT MAX(p.id) FROM messages p '
+                   'WHERE p.conversation_id = messages.conversation_id AND p.id < messages.id) '
+                   'WHERE parent_id IS NULL')
+        db.execute('UPDATE conversations SET active_message_id = '
+                   '(SELECT MAX(id) FROM messages WHERE conversation_id = conversations.id) '
+                   'WHERE active_message_id IS NULL')
+    # Soft-deleted conversations waiting to be purged
+    db.execute('CREATE INDEX IF NOT EXISTS idx_conversations_deleted_at ON conversations (deleted_at) '
+               'WHERE deleted_at IS NOT NULL')
+    
+    # Lets later starts skip all of the above
+    db.execute('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)')
+    db.execute('DELETE FROM schema_version')
+    db.execute('INSERT INTO schema_version (version) VALUES (?)', (max(SCHEMA_VERSION, version or 0),))
     db.commit()
+    return True
 
 
 def init_app(app):
     """Register database functions with the Flask app."""
     app.teardown_appcontext(close_db)
+
+    @app.cli.command('init-db')
+    def init_db_command():
+        """Create or upgrade all tables, even if the schema version is current."""
+        with app.app_context():
+            init_db(force=True)
+        click.echo(f"Database schema at version {SCHEMA_VERSION}")
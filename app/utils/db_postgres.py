@@ -0,0 +1,201 @@
+# app/utils/db_postgres.py
+"""
+PostgreSQL storage backend (optional; needs `psycopg[pool]`).
+
+The models talk DB-API with SQLite-flavoured SQL (`?` placeholders,
+`INSERT OR IGNORE`, `cursor.lastrowid`, `sqlite3.Row`-style rows).
+`PostgresConnection` wraps a pooled psycopg connection and translates that
+subset, so the same model code runs on either backend:
+  - `?` placeholders             -> `%s`
+  - `INSERT OR IGNORE INTO ...`  -> `INSERT INTO ... ON CONFLICT DO NOTHING`
+  - `CREATE/ALTER TABLE` types   -> BIGSERIAL / BYTEA / INTEGER flags
+  - `cursor.lastrowid`           -> `SELECT lastval()` (only when read)
+  - `connection.total_changes`   -> running sum of row counts
+Timestamps are returned as text, matching what SQLite returns.
+"""
+import functools
+import logging
+import os
+import re
+import threading
+
+try:
+    import psycopg
+    from psycopg.types.string import TextLoader
+    from psycopg_pool import ConnectionPool
+except ImportError:  # Optional dependency
+    psycopg = None
+
+logger = logging.getLogger(__name__)
+
+_DDL_REPLACEMENTS = [
+    (re.compile(r'INTEGER PRIMARY KEY AUTOINCREMENT', re.I), 'BIGSERIAL PRIMARY KEY'),
+    (re.compile(r'\bBLOB\b', re.I), 'BYTEA'),
+    # Flags are compared with 0/1 throughout the models
+    (re.compile(r'\bBOOLEAN DEFAULT 0\b', re.I), 'INTEGER DEFAULT 0'),
+]
+_INSERT_OR_IGNORE = re.compile(r'^\s*INSERT OR IGNORE INTO', re.I)
+
+
+@functools.lru_cache(maxsize=512)
+def translate(sql):
+    """Translate a SQLite-flavoured statement to PostgreSQL (cached; statements are literals)."""
+    out = []
+    quote = None
+    for char in sql:
+        if quote:
+            if char == quote:
+                quote = None
+        elif char in ("'", '"'):
+            quote = char
+        elif char == '?':
+            out.append('%s')
+            continue
+        if char == '%':
+            out.append('%%')
+            continue
+        out.append(char)
+    sql = ''.join(out)
+
+    if _INSERT_OR_IGNORE.match(sql):
+        sql = _INSERT_OR_IGNORE.sub('INSERT INTO', sql, count=1).rstrip().rstrip(';') + ' ON CONFLICT DO NOTHING'
+    elif sql.lstrip().upper().startswith(('CREATE TABLE', 'ALTER TABLE')):  # Also columns added by ensure_column
+        for pattern, replacement in _DDL_REPLACEMENTS:
+            sql = pattern.sub(replacement, sql)
+    return sql
+
+
+class Row(tuple):
+    """Row supporting both index and column-name access, like sqlite3.Row."""
+
+    def __new__(cls, values, columns):
+        row = super().__new__(cls, values)
+        row._columns = columns
+        return row
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return tuple.__getitem__(self, self._columns[key])
+        return tuple.__getitem__(self, key)
+
+    def keys(self):
+        return list(self._columns)
+
+
+class PostgresCursor:
+    def __init__(self, connection, cursor):
+        self._connection = connection
+        self._cursor = cursor
+
+    def _columns(self):
+        return {column.name: index for index, column in enumerate(self._cursor.description or ())}
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        return None if row is None else Row(row, self._columns())
+
+    def fetchall(self):
+        columns = self._columns()
+        return [Row(row, columns) for row in self._cursor.fetchall()]
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    @property
+    def lastrowid(self):
+        # lastval() is the id generated by the most recent INSERT on this connection
+        return self._connection.raw.execute('SELECT lastval()').fetchone()[0]
+
+
+class PostgresConnection:
+    """Minimal sqlite3.Connection look-alike over a psycopg connection."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.total_changes = 0
+
+    def _track(self, cursor):
+        if cursor.rowcount and cursor.rowcount > 0:
+            self.total_changes += cursor.rowcount
+        return PostgresCursor(self, cursor)
+
+    def execute(self, sql, params=()):
+        # Always pass a params sequence so '%%' escapes are interpreted consistently
+        return self._track(self.raw.execute(translate(sql), tuple(params)))
+
+    def executemany(self, sql, seq_of_params):
+        cursor = self.raw.cursor()
+        cursor.executemany(translate(sql), list(seq_of_params))
+        return self._track(cursor)
+
+    def commit(self):
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+
+class PostgresBackend:
+    dialect = 'postgresql'
+
+    def __init__(self, url, min_size=1, max_size=10):
+        if psycopg is None:
+            raise RuntimeError("DATABASE_URL points at PostgreSQL but psycopg[pool] is not installed")
+        self.url = url
+        self.min_size = min_size
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._pool = None
+        self._pid = None
+        self._archive_ready = False
+
+    @staticmethod
+    def _configure(raw):
+        # Hand timestamps back as text, as SQLite does, so API payloads are unchanged
+        for type_name in ('timestamp', 'timestamptz'):
+            raw.adapters.register_loader(type_name, TextLoader)
+
+    def _get_pool(self):
+        # Pools hold sockets and a maintenance thread; neither survives fork
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = ConnectionPool(
+                    self.url, min_size=self.min_size, max_size=self.max_size,
+                    configure=self._configure, open=True,
+                )
+                self._pid = os.getpid()
+                logger.info(f"[DB] Opened PostgreSQL pool (max {self.max_size}) in pid {self._pid}")
+            return self._pool
+
+    def connect(self):
+        return PostgresConnection(self._get_pool().getconn())
+
+    def release(self, db):
+        # The pool rolls back anything left uncommitted
+        self._get_pool().putconn(db.raw)
+
+    def column_names(self, db, table):
+        schema, _, name = table.rpartition('.')
+        rows = db.execute(
+            'SELECT column_name FROM information_schema.columns WHERE table_schema = ? AND table_name = ?',
+            (schema or 'public', name)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def attach_archive(self, db, path):
+        """The archive tier is a schema in the same database; True the first time (create its tables)."""
+        if self._archive_ready:
+            return False
+        db.execute('CREATE SCHEMA IF NOT EXISTS archive')
+        self._archive_ready = True
+        return True
+
+    def close(self):
+        with self._lock:
+            if self._pool is not None and self._pid == os.getpid():
+                self._pool.close()
+            self._pool = None
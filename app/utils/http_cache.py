@@ -0,0 +1,39 @@
+# app/utils/http_cache.py
+"""
+ETag / If-None-Match helpers for JSON endpoints.
+
+A view computes a cheap fingerprint of what it would return (e.g. a few
+indexed columns instead of the full payload), calls `not_modified(etag)` and
+returns its 304 response if the client's copy is current; otherwise it builds
+the body and passes the response through `with_etag`. Comparison is weak, so
+tags made weak by response compression still match.
+"""
+import hashlib
+import json
+
+from flask import make_response, request
+
+
+def make_etag(*parts):
+    """A short, stable tag for JSON-serialisable `parts`."""
+    data = json.dumps(parts, separators=(',', ':'), sort_keys=True, default=str).encode()
+    return hashlib.sha256(data).hexdigest()[:32]
+
+
+def not_modified(etag, public=False):
+    """Return a 304 response if the request's If-None-Match matches `etag`, else None."""
+    if not request.if_none_match.contains_weak(etag):
+        return None
+    return with_etag(('', 304), etag, public)
+
+
+def with_etag(response, etag, public=False):
+    """Tag a view's return value (response or (body, status) tuple) and make clients revalidate it."""
+    response = make_response(response)
+    response.set_etag(etag)
+    response.cache_control.no_cache = True  # Cache, but check the tag on every use
+    if public:
+        response.cache_control.public = True
+    else:
+        response.cache_control.private = True
+    return response
@@ -0,0 +1,229 @@
+# app/utils/markdown_render.py
+"""
+Server-side Markdown rendering (optional; needs the `markdown` package).
+
+Assistant replies can be rendered to HTML on the server so clients don't
+re-parse the whole answer on every streamed chunk:
+  - `IncrementalRenderer` splits a streamed answer into blocks at blank lines
+    outside fenced code, unless the next line continues the block (list
+    items, indented continuations, quotes, link definitions). Closed blocks
+    are rendered once; only the trailing, still-open block is re-rendered as
+    text arrives.
+  - Rendered HTML of stored replies is cached in the `message_html` table
+    (keyed by RENDER_VERSION), so history loads ship HTML as well.
+
+Model output is untrusted: raw HTML is escaped rather than passed through,
+and links/images with script-capable URLs are neutralised.
+"""
+import logging
+import re
+import threading
+import time
+
+try:
+    import markdown
+    from markdown.extensions import Extension
+    from markdown.treeprocessors import Treeprocessor
+except ImportError:  # Optional dependency
+    markdown = None
+
+from app.utils.compression import compress_text, row_content
+from app.utils.db import get_db
+
+logger = logging.getLogger(__name__)
+
+RENDER_VERSION = 1  # Bump when the rendering changes; older cached HTML is re-rendered
+# Matches marked's gfm + breaks options used by the client-side worker
+_EXTENSIONS = ['fenced_code', 'tables', 'sane_lists', 'nl2br']
+_SAFE_URL = re.compile(r'^(https?:|mailto:|#|/|[^:]*$)', re.I)
+_FENCE = re.compile(r'^ {0,3}(`{3,}|~{3,})')
+# A line after a blank line that may still belong to the block before it:
+# indented continuation, list item, blockquote or link definition
+_CONTINUES = re.compile(r'^(?:[ \t]| {0,3}(?:[-*+]|\d{1,9}[.)])(?:[ \t]|$)| {0,3}>| {0,3}\[[^\]]+\]:)')
+_LINK_DEFINITION = re.compile(r'^ {0,3}\[[^\]]+\]:\s*\S')
+
+_local = threading.local()
+
+
+def available():
+    return markdown is not None
+
+
+def enabled(app):
+    """True if the app renders Markdown server-side (MARKDOWN_SERVER_RENDER and the package installed)."""
+    return app.config.get('MARKDOWN_SERVER_RENDER', True) and markdown is not None
+
+
+if markdown is not None:
+    class _SafeUrls(Treeprocessor):
+        def run(self, root):
+            for element in root.iter():
+                for attribute in ('href', 'src'):
+                    value = element.get(attribute)
+                    if value is not None and not _SAFE_URL.match(value.strip()):
+                        element.set(attribute, '#')
+
+    class _SafeHtml(Extension):
+        """Escape raw HTML instead of passing it through, and filter link/image URLs."""
+
+        def extendMarkdown(self, md):
+            md.preprocessors.deregister('html_block')
+            md.inlinePatterns.deregister('html')
+            md.treeprocessors.register(_SafeUrls(md), 'safe_urls', 0)
+
+
+def render(text):
+    """Render Markdown to HTML. Raises RuntimeError if the `markdown` package is missing."""
+    if markdown is None:
+        raise RuntimeError("Server-side Markdown rendering needs the 'markdown' package")
+    # Markdown instances keep per-document state; one per thread, reset between documents
+    md = getattr(_local, 'md', None)
+    if md is None:
+        md = _local.md = markdown.Markdown(extensions=_EXTENSIONS + [_SafeHtml()])
+    return md.reset().convert(text)
+
+
+class IncrementalRenderer:
+    """
+    Renders a streamed answer block by block. `feed` and `finish` return
+    events `{"index": i, "html": ..., "final": bool}`; a client replaces
+    block `i` with each event's HTML. Final blocks only change once more, in
+    `finish`, if reference-style link definitions later in the answer apply to
+    them. The open block is re-rendered at most every `min_interval` seconds.
+    """
+
+    def __init__(self, min_interval=0.0):
+        self.min_interval = min_interval  # Seconds between re-renders of the open block
+        self._last_render = 0.0
+        self._text = ''
+        self._scanned = 0     # Offset up to which complete lines have been scanned
+        self._block_start = 0  # Offset where the open block starts
+        self._blank = None     # Offset of the first blank line after the open block's text, if any
+        self._fence = None     # Marker of the fenced code block we're inside, if any
+        self._last_open = None
+        self._blocks = []      # (text, html) of final blocks; the open block's index is len(self._blocks)
+        self._definitions = []  # Reference-style link definitions seen outside code
+
+    def _close_block(self, end, events):
+        block = self._text[self._block_start:end]
+        if block.strip():
+            html = render(block)
+            events.append({'index': len(self._blocks), 'html': html, 'final': True})
+            self._blocks.append((block, html))
+        self._last_open = None
+
+    def _end_block_at_blank(self, line, line_start, events):
+        # The block before the blank line is finished unless `line` can continue it
+        if not _CONTINUES.match(line):
+            self._close_block(self._blank, events)
+            self._block_start = line_start
+        self._blank = None
+
+    def _scan(self, events):
+        """Track fences and block boundaries over the complete lines received so far."""
+        while True:
+            newline = self._text.find('\n', self._scanned)
+            if newline < 0:
+                break
+            line = self._text[self._scanned:newline]
+            line_start, self._scanned = self._scanned, newline + 1
+            if self._fence:
+                fence = _FENCE.match(line)
+                if fence and fence.group(1)[0] == self._fence[0] and len(fence.group(1)) >= len(self._fence) \
+                        and not line.strip().lstrip(self._fence[0]):
+                    self._fence = None
+                continue
+            if not line.strip():
+                if self._blank is None:
+                    self._blank = line_start
+                continue
+            if self._blank is not None:
+                self._end_block_at_blank(line, line_start, events)
+            if _LINK_DEFINITION.match(line):
+                self._definitions.append(line.strip())
+            fence = _FENCE.match(line)
+            if fence:
+                self._fence = fence.group(1)
+
+    def feed(self, delta):
+        self._text += delta
+        events = []
+        self._scan(events)
+        partial = self._text[self._scanned:]
+        if self._blank is not None and partial and partial[0] not in ' \t-*+>[0123456789':
+            # The first character already rules out a continuation; don't wait for the whole line
+            self._end_block_at_blank(partial, self._scanned, events)
+
+        open_block = self._text[self._block_start:]
+        now = time.monotonic()
+        if open_block.strip() and open_block != self._last_open and now - self._last_render >= self.min_interval:
+            events.append({'index': len(self._blocks), 'html': render(open_block), 'final': False})
+            self._last_open = open_block
+            self._last_render = now
+        return events
+
+    def finish(self):
+        """Render the trailing block for the last time, and blocks whose link definitions came later."""
+        events = []
+        if not self._text.endswith('\n'):
+            self._text += '\n'  # Scan the last line too
+        self._scan(events)
+        self._close_block(len(self._text), events)
+        self._block_start = len(self._text)
+        if self._definitions:
+            definitions = '\n'.join(self._definitions)
+            for index, (block, html) in enumerate(self._blocks):
+                updated = render(f"{block}\n\n{definitions}")
+                if updated != html:
+                    events = [event for event in events if event['index'] != index]
+                    events.append({'index': index, 'html': updated, 'final': True})
+                    self._blocks[index] = (block, updated)
+        return events
+
+
+# --- Cache of rendered HTML for stored messages ---
+
+def cached_html(messages):
+    """
+    Set `message.html` on assistant messages, from the cache or by rendering
+    (and caching) them. Does nothing when rendering is unavailable.
+    """
+    targets = [message for message in messages if message.role == 'assistant' and message.id is not None]
+    if markdown is None or not targets:
+        return messages
+    db = get_db()
+    ids = [message.id for message in targets]
+    rows = db.execute(
+        f'SELECT * FROM message_html WHERE version = ? AND message_id IN ({", ".join("?" * len(ids))})',
+        (RENDER_VERSION, *ids)
+    ).fetchall()
+    cached = {row['message_id']: row_content(row) for row in rows}
+
+    missing = [message for message in targets if message.id not in cached]
+    for message in targets:
+        message.html = cached.get(message.id)
+    if missing:
+        for message in missing:
+            message.html = render(message.content)
+        try:
+            store_html(db, [(message.id, message.html) for message in missing])
+        except Exception as e:
+            db.rollback()  # A cache write failing must not fail the read
+            logger.warning(f"[MARKDOWN] Failed to cache rendered HTML: {e}")
+    return messages
+
+
+def store_html(db, items):
+    """Cache rendered HTML for (message_id, html) pairs, replacing older versions."""
+    ids = [message_id for message_id, _ in items]
+    db.execute(f'DELETE FROM message_html WHERE message_id IN ({", ".join("?" * len(ids))})', ids)
+    rows = []
+    for message_id, html in items:
+        blob, encoding = compress_text(html)
+        rows.append((message_id, RENDER_VERSION, html if encoding is None else '', blob, encoding))
+    db.executemany(
+        'INSERT INTO message_html (message_id, version, content, content_blob, content_encoding) '
+        'VALUES (?, ?, ?, ?, ?)',
+        rows
+    )
+    db.commit()
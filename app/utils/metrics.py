@@ -0,0 +1,74 @@
+# app/utils/metrics.py
+"""
+Minimal in-process metrics: counters, gauges and histograms with recent-window percentiles.
+Thread-safe; values are per worker process.
+"""
+import threading
+from collections import deque
+
+
+class Histogram:
+    def __init__(self, window=1024):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._recent = deque(maxlen=window)
+
+    def observe(self, value):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self._recent.append(value)
+
+    def percentile(self, p):
+        if not self._recent:
+            return 0.0
+        values = sorted(self._recent)
+        index = min(len(values) - 1, int(round(p / 100.0 * (len(values) - 1))))
+        return values[index]
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'avg': self.total / self.count if self.count else 0.0,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def observe(self, name, value):
+        with self._lock:
+            histogram = self._histograms.get(name)
+            if histogram is None:
+                histogram = self._histograms[name] = Histogram()
+            histogram.observe(value)
+
+    def snapshot(self):
+        """Return a JSON-serialisable copy of all metrics."""
+        with self._lock:
+            return {
+                'counters': dict(self._counters),
+                'gauges': dict(self._gauges),
+                'histograms': {name: h.to_dict() for name, h in self._histograms.items()},
+            }
+
+
+# Process-wide registry
+metrics = Metrics()
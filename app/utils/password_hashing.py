@@ -0,0 +1,99 @@
+# app/utils/password_hashing.py
+"""
+Password hashing off the request threads.
+
+Hashing and verification run in a bounded process pool so a login burst uses
+the pool's cores instead of holding the GIL in every request thread. Admission
+is bounded: when too many hashes are in flight, callers get HashingBusy (the
+routes turn it into a 503) instead of piling up behind the pool.
+
+The hash method/cost comes from PASSWORD_HASH_METHOD; hashes made with other
+parameters are reported by `needs_rehash` so they can be upgraded on login.
+"""
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+from app.utils.process_pool import pool_context
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_METHOD = 'pbkdf2:sha256:600000'  # Werkzeug 2.3's default, so existing hashes stay valid
+
+
+class HashingBusy(Exception):
+    """Raised when the hashing pool is saturated."""
+
+    retry_after = 1
+
+
+class PasswordHasher:
+    def __init__(self, method=DEFAULT_METHOD, workers=None, max_pending=None, queue_timeout=0.5):
+        self.method = method
+        # Werkzeug expands shorthands ('scrypt', 'pbkdf2:sha256') in the hashes it writes; compare with that
+        self.hash_prefix = generate_password_hash('', method).split('$', 1)[0]
+        self.workers = 1 if workers is None else workers
+        self.max_pending = max_pending or max(1, self.workers) * 4
+        self.queue_timeout = queue_timeout
+        self._slots = threading.BoundedSemaphore(self.max_pending)
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def _get_executor(self):
+        # Pools don't survive fork (e.g. gunicorn workers); build one per process
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                # Created lazily, after the app's threads have started: no plain fork here
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=pool_context(__name__))
+                self._pid = os.getpid()
+                logger.info(f"[PASSWORD_HASH] Started pool with {self.workers} workers (pid {self._pid})")
+            return self._executor
+
+    def _run(self, func, *args):
+        if self.workers <= 0:
+            return func(*args)
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            logger.warning("[PASSWORD_HASH] Pool saturated, rejecting request")
+            raise HashingBusy("Too many concurrent logins, please retry")
+        try:
+            future = self._get_executor().submit(func, *args)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        return future.result()
+
+    def hash(self, password):
+        return self._run(generate_password_hash, password, self.method)
+
+    def verify(self, password_hash, password):
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """True if the hash was made with a different method or cost than configured."""
+        return password_hash.split('$', 1)[0] != self.hash_prefix
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+def get_password_hasher(app=None):
+    """Return the app's PasswordHasher, creating it on first use."""
+    app = app or current_app._get_current_object()
+    hasher = app.extensions.get('password_hasher')
+    if hasher is None:
+        hasher = app.extensions.setdefault('password_hasher', PasswordHasher(
+            method=app.config.get('PASSWORD_HASH_METHOD', DEFAULT_METHOD),
+            workers=app.config.get('PASSWORD_HASH_WORKERS'),
+            max_pending=app.config.get('PASSWORD_HASH_MAX_PENDING'),
+            queue_timeout=app.config.get('PASSWORD_HASH_QUEUE_TIMEOUT', 0.5),
+        ))
+    return hasher
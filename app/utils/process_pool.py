@@ -0,0 +1,24 @@
+# app/utils/process_pool.py
+"""
+Start method for the worker pools (sandbox, password hashing).
+
+The pools are created while the server's threads (upstream loop, jobs, usage
+flushes, stream broker, health checks) are running. Forking a threaded process
+copies locks other threads hold into the child, so the workers come from a
+fork server instead, or are spawned where no fork server is available.
+"""
+import multiprocessing
+
+
+def pool_context(*preload):
+    """
+    multiprocessing context for a ProcessPoolExecutor. The fork server imports
+    the entry script and `preload` once, so workers start without re-importing
+    them; only the first caller's preload applies, later pools import their
+    modules in the workers.
+    """
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(['__main__', *preload])
+    return context
@@ -0,0 +1,399 @@
+# app/utils/rate_limit.py
+"""
+Rate limiting and admission control for generation endpoints.
+
+Token buckets (per user and per model) smooth out request bursts, and
+concurrency leases bound how many streams run at once, globally and per user.
+State lives in a pluggable store: in-process by default, or a shared
+SQLite file / Redis server when several workers must agree on the limits.
+"""
+import itertools
+import logging
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+
+from flask import current_app, jsonify
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a request is rejected by the rate limiter."""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.message = message
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+
+# --- Stores ---
+
+class MemoryStore:
+    """Process-local store. Fast, but limits are not shared between workers."""
+
+    shared = False
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._buckets = {}
+        self._leases = {}
+        self._ids = itertools.count(1)
+
+    def take(self, key, rate, capacity, cost=1.0):
+        """Take `cost` tokens from a bucket (a negative cost refunds). Returns 0 on success, else seconds to wait."""
+        with self._cond:
+            now = time.monotonic()
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            if tokens >= cost:
+                self._buckets[key] = (min(capacity, tokens - cost), now)
+                return 0.0
+            self._buckets[key] = (tokens, now)
+            return (cost - tokens) / rate
+
+    def _holders(self, key):
+        # Expired leases belong to generations that never finished; drop them like the shared stores do
+        holders = self._leases.setdefault(key, {})
+        now = time.monotonic()
+        for lease_id in [lease_id for lease_id, expires_at in holders.items() if expires_at < now]:
+            del holders[lease_id]
+        return holders
+
+    def acquire(self, key, limit, ttl):
+        """Acquire a concurrency lease under `key` for at most `ttl` seconds. Returns a lease id or None."""
+        with self._cond:
+            holders = self._holders(key)
+            if len(holders) >= limit:
+                return None
+            lease_id = next(self._ids)
+            holders[lease_id] = time.monotonic() + ttl
+            return lease_id
+
+    def renew(self, key, lease_id, ttl):
+        """Extend a held lease to `ttl` seconds from now (expired leases stay gone)."""
+        with self._cond:
+            holders = self._leases.get(key, {})
+            if lease_id in holders:
+                holders[lease_id] = time.monotonic() + ttl
+
+    def release(self, key, lease_id):
+        with self._cond:
+            self._leases.get(key, {}).pop(lease_id, None)
+            self._cond.notify_all()
+
+    def count(self, key):
+        with self._cond:
+            return len(self._holders(key))
+
+    def wait(self, timeout):
+        """Block until a lease may have been released, or `timeout` elapses."""
+        with self._cond:
+            self._cond.wait(timeout)
+
+
+class SQLiteStore:
+    """Shared store backed by a SQLite file, usable by all workers on one host."""
+
+    shared = True
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        conn = self._conn()
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+            key TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+        ''')
+        conn.execute('''
+        CREATE TABLE IF NOT EXISTS rate_limit_leases (
+            id TEXT PRIMARY KEY,
+            key TEXT NOT NULL,
+            expires_at REAL NOT NULL
+        )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_rate_limit_leases_key ON rate_limit_leases (key, expires_at)')
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Autocommit mode; transactions are opened explicitly with BEGIN IMMEDIATE
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def take(self, key, rate, capacity, cost=1.0):
+        conn = self._conn()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute(
+                'SELECT tokens, updated_at FROM rate_limit_buckets WHERE key = ?', (key,)
+            ).fetchone()
+            tokens, updated = row if row else (capacity, now)
+            tokens = min(capacity, tokens + max(0.0, now - updated) * rate)
+            wait = 0.0
+            if tokens >= cost:
+                tokens = min(capacity, tokens - cost)
+            else:
+                wait = (cost - tokens) / rate
+            conn.execute(
+                'INSERT OR REPLACE INTO rate_limit_buckets (key, tokens, updated_at) VALUES (?, ?, ?)',
+                (key, tokens, now)
+            )
+            conn.execute('COMMIT')
+            return wait
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def acquire(self, key, limit, ttl):
+        conn = self._conn()
+        now = time.time()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Expired leases belong to workers that died without releasing them
+            conn.execute('DELETE FROM rate_limit_leases WHERE key = ? AND expires_at < ?', (key, now))
+            (held,) = conn.execute(
+                'SELECT COUNT(*) FROM rate_limit_leases WHERE key = ?', (key,)
+            ).fetchone()
+            lease_id = None
+            if held < limit:
+                lease_id = uuid.uuid4().hex
+                conn.execute(
+                    'INSERT INTO rate_limit_leases (id, key, expires_at) VALUES (?, ?, ?)',
+                    (lease_id, key, now + ttl)
+                )
+            conn.execute('COMMIT')
+            return lease_id
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+
+    def renew(self, key, lease_id, ttl):
+        self._conn().execute('UPDATE rate_limit_leases SET expires_at = ? WHERE id = ?', (time.time() + ttl, lease_id))
+
+    def release(self, key, lease_id):
+        self._conn().execute('DELETE FROM rate_limit_leases WHERE id = ?', (lease_id,))
+
+    def count(self, key):
+        (held,) = self._conn().execute(
+            'SELECT COUNT(*) FROM rate_limit_leases WHERE key = ? AND expires_at >= ?',
+            (key, time.time())
+        ).fetchone()
+        return held
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, 0.05))
+
+
+class RedisStore:
+    """Shared store for multi-host deployments. Requires the optional `redis` package."""
+
+    shared = True
+
+    _TAKE_SCRIPT = """
+    local data = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+    local rate, capacity, cost, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+    local tokens = tonumber(data[1]) or capacity
+    local ts = tonumber(data[2]) or now
+    tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+    local wait = 0
+    if tokens >= cost then tokens = math.min(capacity, tokens - cost) else wait = (cost - tokens) / rate end
+    redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+    redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+    return tostring(wait)
+    """
+
+    _ACQUIRE_SCRIPT = """
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+    if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[2]) then return 0 end
+    redis.call('ZADD', KEYS[1], ARGV[3], ARGV[4])
+    return 1
+    """
+
+    def __init__(self, url):
+        import redis  # Optional dependency, only needed for redis:// storage
+        self._redis = redis.Redis.from_url(url)
+        self._take = self._redis.register_script(self._TAKE_SCRIPT)
+        self._acquire = self._redis.register_script(self._ACQUIRE_SCRIPT)
+
+    def take(self, key, rate, capacity, cost=1.0):
+        return float(self._take(keys=[f'rl:bucket:{key}'], args=[rate, capacity, cost, time.time()]))
+
+    def acquire(self, key, limit, ttl):
+        now = time.time()
+        lease_id = uuid.uuid4().hex
+        ok = self._acquire(keys=[f'rl:leases:{key}'], args=[now, limit, now + ttl, lease_id])
+        return lease_id if ok else None
+
+    def renew(self, key, lease_id, ttl):
+        self._redis.zadd(f'rl:leases:{key}', {lease_id: time.time() + ttl}, xx=True)
+
+    def release(self, key, lease_id):
+        self._redis.zrem(f'rl:leases:{key}', lease_id)
+
+    def count(self, key):
+        return self._redis.zcount(f'rl:leases:{key}', time.time(), '+inf')
+
+    def wait(self, timeout):
+        time.sleep(min(timeout, 0.05))
+
+
+def create_store(url):
+    """Build a store from a URL: memory://, sqlite:///path/to/file.db or redis://host:port/db."""
+    if not url or url.startswith('memory://'):
+        return MemoryStore()
+    if url.startswith('sqlite:///'):
+        return SQLiteStore(url[len('sqlite:///'):])
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisStore(url)
+    raise ValueError(f"Unsupported rate limit storage URL: {url}")
+
+
+# --- Limiter ---
+
+class Lease:
+    """A held concurrency slot. Releasing is idempotent."""
+
+    def __init__(self, store, slots, ttl=None, on_release=None):
+        self._store = store
+        self._slots = slots  # list of (key, lease_id)
+        self._ttl = ttl
+        self._on_release = on_release
+        self._lock = threading.Lock()
+
+    def renew(self):
+        """Push the lease's expiry `ttl` seconds ahead."""
+        with self._lock:
+            slots = list(self._slots)
+        for key, lease_id in slots:
+            try:
+                self._store.renew(key, lease_id, self._ttl)
+            except Exception as e:
+                logger.error(f"[RATE_LIMIT] Failed to renew lease {key}: {e}", exc_info=True)
+
+    def release(self):
+        with self._lock:
+            slots, self._slots = self._slots, []
+        for key, lease_id in reversed(slots):
+            try:
+                self._store.release(key, lease_id)
+            except Exception as e:
+                logger.error(f"[RATE_LIMIT] Failed to release lease {key}: {e}", exc_info=True)
+        if self._on_release is not None:
+            self._on_release(self)
+
+
+class RateLimiter:
+    def __init__(self, store, config):
+        self.store = store
+        self.enabled = config.get('RATE_LIMIT_ENABLED', True)
+        self.user_rate = config.get('RATE_LIMIT_USER_RATE', 0.5)
+        self.user_burst = config.get('RATE_LIMIT_USER_BURST', 10)
+        self.model_rate = config.get('RATE_LIMIT_MODEL_RATE', 5.0)
+        self.model_burst = config.get('RATE_LIMIT_MODEL_BURST', 50)
+        self.max_streams = config.get('MAX_CONCURRENT_STREAMS', 32)
+        self.max_streams_per_user = config.get('MAX_CONCURRENT_STREAMS_PER_USER', 2)
+        self.admission_timeout = config.get('STREAM_ADMISSION_TIMEOUT', 5.0)
+        self.lease_ttl = config.get('STREAM_LEASE_TTL', 600)
+        self._held = set()  # Leases of this process, renewed until released
+        self._held_lock = threading.Lock()
+        self._renewer_pid = None
+
+    def check_rate(self, user_id, model):
+        """Charge one request against the user's and the model's token buckets."""
+        wait = self.store.take(f'user:{user_id}', self.user_rate, self.user_burst)
+        if wait > 0:
+            raise RateLimitExceeded("Too many requests, slow down", wait)
+        wait = self.store.take(f'model:{model}', self.model_rate, self.model_burst)
+        if wait > 0:
+            # Server-side congestion: give the user's token back
+            self.store.take(f'user:{user_id}', self.user_rate, self.user_burst, cost=-1.0)
+            raise RateLimitExceeded("This model is receiving too many requests, try again shortly", wait)
+
+    def admit(self, user_id):
+        """
+        Acquire a per-user and a global concurrency slot.
+        The per-user cap rejects immediately; the global cap queues for up to
+        `admission_timeout` seconds before rejecting.
+        """
+        user_key = f'streams:user:{user_id}'
+        user_lease = self.store.acquire(user_key, self.max_streams_per_user, self.lease_ttl)
+        if user_lease is None:
+            raise RateLimitExceeded("Too many concurrent generations for this user", 5)
+
+        deadline = time.monotonic() + self.admission_timeout
+        while True:
+            global_lease = self.store.acquire('streams:global', self.max_streams, self.lease_ttl)
+            if global_lease is not None:
+                return self._hold(Lease(self.store, [(user_key, user_lease), ('streams:global', global_lease)],
+                                        self.lease_ttl, self._held.discard))
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.store.release(user_key, user_lease)
+                logger.warning(f"[RATE_LIMIT] Admission timed out for user {user_id}")
+                raise RateLimitExceeded("Server is at capacity, try again shortly", 2)
+            self.store.wait(remaining)
+
+    def _hold(self, lease):
+        # A generation may outlive the TTL; renew its lease every TTL/3 until it is released,
+        # so only leases of crashed workers expire
+        with self._held_lock:
+            self._held.add(lease)
+            if self._renewer_pid != os.getpid():  # Threads don't survive fork
+                self._renewer_pid = os.getpid()
+                threading.Thread(target=self._renew_held, name='lease-renewer', daemon=True).start()
+        return lease
+
+    def _renew_held(self):
+        while True:
+            time.sleep(self.lease_ttl / 3)
+            with self._held_lock:
+                leases = list(self._held)
+            for lease in leases:
+                lease.renew()
+
+    def active_streams(self):
+        return self.store.count('streams:global')
+
+
+class _NoopLease:
+    def release(self):
+        pass
+
+
+def get_rate_limiter(app=None):
+    """Return the app's rate limiter, creating it on first use."""
+    app = app or current_app._get_current_object()
+    limiter = app.extensions.get('rate_limiter')
+    if limiter is None:
+        store = create_store(app.config.get('RATE_LIMIT_STORAGE', 'memory://'))
+        limiter = app.extensions.setdefault('rate_limiter', RateLimiter(store, app.config))
+        logger.info(f"[RATE_LIMIT] Initialized with {type(store).__name__}")
+    return limiter
+
+
+def admit_generation(user_id, model):
+    """Rate-check and admit a generation request. Returns a lease to release when done."""
+    limiter = get_rate_limiter()
+    if not limiter.enabled:
+        return _NoopLease()
+    limiter.check_rate(user_id, model)
+    return limiter.admit(user_id)
+
+
+def rate_limit_response(error):
+    """Build the 429 response for a RateLimitExceeded error."""
+    response = jsonify({"error": error.message, "retry_after": error.retry_after})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
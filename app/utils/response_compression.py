@@ -0,0 +1,55 @@
+# app/utils/response_compression.py
+"""
+Compression of large API responses (conversation payloads).
+
+Register `compress_response` as an `after_request` hook. Buffered JSON
+responses of at least COMPRESS_MIN_SIZE bytes are sent brotli- (if the
+optional `brotli` package is installed) or gzip-encoded, per the client's
+Accept-Encoding. Streamed responses (SSE) are never touched: compressing
+them would buffer the events.
+"""
+import gzip
+
+from flask import current_app, request
+
+from app.utils.metrics import metrics
+
+try:
+    import brotli
+except ImportError:  # Optional dependency; gzip only without it
+    brotli = None
+
+COMPRESSIBLE = ('application/json',)
+
+
+def _encode(data, encoding, config):
+    if encoding == 'br':
+        return brotli.compress(data, quality=config.get('COMPRESS_BROTLI_QUALITY', 4))
+    return gzip.compress(data, compresslevel=config.get('COMPRESS_LEVEL', 6))
+
+
+def compress_response(response):
+    """after_request hook: compress a large buffered JSON response if the client accepts it."""
+    config = current_app.config
+    if (not config.get('COMPRESS_RESPONSES', True) or response.is_streamed or response.direct_passthrough
+            or response.status_code != 200 or response.mimetype not in COMPRESSIBLE
+            or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < config.get('COMPRESS_MIN_SIZE', 1024):
+        return response
+    accepted = request.accept_encodings
+    encoding = 'br' if brotli is not None and 'br' in accepted else 'gzip' if 'gzip' in accepted else None
+    if encoding is None:
+        return response
+
+    compressed = _encode(data, encoding, config)
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)  # The encoded bytes differ from the identity representation
+    metrics.incr('http.compressed_responses')
+    metrics.incr('http.compressed_bytes_saved', len(data) - len(compressed))
+    return response
@@ -0,0 +1,107 @@
+# app/utils/user_cache.py
+"""
+Cached resolution of JWT identities to User objects.
+
+Two layers: a request-scoped map on `flask.g` (a request never loads the same
+user twice) and a process-wide TTL/LRU cache shared across requests.
+Call `invalidate_user` whenever a user's row changes.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app, g
+from flask_jwt_extended import get_jwt_identity
+
+from app.models.user import User
+
+
+class TTLCache:
+    """Small thread-safe LRU cache whose entries expire after `ttl` seconds."""
+
+    def __init__(self, maxsize=1024, ttl=60.0):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+def _get_cache():
+    app = current_app._get_current_object()
+    cache = app.extensions.get('user_cache')
+    if cache is None:
+        cache = app.extensions.setdefault('user_cache', TTLCache(
+            maxsize=app.config.get('USER_CACHE_SIZE', 1024),
+            ttl=app.config.get('USER_CACHE_TTL', 60),
+        ))
+    return cache
+
+
+def _normalize(identity):
+    # JWT identities are strings; the users table uses integer ids
+    try:
+        return int(identity)
+    except (TypeError, ValueError):
+        return None
+
+
+def load_user(identity):
+    """Resolve a user id/JWT identity to a User, or None if it doesn't exist."""
+    user_id = _normalize(identity)
+    if user_id is None:
+        return None
+
+    loaded = g.setdefault('_loaded_users', {})
+    if user_id in loaded:
+        return loaded[user_id]
+
+    cache = _get_cache()
+    user = cache.get(user_id)
+    if user is None:
+        user = User.get_by_id(user_id)
+        if user is not None:
+            cache.set(user_id, user)
+
+    loaded[user_id] = user
+    return user
+
+
+def load_current_user():
+    """Return the User for the current request's JWT identity, or None."""
+    return load_user(get_jwt_identity())
+
+
+def invalidate_user(identity):
+    """Drop a user from both cache layers (call after updating the users row)."""
+    user_id = _normalize(identity)
+    if user_id is None:
+        return
+    _get_cache().invalidate(user_id)
+    g.get('_loaded_users', {}).pop(user_id, None)
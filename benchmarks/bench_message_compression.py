@@ -0,0 +1,112 @@
+# benchmarks/bench_message_compression.py
+"""
+Message compression benchmark: DB file size, cold single-message read and
+history load time for plain vs zlib vs zstd vs zstd with a trained dictionary.
+
+    python benchmarks/bench_message_compression.py [--conversations 200] [--messages 40]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, g
+
+from app.utils.db import init_db, init_app as init_db_app, get_db
+from app.utils import compression
+from app.models.message import Message
+
+WORDS = ("the function returns a list of values sorted by key and the cache is invalidated when "
+         "configuration changes request response database index query latency throughput worker "
+         "thread process memory python flask sqlite stream token model prompt").split()
+
+
+def fake_answer(rng):
+    parts = [f"## {rng.choice(WORDS).title()} {rng.choice(WORDS)}\n"]
+    for _ in range(rng.randint(3, 8)):
+        kind = rng.random()
+        if kind < 0.5:
+            parts.append(' '.join(rng.choice(WORDS) for _ in range(rng.randint(30, 90))) + '.\n')
+        elif kind < 0.75:
+            parts.append('\n'.join(f"- **{rng.choice(WORDS)}**: {' '.join(rng.choice(WORDS) for _ in range(8))}"
+                                   for _ in range(rng.randint(3, 6))) + '\n')
+        else:
+            parts.append("```python\n" + '\n'.join(
+                f"def {rng.choice(WORDS)}_{i}(x):\n    return x.{rng.choice(WORDS)}()" for i in range(rng.randint(2, 5))
+            ) + "\n```\n")
+    return '\n'.join(parts)
+
+
+def populate(app, conversations, per_conversation, seed=1):
+    rng = random.Random(seed)
+    with app.app_context():
+        db = get_db()
+        for c in range(conversations):
+            db.execute("INSERT INTO conversations (user_id, title) VALUES (1, 'bench')")
+            conv_id = db.execute('SELECT last_insert_rowid()').fetchone()[0]
+            for m in range(per_conversation):
+                if m % 2:
+                    Message.create(conv_id, 'assistant', fake_answer(rng))
+                else:
+                    Message.create(conv_id, 'user', ' '.join(rng.choice(WORDS) for _ in range(15)))
+
+
+def measure(app, db_path, conversations):
+    with app.app_context():
+        get_db().execute('VACUUM')
+    size = os.path.getsize(db_path)
+    rng = random.Random(2)
+
+    cold = []
+    history = []
+    for _ in range(50):
+        conv_id = rng.randint(1, conversations)
+        with app.app_context():
+            compression._dictionaries.clear()  # Count dictionary loading as part of a cold read
+            start = time.perf_counter()
+            Message.get_by_id(conv_id * 2)
+            cold.append(time.perf_counter() - start)
+        with app.app_context():
+            start = time.perf_counter()
+            Message.get_by_conversation_id(conv_id)
+            history.append(time.perf_counter() - start)
+    cold.sort(); history.sort()
+    return size, cold[len(cold) // 2], history[len(history) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--conversations', type=int, default=200)
+    parser.add_argument('--messages', type=int, default=40)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for variant in ('none', 'zlib', 'zstd', 'zstd+dict'):
+            db_path = os.path.join(tmp, f'{variant}.db')
+            app = Flask(__name__)
+            app.config.update(DATABASE_PATH=db_path, MESSAGE_COMPRESSION=variant.split('+')[0],
+                              MESSAGE_COMPRESSION_THRESHOLD=1024, MESSAGE_COMPRESSION_LEVEL=6)
+            init_db_app(app)
+            with app.app_context():
+                init_db()
+            if variant == 'zstd+dict':
+                # Train on a first slice of data, then store everything with the dictionary
+                populate(app, max(20, args.conversations // 10), args.messages, seed=99)
+                with app.app_context():
+                    compression.train_dictionary()
+                    db = get_db()
+                    db.execute('DELETE FROM messages'); db.execute('DELETE FROM conversations')
+                    db.execute("DELETE FROM sqlite_sequence WHERE name IN ('messages', 'conversations')")
+                    db.commit()
+            populate(app, args.conversations, args.messages)
+            size, cold, history = measure(app, db_path, args.conversations)
+            print(f"{variant:10s} db={size / 1024 / 1024:7.2f} MiB  cold read p50={cold * 1000:6.3f} ms  "
+                  f"history load p50={history * 1000:6.3f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,123 @@
+# benchmarks/bench_page_weight.py
+"""
+Bytes transferred per page load of the chat UI, and per conversation fetch.
+
+Loads / and every static asset it pulls in (including the Markdown worker and
+marked.min.js, which are referenced from JS) through the test client, with
+plain files vs fingerprinted builds served gzip/brotli-encoded, and counts the
+requests a repeat visit still has to make. Then compares the JSON size of a
+long conversation with and without Accept-Encoding.
+
+    python benchmarks/bench_page_weight.py [--messages 60]
+"""
+import argparse
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask_jwt_extended import create_access_token
+
+from app import create_app
+from app.config.config import TestingConfig, config
+from app.models.conversation import Conversation
+from app.models.message import Message
+from app.utils.assets import brotli, build_assets
+from app.utils.db import get_db
+
+WORDS = ("the function returns a list of values sorted by key and the cache is invalidated when "
+         "configuration changes request response database index query latency throughput worker "
+         "thread process memory python flask sqlite stream token model prompt").split()
+_REFERENCE = re.compile(rb'(?:href|src)="(/static/[^"]+)"|[\'"](/static/[\w./-]+\.js)[\'"]')
+
+
+def make_app(static_folder, built):
+    config['bench'] = type('BenchConfig', (TestingConfig,), {
+        'DATABASE_PATH': os.path.join(os.path.dirname(static_folder), f'{os.path.basename(static_folder)}.db'),
+    })
+    app = create_app('bench')
+    shutil.copytree(app.static_folder, static_folder)
+    app.static_url_path = app.static_url_path  # Keep /static once the folder is renamed
+    app.static_folder = static_folder
+    if built:
+        build_assets(static_folder, app.config['ASSETS_DIST'], app.static_url_path)
+    return app
+
+
+def page_load(client, encoding):
+    """(bytes, requests) of a first visit, and requests a repeat visit still makes."""
+    headers = {'Accept-Encoding': encoding} if encoding else {}
+    page = client.get('/', headers=headers)
+    total, requests, revalidated = len(page.data), 1, 1  # The page itself is always revalidated
+    seen, pending = set(), [page.data]
+    while pending:
+        body = pending.pop()
+        for match in _REFERENCE.finditer(body):
+            url = (match.group(1) or match.group(2)).decode()
+            if url in seen:
+                continue
+            seen.add(url)
+            response = client.get(url, headers=headers)
+            assert response.status_code == 200, url
+            total += len(response.data)
+            requests += 1
+            if 'immutable' not in response.headers.get('Cache-Control', ''):
+                revalidated += 1
+            if response.headers.get('Content-Encoding') is None:
+                pending.append(response.data)
+            else:  # Look for references in the decoded body
+                client_raw = client.get(url)
+                pending.append(client_raw.data)
+    return total, requests, revalidated
+
+
+def conversation_bytes(app, messages):
+    with app.app_context():
+        db = get_db()
+        db.execute("INSERT INTO users (username, password_hash) VALUES ('bench', 'x')")
+        db.commit()
+        user_id = db.execute("SELECT id FROM users WHERE username = 'bench'").fetchone()['id']
+        conversation = Conversation.create(user_id)
+        rng = random.Random(42)
+        for i in range(messages):
+            role = 'user' if i % 2 == 0 else 'assistant'
+            words = rng.randint(15, 40) if role == 'user' else rng.randint(150, 400)
+            Message.create(conversation.id, role, ' '.join(rng.choice(WORDS) for _ in range(words)))
+        token = create_access_token(identity=str(user_id))
+    client = app.test_client()
+    url = f'/api/chat/conversations/{conversation.id}'
+    headers = {'Authorization': f'Bearer {token}'}
+    plain = len(client.get(url, headers=headers).data)
+    gzipped = client.get(url, headers={**headers, 'Accept-Encoding': 'gzip'})
+    return plain, len(gzipped.data), gzipped.headers.get('Content-Encoding')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--messages', type=int, default=60, help='messages in the fetched conversation')
+    args = parser.parse_args()
+    workdir = tempfile.mkdtemp()
+    try:
+        rows = [('plain files', False, None)]
+        rows.append(('built, gzip', True, 'gzip'))
+        if brotli is not None:
+            rows.append(('built, br', True, 'br, gzip'))
+        for i, (label, built, encoding) in enumerate(rows):
+            app = make_app(os.path.join(workdir, f'static{i}'), built)
+            total, requests, revalidated = page_load(app.test_client(), encoding)
+            print(f"{label:12s} first visit {total / 1024:7.1f} KiB in {requests} requests; "
+                  f"repeat visit revalidates {revalidated}")
+
+        plain, compressed, encoding = conversation_bytes(make_app(os.path.join(workdir, 'json'), False), args.messages)
+        print(f"conversation ({args.messages} messages): {plain / 1024:.1f} KiB plain, "
+              f"{compressed / 1024:.1f} KiB {encoding} ({plain / compressed:.1f}x smaller)")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+# benchmarks/bench_parallel_tools.py
+"""
+Agent turn latency when one model step asks for several tool calls, with a stub model.
+
+Compares guarded tool calls run one at a time (TOOL_MAX_PARALLEL=1) with
+the same calls run concurrently, and reports the per-turn saving.
+
+    python benchmarks/bench_parallel_tools.py [--calls 4] [--delay 0.5]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agents import Agent, ModelResponse, ModelSettings, Runner, Usage, function_tool, set_tracing_disabled
+from agents.models.interface import Model
+from openai.types.responses import ResponseFunctionToolCall, ResponseOutputMessage, ResponseOutputText
+
+from app.tools.context import ToolContext
+from app.tools.runtime import guard_tool
+
+
+class StubModel(Model):
+    """Asks for `calls` tool calls in its first step, then answers."""
+
+    def __init__(self, tool_name, calls, delay):
+        self.tool_name = tool_name
+        self.calls = calls
+        self.delay = delay
+
+    async def get_response(self, *args, **kwargs):
+        items = kwargs.get('input', args[1] if len(args) > 1 else None)
+        if not any(isinstance(item, dict) and item.get('type') == 'function_call_output' for item in items):
+            output = [
+                ResponseFunctionToolCall(type='function_call', id=f'fc_{i}', call_id=f'call_{i}',
+                                         name=self.tool_name, arguments=f'{{"seconds": {self.delay}}}')
+                for i in range(self.calls)
+            ]
+        else:
+            output = [ResponseOutputMessage(
+                type='message', id='msg_1', role='assistant', status='completed',
+                content=[ResponseOutputText(type='output_text', text='done', annotations=[])],
+            )]
+        return ModelResponse(output=output, usage=Usage(), response_id=None)
+
+    def stream_response(self, *args, **kwargs):
+        raise NotImplementedError
+
+
+@function_tool
+async def wait_async(seconds: float) -> str:
+    """Wait without blocking the event loop (like the sandboxed shell tool)."""
+    await asyncio.sleep(seconds)
+    return 'ok'
+
+
+async def turn(tool, calls, delay, max_parallel):
+    events = []
+    context = ToolContext(app=None, emit=events.append, tool_budget=60.0, max_parallel=max_parallel)
+    agent = Agent(name='bench', instructions='', model=StubModel(tool.name, calls, delay), tools=[tool],
+                  model_settings=ModelSettings(parallel_tool_calls=True))
+    start = time.perf_counter()
+    result = await Runner.run(agent, input='go', context=context)
+    elapsed = time.perf_counter() - start
+    assert result.final_output == 'done'
+    assert sum(1 for event in events if event['status'] == 'done') == calls
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=4, help='tool calls requested in one model step')
+    parser.add_argument('--delay', type=float, default=0.5, help='seconds each tool call takes')
+    args = parser.parse_args()
+    set_tracing_disabled(True)
+    print(f"calls={args.calls} delay={args.delay}s")
+
+    tool = guard_tool(wait_async)
+    serial = asyncio.run(turn(tool, args.calls, args.delay, max_parallel=1))
+    parallel = asyncio.run(turn(tool, args.calls, args.delay, max_parallel=args.calls))
+    print(f"one at a time: {serial:6.2f}s per turn")
+    print(f"parallel:      {parallel:6.2f}s per turn (saves {serial - parallel:.2f}s, {serial / parallel:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
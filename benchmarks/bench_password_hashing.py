@@ -0,0 +1,52 @@
+# benchmarks/bench_password_hashing.py
+"""
+Login throughput: password verification inline in request threads vs. the hashing process pool.
+
+    python benchmarks/bench_password_hashing.py [--logins 200] [--threads 16] [--method pbkdf2:sha256:600000]
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from werkzeug.security import generate_password_hash
+
+from app.utils.password_hashing import PasswordHasher
+
+
+def run(hasher, password_hash, logins, threads):
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        results = list(pool.map(lambda _: hasher.verify(password_hash, 'correct horse'), range(logins)))
+    elapsed = time.perf_counter() - start
+    assert all(results)
+    return logins / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--logins', type=int, default=200)
+    parser.add_argument('--threads', type=int, default=16, help='concurrent request threads')
+    parser.add_argument('--method', default='pbkdf2:sha256:600000')
+    args = parser.parse_args()
+
+    cores = os.cpu_count() or 1
+    password_hash = generate_password_hash('correct horse', args.method)
+    print(f"method={args.method} cores={cores} threads={args.threads} logins={args.logins}")
+
+    inline = run(PasswordHasher(args.method, workers=0), password_hash, args.logins, args.threads)
+    print(f"inline (request threads): {inline:7.1f} logins/s")
+
+    for workers in sorted({1, max(1, cores // 2), cores}):
+        hasher = PasswordHasher(args.method, workers=workers, max_pending=args.logins)
+        hasher.verify(password_hash, 'warm up')  # start the pool outside the timing
+        rate = run(hasher, password_hash, args.logins, args.threads)
+        hasher.shutdown()
+        print(f"pool, {workers:2d} worker(s):      {rate:7.1f} logins/s ({rate / workers:.1f} per core)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+# benchmarks/bench_registration_keys.py
+"""
+Registration key bulk generation/import benchmark.
+
+Compares the per-key path (SELECT + INSERT + COMMIT per key, as the old
+load_keys_from_file did) against the single-transaction executemany path.
+
+    python benchmarks/bench_registration_keys.py [--keys 1000000] [--legacy-keys 20000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask
+
+from app.utils.db import init_db, init_app as init_db_app
+from app.models.registration_key import RegistrationKey
+from app.utils.key_management import load_keys_from_file
+
+
+def make_app(db_path):
+    app = Flask(__name__)
+    app.config['DATABASE_PATH'] = db_path
+    init_db_app(app)
+    with app.app_context():
+        init_db()
+    return app
+
+
+def legacy_import(keys):
+    from app.utils.db import get_db
+    db = get_db()
+    for key_value in keys:
+        if not RegistrationKey.get_by_value(key_value):
+            db.execute('INSERT INTO registration_keys (key_value) VALUES (?)', (key_value,))
+            db.commit()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--keys', type=int, default=1000000)
+    parser.add_argument('--legacy-keys', type=int, default=20000,
+                        help='keys for the per-key baseline (extrapolated to --keys)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        t0 = time.perf_counter()
+        keys = RegistrationKey.generate_keys(args.keys)
+        print(f"generate_keys({args.keys}): {time.perf_counter() - t0:.2f}s")
+
+        app = make_app(os.path.join(tmp, 'legacy.db'))
+        with app.app_context():
+            t0 = time.perf_counter()
+            legacy_import(keys[:args.legacy_keys])
+            elapsed = time.perf_counter() - t0
+        per_key = elapsed / args.legacy_keys
+        print(f"legacy import {args.legacy_keys} keys: {elapsed:.2f}s "
+              f"({args.legacy_keys / elapsed:,.0f} keys/s, ~{per_key * args.keys:.0f}s extrapolated to {args.keys})")
+
+        keys_file = os.path.join(tmp, 'keys.txt')
+        with open(keys_file, 'w') as f:
+            f.write('\n'.join(keys))
+        app = make_app(os.path.join(tmp, 'bulk.db'))
+        with app.app_context():
+            t0 = time.perf_counter()
+            ok, message = load_keys_from_file(keys_file)
+            elapsed = time.perf_counter() - t0
+            print(f"bulk import {args.keys} keys from file: {elapsed:.2f}s ({args.keys / elapsed:,.0f} keys/s) - {message}")
+
+            t0 = time.perf_counter()
+            ok, message = load_keys_from_file(keys_file)
+            print(f"re-import (all duplicates): {time.perf_counter() - t0:.2f}s - {message}")
+
+            t0 = time.perf_counter()
+            created = RegistrationKey.bulk_create(args.keys)
+            elapsed = time.perf_counter() - t0
+            print(f"bulk_create({args.keys}): {elapsed:.2f}s ({len(created) / elapsed:,.0f} keys/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+# benchmarks/bench_startup.py
+"""
+Cold start of a worker: import time and create_app() time, in fresh processes.
+
+Runs `from app import create_app; create_app(...)` in a new interpreter
+(against a database whose schema is already current, like a restarted
+worker) with the chat stack loaded lazily (default) and with
+PRELOAD_CHAT_STACK=true (the old eager startup), and reports the median over
+--runs. Then prints an import-time profile (`python -X importtime`) of a lazy
+start, grouped by top-level package, and what the first chat request pays to
+import the chat stack.
+
+    python benchmarks/bench_startup.py [--runs 5] [--top 12] [--target 0.3]
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+START = '''
+import time
+started = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+app = create_app('development')
+created = time.perf_counter()
+before_chat = time.perf_counter()
+from app.services import chat_service
+print(imported - started, created - started, time.perf_counter() - before_chat)
+'''
+
+
+def run(code, workdir, preload=False, importtime=False):
+    env = dict(os.environ, PRELOAD_CHAT_STACK='true' if preload else 'false',
+               SECRET_KEY=os.getenv('SECRET_KEY', 'bench'), JWT_SECRET_KEY=os.getenv('JWT_SECRET_KEY', 'bench'),
+               PYTHONPATH=os.pathsep.join(filter(None, [ROOT, os.getenv('PYTHONPATH')])))
+    args = [sys.executable, '-X', 'importtime', '-c', code] if importtime else [sys.executable, '-c', code]
+    result = subprocess.run(args, cwd=workdir, env=env, capture_output=True, text=True, check=True)
+    return result.stdout, result.stderr
+
+
+def timings(workdir, preload, runs):
+    samples = [tuple(map(float, run(START, workdir, preload)[0].split()[-3:])) for _ in range(runs)]
+    return [statistics.median(column) for column in zip(*samples)]
+
+
+def import_profile(workdir):
+    """Import time (self, microseconds) summed per top-level package."""
+    _, stderr = run("from app import create_app; create_app('development')", workdir, importtime=True)
+    totals = defaultdict(int)
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        own, _, name = line[len('import time:'):].split('|')
+        totals[name.strip().split('.')[0]] += int(own)
+    return sorted(totals.items(), key=lambda item: -item[1])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--runs', type=int, default=5, help='fresh processes per variant')
+    parser.add_argument('--top', type=int, default=12, help='packages shown in the import profile')
+    parser.add_argument('--target', type=float, default=0.3, help='cold start target for create_app, seconds')
+    args = parser.parse_args()
+    workdir = tempfile.mkdtemp()
+    run(START, workdir)  # Creates the database schema (and warms the OS file cache)
+
+    lazy_import, lazy_start, first_chat = timings(workdir, False, args.runs)
+    _, eager_start, _ = timings(workdir, True, args.runs)
+    print(f"lazy  (default)          import {lazy_import * 1000:6.0f} ms, create_app done at {lazy_start * 1000:6.0f} ms; "
+          f"first chat imports the chat stack in {first_chat * 1000:.0f} ms")
+    print(f"eager (PRELOAD_CHAT_STACK)                     create_app done at {eager_start * 1000:6.0f} ms")
+    verdict = 'met' if lazy_start <= args.target else 'MISSED'
+    print(f"cold start target {args.target * 1000:.0f} ms: {verdict} ({eager_start / lazy_start:.1f}x faster than eager)")
+
+    print(f"\nimport profile of a lazy start (top {args.top} packages, ms):")
+    for package, micros in import_profile(workdir)[:args.top]:
+        print(f"  {package:28s} {micros / 1000:7.1f}")
+
+
+if __name__ == '__main__':
+    main()
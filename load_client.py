@@ -1,25 +1,38 @@
-from openai import AsyncOpenAI
-from dotenv import load_dotenv
 import os
 import logging
-from agents import set_default_openai_client, set_tracing_disabled
+import threading
+
+# openai / agents / httpx are imported on first use: they dominate import time and
+# most processes (CLI commands, workers that haven't served a chat yet) never need them.
+# The environment (.env) is loaded once by the entry point (run.py).
 
 logger = logging.getLogger(__name__)
 client = None
+_client_pid = None  # The client's connection pool must not be shared across fork()
+_lock = threading.Lock()
 
 def get_client():
     global client
-    return client
+    return client if isClientLoaded() else None
 
 def isClientLoaded():
     global client
-    return client is not None
+    return client is not None and _client_pid == os.getpid()
 
 def load_client():
-    logger.info("[DEBUG] Loading OpenAI client")
+    with _lock:
+        if isClientLoaded():  # Another thread got here first
+            return client
+        return _load_client()
+
+def _load_client():
+    global client, _client_pid
+    logger.info(f"[DEBUG] Loading OpenAI client (pid {os.getpid()})")
     try:
-        load_dotenv()
-        
+        import httpx
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+        from agents import set_default_openai_client, set_tracing_disabled
+
         # Check for required environment variables
         api_key = os.getenv("OPENROUTER_API_KEY")
         helicone_key = os.getenv("HELICONE_API_KEY")
@@ -33,10 +46,15 @@ def load_client():
             raise ValueError("HELICONE_API_KEY is required but not found in environment variables")
         
         logger.info("[DEBUG] Creating AsyncOpenAI client")
-        global client
         client = AsyncOpenAI(
             base_url="https://gateway.helicone.ai/api/v1",
             api_key=api_key,
+            # Keep idle gateway connections around so requests skip TCP/TLS setup
+            http_client=DefaultAsyncHttpxClient(limits=httpx.Limits(
+                max_connections=int(os.getenv("UPSTREAM_MAX_CONNECTIONS", 1000)),
+                max_keepalive_connections=int(os.getenv("UPSTREAM_MAX_KEEPALIVE_CONNECTIONS", 100)),
+                keepalive_expiry=float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", 120)),
+            )),
             default_headers={
                 "Helicone-Auth": f"Bearer {helicone_key}",
                 "Helicone-Target-Url": "https://openrouter.ai",
@@ -50,6 +68,7 @@ def load_client():
         logger.info("[DEBUG] Configuring agents SDK")
         set_tracing_disabled(True)
         set_default_openai_client(client)
+        _client_pid = os.getpid()
         logger.info("[DEBUG] Client loaded successfully")
         return client
         
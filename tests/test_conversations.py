@@ -0,0 +1,123 @@
+# tests/test_conversations.py
+import time
+
+import pytest
+
+from app.models.conversation import Conversation
+from app.models.message import Message
+from app.utils.db import get_db
+
+
+@pytest.fixture
+def conversation(user):
+    conversation = Conversation.create(user.id)
+    for role, content in [('user', 'q1'), ('assistant', 'a1'), ('user', 'q2'), ('assistant', 'a2')]:
+        Message.create(conversation.id, role, content)
+    return Conversation.get_by_id(conversation.id)
+
+
+def test_create_and_get(user, conversation):
+    assert conversation.user_id == user.id and conversation.title == 'New Conversation'
+    assert [m.content for m in conversation.messages] == ['q1', 'a1', 'q2', 'a2']
+    assert conversation.active_message_id == conversation.messages[-1].id
+    assert Conversation.get_owner_id(conversation.id) == user.id
+    assert Conversation.get_by_id(10 ** 6) is None
+
+
+def test_list_and_rename(user, conversation):
+    other = Conversation.create(user.id, 'Other')
+    assert {c.id for c in Conversation.get_by_user_id(user.id)} == {conversation.id, other.id}
+    conversation.update_title('Renamed')
+    assert Conversation.get_by_id(conversation.id).title == 'Renamed'
+
+
+def test_list_has_each_active_branch(user, conversation):
+    from app.models.user import User
+    a1 = conversation.messages[1]
+    Message.create(conversation.id, 'user', 'q2 edited', parent_id=a1.id, active_if=Message.ALWAYS)
+    empty = Conversation.create(user.id, 'Empty')
+    Conversation.create(User.create('bob', 'battery staple').id)
+
+    listed = Conversation.get_by_user_id(user.id)
+
+    assert [c.id for c in listed] == [c.id for c in sorted(listed, key=lambda c: (c.updated_at, c.id), reverse=True)]
+    assert {c.id for c in listed} == {conversation.id, empty.id}
+    by_id = {c.id: c for c in listed}
+    assert [m.content for m in by_id[conversation.id].messages] == ['q1', 'a1', 'q2 edited']
+    assert [m.to_dict() for m in by_id[conversation.id].messages] == \
+        [m.to_dict() for m in Message.get_branch(conversation.id)]
+    assert by_id[empty.id].messages == []
+
+
+def test_fingerprints_change_with_content(user, conversation):
+    _, before = Conversation.fingerprint(conversation.id)
+    listing = Conversation.list_fingerprint(user.id)
+    Message.create(conversation.id, 'user', 'q3')
+    assert Conversation.fingerprint(conversation.id)[1] != before
+    assert Conversation.list_fingerprint(user.id) != listing
+
+
+def test_switch_branch(conversation):
+    q2, a2 = conversation.messages[2:]
+    edited = Message.create(conversation.id, 'user', 'q2 edited', q2.parent_id, active_if=Message.ALWAYS)
+    Message.create(conversation.id, 'assistant', 'a2 for the edit')
+    assert [m.content for m in Conversation.get_by_id(conversation.id).messages][-2:] == ['q2 edited', 'a2 for the edit']
+
+    assert Conversation.set_active_branch(conversation.id, q2.id) == a2.id
+    shown = Conversation.get_by_id(conversation.id, siblings=True)
+    assert [m.content for m in shown.messages] == ['q1', 'a1', 'q2', 'a2']
+    assert shown.messages[2].sibling_ids == [q2.id, edited.id]
+    assert Conversation.set_active_branch(conversation.id, 10 ** 6) is None
+
+
+@pytest.mark.parametrize('soft', [True, False])
+def test_delete(user, conversation, soft):
+    assert conversation.delete(soft=soft)
+    assert Conversation.get_by_id(conversation.id) is None
+    remaining = get_db().execute('SELECT COUNT(*) FROM messages WHERE conversation_id = ?', (conversation.id,)).fetchone()[0]
+    assert remaining == (4 if soft else 0)  # Soft deletes leave the rows to the purger
+
+
+def test_delete_many_only_touches_own_conversations(user, conversation):
+    from app.models.user import User
+    mallory = User.create('mallory', 'pw')
+    theirs = Conversation.create(mallory.id)
+    assert Conversation.delete_many(user.id, [conversation.id, theirs.id]) == [conversation.id]
+    assert Conversation.get_by_id(theirs.id) is not None
+
+
+def test_archive_round_trip(conversation):
+    from app.utils.archive import archive_conversation, archive_idle_conversations, attach_archive
+    before = [(m.id, m.parent_id, m.content) for m in conversation.messages]
+    db = attach_archive()
+    db.execute("UPDATE conversations SET updated_at = '2000-01-01 00:00:00' WHERE id = ?", (conversation.id,))
+    archive_conversation(db, conversation.id)
+    db.commit()
+    assert get_db().execute('SELECT COUNT(*) FROM messages').fetchone()[0] == 0
+    assert [c.archived_at is not None for c in Conversation.get_by_user_id(conversation.user_id)] == [True]
+
+    restored = Conversation.get_by_id(conversation.id)  # Opening restores it
+    assert [(m.id, m.parent_id, m.content) for m in restored.messages] == before
+    assert restored.active_message_id == before[-1][0]
+    assert str(restored.updated_at) > '2000-01-01 00:00:00'
+    assert archive_idle_conversations(idle_days=1) == 0  # Not archived again straight away
+
+
+def test_archive_job_reschedules_itself(make_app):
+    from app.models.user import User
+    from app.utils.archive import archive_job
+    app = make_app(JOBS_WORKERS=1, ARCHIVE_INTERVAL=3600)
+    with app.app_context():
+        conversation = Conversation.create(User.create('alice', 'correct horse').id)
+        Message.create(conversation.id, 'user', 'hello')
+        db = get_db()
+        db.execute("UPDATE conversations SET updated_at = '2000-01-01 00:00:00' WHERE id = ?", (conversation.id,))
+        db.commit()
+
+        archive_job()
+        archive_job()  # Only one next sweep is queued
+
+        assert Conversation.get_by_user_id(conversation.user_id)[0].archived_at is not None
+        queued = db.execute("SELECT run_at FROM jobs WHERE name = 'conversations.archive_idle'").fetchall()
+        assert len(queued) == 1 and queued[0]['run_at'] > time.time() + 3000
+
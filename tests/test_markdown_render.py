@@ -0,0 +1,48 @@
+# tests/test_markdown_render.py
+import pytest
+
+pytest.importorskip('markdown')
+
+from app.utils.markdown_render import IncrementalRenderer, render  # noqa: E402
+
+
+def stream(text, chunk=3):
+    """Feed `text` in small chunks; returns the final HTML of each block, in order."""
+    renderer = IncrementalRenderer()
+    blocks, final = {}, set()
+    events = []
+    for i in range(0, len(text), chunk):
+        events += renderer.feed(text[i:i + chunk])
+    events += renderer.finish()
+    for event in events:
+        assert event['index'] not in final or event['final'], "a final block went back to open"
+        blocks[event['index']] = event['html']
+        if event['final']:
+            final.add(event['index'])
+    assert final == set(blocks) == set(range(len(blocks)))
+    return [blocks[i] for i in range(len(blocks))]
+
+
+@pytest.mark.parametrize('text', [
+    "1. first\n\n2. second\n\n3. third",
+    "- item\n\n    continued paragraph\n\n- next item\n\nAfter the list.",
+    "> quoted\n\n> still quoted\n\nplain",
+    "Intro\n\n```python\nx = 1\n\n\ny = 2\n```\n\nOutro",
+    "~~~\n```\n\n~~~\n\ntext",
+    "See [the docs][docs].\n\nMore text.\n\n[docs]: https://example.com/docs",
+    "# Title\n\nParagraph one\nline two\n\n| a | b |\n|---|---|\n| 1 | 2 |\n\nEnd",
+])
+def test_streamed_blocks_match_the_full_render(text):
+    for chunk in (1, 3, len(text)):
+        assert '\n'.join(stream(text, chunk)) == render(text)
+
+
+def test_paragraphs_are_separate_blocks():
+    assert stream("one\n\ntwo\n\nthree") == ['<p>one</p>', '<p>two</p>', '<p>three</p>']
+
+
+def test_closed_blocks_are_final_before_the_answer_ends():
+    renderer = IncrementalRenderer()
+    events = renderer.feed("first paragraph\n\nsecond")
+    assert {'index': 0, 'html': '<p>first paragraph</p>', 'final': True} in events
+    assert events[-1] == {'index': 1, 'html': '<p>second</p>', 'final': False}
@@ -0,0 +1,79 @@
+# tests/test_messages.py
+import pytest
+
+from app.models.conversation import Conversation
+from app.models.message import Message
+
+
+@pytest.fixture
+def conversation(user):
+    return Conversation.create(user.id)
+
+
+def test_messages_continue_the_active_branch(conversation):
+    first = Message.create(conversation.id, 'user', 'hello')
+    reply = Message.create(conversation.id, 'assistant', 'hi there')
+    assert first.parent_id is None and reply.parent_id == first.id
+    assert [m.content for m in Message.get_branch(conversation.id)] == ['hello', 'hi there']
+
+
+def test_long_content_is_stored_compressed(app, conversation):
+    content = 'lorem ipsum dolor sit amet ' * 200
+    message = Message.create(conversation.id, 'assistant', content)
+    from app.utils.db import get_db
+    row = get_db().execute('SELECT content, content_encoding FROM messages WHERE id = ?', (message.id,)).fetchone()
+    assert row['content'] == '' and row['content_encoding']
+    assert Message.get_by_id(message.id).content == content
+
+
+def test_zstd_falls_back_to_zlib_without_zstandard(app, monkeypatch):
+    from app.utils import compression
+    monkeypatch.setattr(compression, 'zstandard', None)
+    blob, encoding = compression.compress_payload(b'payload ' * 100, 'zstd')
+    assert encoding == 'zlib' and compression.decompress_payload(blob, encoding) == b'payload ' * 100
+
+
+def test_migration_measures_the_threshold_in_bytes(app, conversation):
+    from app.utils.compression import migrate_messages
+    content = 'é' * 600  # 600 characters, 1200 bytes: over the 1024-byte threshold
+    app.config['MESSAGE_COMPRESSION'] = 'none'
+    message = Message.create(conversation.id, 'assistant', content)
+    app.config['MESSAGE_COMPRESSION'] = 'zlib'
+    assert migrate_messages() == 1
+    assert Message.get_by_id(message.id).content == content
+
+
+def test_trained_dictionary_is_used_right_away(app, conversation):
+    pytest.importorskip('zstandard')
+    from app.utils import compression
+    assert compression.compress_payload(b'x' * 2000, 'zstd')[1] == 'zstd'  # Caches "no dictionary"
+    for i in range(20):
+        Message.create(conversation.id, 'assistant', f'message {i}: ' + 'lorem ipsum dolor sit amet ' * 60)
+    dict_id = compression.train_dictionary(dict_size=4096)
+    assert compression.compress_payload(b'x' * 2000, 'zstd')[1] == f'zstd:{dict_id}'
+
+
+def test_regenerated_reply_is_a_sibling(conversation):
+    question = Message.create(conversation.id, 'user', 'q')
+    old = Message.create(conversation.id, 'assistant', 'old answer')
+    new = Message.create(conversation.id, 'assistant', 'new answer', question.id, active_if=old.id)
+    branch = Message.load_siblings(conversation.id, Message.get_branch(conversation.id))
+    assert [m.id for m in branch] == [question.id, new.id]
+    assert branch[-1].sibling_ids == [old.id, new.id]
+    assert len(Message.get_by_conversation_id(conversation.id)) == 3  # No history was copied
+
+
+def test_late_reply_does_not_hide_newer_messages(conversation):
+    first = Message.create(conversation.id, 'user', 'one', active_if=Message.ALWAYS)
+    second = Message.create(conversation.id, 'user', 'two', active_if=Message.ALWAYS)
+    Message.create(conversation.id, 'assistant', 'reply to one', first.id)
+    assert Conversation.get_by_id(conversation.id).active_message_id == second.id
+
+
+def test_newest_leaf_follows_newest_children(conversation):
+    root = Message.create(conversation.id, 'user', 'q')
+    Message.create(conversation.id, 'assistant', 'a1')
+    a2 = Message.create(conversation.id, 'assistant', 'a2', root.id, active_if=Message.ALWAYS)
+    follow_up = Message.create(conversation.id, 'user', 'more')
+    assert follow_up.parent_id == a2.id
+    assert Message.newest_leaf(conversation.id, root.id) == follow_up.id
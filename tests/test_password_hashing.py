@@ -0,0 +1,35 @@
+# tests/test_password_hashing.py
+import pytest
+
+from app.utils.password_hashing import HashingBusy, PasswordHasher
+
+
+@pytest.mark.parametrize('method, expanded', [
+    ('pbkdf2', 'pbkdf2:sha256:600000'),
+    ('pbkdf2:sha256', 'pbkdf2:sha256:600000'),
+    ('scrypt', 'scrypt:32768:8:1'),
+    ('pbkdf2:sha256:1000', 'pbkdf2:sha256:1000'),
+])
+def test_shorthand_methods_do_not_force_a_rehash(method, expanded):
+    hasher = PasswordHasher(method=method, workers=0)
+    assert not hasher.needs_rehash(f'{expanded}$salt$hash')
+    assert hasher.needs_rehash('pbkdf2:sha256:1$salt$hash')
+
+
+def test_hash_and_verify_in_the_pool():
+    hasher = PasswordHasher(method='pbkdf2:sha256:1000', workers=1)
+    try:
+        password_hash = hasher.hash('secret')
+        assert password_hash.startswith('pbkdf2:sha256:1000$')
+        assert hasher.verify(password_hash, 'secret')
+        assert not hasher.verify(password_hash, 'wrong')
+        assert not hasher.needs_rehash(password_hash)
+    finally:
+        hasher.shutdown()
+
+
+def test_saturated_pool_rejects_instead_of_queueing():
+    hasher = PasswordHasher(method='pbkdf2:sha256:1000', workers=1, max_pending=1, queue_timeout=0.01)
+    assert hasher._slots.acquire(timeout=0)  # A hash already in flight
+    with pytest.raises(HashingBusy):
+        hasher.hash('secret')
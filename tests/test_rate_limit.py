@@ -0,0 +1,54 @@
+# tests/test_rate_limit.py
+import time
+
+import pytest
+
+from app.models.conversation import Conversation
+from app.utils.rate_limit import MemoryStore, RateLimitExceeded, get_rate_limiter
+
+
+def test_memory_store_leases_expire():
+    store = MemoryStore()
+    assert store.acquire('streams:global', 1, ttl=0.05) is not None
+    assert store.acquire('streams:global', 1, ttl=0.05) is None
+    time.sleep(0.1)
+    assert store.count('streams:global') == 0
+    assert store.acquire('streams:global', 1, ttl=0.05) is not None
+
+
+def test_lease_is_released_when_the_stream_fails_to_start(make_app, monkeypatch):
+    from app.models.user import User
+    from app.services import chat_service
+
+    def broken(app_instance):
+        raise RuntimeError("stream broker is down")
+
+    app = make_app(RATE_LIMIT_ENABLED=True, MAX_CONCURRENT_STREAMS_PER_USER=1)
+    monkeypatch.setattr(chat_service, 'get_stream_broker', broken)
+    with app.app_context():
+        user = User.create('alice', 'correct horse')
+        conversation = Conversation.create(user.id)
+        for _ in range(2):  # A leaked lease would turn the second attempt into a RateLimitExceeded
+            with pytest.raises(RuntimeError):
+                chat_service.start_stream(app, user.id, conversation.id, 'hi', 'openai/gpt-4o-mini')
+        assert get_rate_limiter(app).active_streams() == 0
+
+
+def test_model_rejection_refunds_the_user_token(make_app):
+    app = make_app(RATE_LIMIT_ENABLED=True, RATE_LIMIT_USER_RATE=0.001, RATE_LIMIT_USER_BURST=2,
+                   RATE_LIMIT_MODEL_RATE=0.001, RATE_LIMIT_MODEL_BURST=1)
+    limiter = get_rate_limiter(app)
+    limiter.check_rate(1, 'm')
+    with pytest.raises(RateLimitExceeded):
+        limiter.check_rate(1, 'm')  # Rejected by the model bucket
+    assert limiter.store.take('user:1', limiter.user_rate, limiter.user_burst) == 0
+
+
+def test_held_leases_are_renewed(make_app):
+    app = make_app(RATE_LIMIT_ENABLED=True, STREAM_LEASE_TTL=0.3)
+    limiter = get_rate_limiter(app)
+    lease = limiter.admit(1)
+    time.sleep(0.8)  # Well past the TTL
+    assert limiter.active_streams() == 1
+    lease.release()
+    assert limiter.active_streams() == 0
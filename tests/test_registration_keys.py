@@ -0,0 +1,50 @@
+# tests/test_registration_keys.py
+from app.models.registration_key import RegistrationKey
+
+
+def test_create_and_mark_used(app, user):
+    key = RegistrationKey.create()
+    assert len(key.key_value) == 16 and not key.is_used
+    assert key.mark_as_used(user.id)
+    assert not key.mark_as_used(user.id)
+    stored = RegistrationKey.get_by_value(key.key_value)
+    assert stored.is_used and stored.used_by == user.id and stored.used_at
+
+
+def test_bulk_create_and_counts(app, user):
+    created = RegistrationKey.bulk_create(250, chunk_size=100)
+    assert len(set(created)) == 250
+    RegistrationKey.get_by_value(created[0]).mark_as_used(user.id)
+    assert RegistrationKey.counts() == {'total': 250, 'used': 1, 'unused': 249}
+
+
+def test_bulk_insert_skips_existing(app):
+    existing = RegistrationKey.create().key_value
+    added, skipped = RegistrationKey.bulk_insert(iter([existing, 'a' * 16, 'b' * 16, 'a' * 16]), chunk_size=2)
+    assert (added, skipped) == (2, 2)
+
+
+def test_list_page_walks_keys_newest_first(app, user):
+    created = RegistrationKey.bulk_create(5)
+    for value in created[:2]:
+        RegistrationKey.get_by_value(value).mark_as_used(user.id)
+
+    first, cursor = RegistrationKey.list_page(limit=3)
+    second, end = RegistrationKey.list_page(limit=3, before_id=cursor)
+    assert [k.id for k in first + second] == sorted((k.id for k in first + second), reverse=True)
+    assert len(first) == 3 and len(second) == 2 and end is None
+
+    used, _ = RegistrationKey.list_page(is_used=True)
+    assert {k.key_value for k in used} == set(created[:2])
+    assert {k.key_value for k in RegistrationKey.list_page(used_by=user.id)[0]} == set(created[:2])
+
+
+def test_list_page_date_range_includes_whole_days(app):
+    from app.utils.db import get_db
+    for value, created_at in [('a' * 16, '2024-05-01 00:00:00'), ('b' * 16, '2024-05-02 23:59:59'),
+                              ('c' * 16, '2024-05-03 00:00:00')]:
+        get_db().execute('INSERT INTO registration_keys (key_value, created_at) VALUES (?, ?)', (value, created_at))
+    get_db().commit()
+
+    keys, _ = RegistrationKey.list_page(created_from='2024-05-01', created_to='2024-05-02')
+    assert [k.key_value for k in keys] == ['b' * 16, 'a' * 16]
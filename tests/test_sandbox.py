@@ -0,0 +1,114 @@
+# tests/test_sandbox.py
+"""
+ShellSandbox (app/tools/sandbox.py). Commands need Linux namespaces (root, or
+unprivileged user namespaces); those tests are skipped where they aren't
+available.
+"""
+import asyncio
+import sys
+import time
+
+import pytest
+
+from app.tools import sandbox as sandbox_module
+from app.tools.sandbox import SandboxBusy, ShellSandbox, run_command
+
+pytestmark = pytest.mark.skipif(not sys.platform.startswith('linux'), reason="the sandbox needs Linux")
+
+
+def run(coroutine):
+    return asyncio.run(coroutine)
+
+
+@pytest.fixture(scope='module')
+def sandbox():
+    sandbox = ShellSandbox(workers=2, max_per_user=1, max_pending=2, max_timeout=5, cpu_seconds=1,
+                           max_output=1000)
+    result = run(sandbox.run('true', user_id=0))
+    if result['returncode'] is None:
+        sandbox.shutdown()
+        pytest.skip(f"namespaces are not available here: {result['stderr']}")
+    yield sandbox
+    sandbox.shutdown()
+
+
+def test_runs_a_command(sandbox):
+    result = run(sandbox.run('echo hi; echo oops >&2; exit 3', user_id=1))
+
+    assert result == {'returncode': 3, 'stdout': 'hi\n', 'stderr': 'oops\n', 'truncated': False, 'timed_out': False}
+
+
+def test_timeout_kills_the_process_group(sandbox):
+    started = time.monotonic()
+    result = run(sandbox.run('sleep 30 & sleep 30', timeout=1, user_id=1))
+
+    assert result['timed_out']
+    assert result['returncode'] == -9
+    assert time.monotonic() - started < 3
+
+
+def test_cpu_rlimit_kills_a_busy_loop(sandbox):
+    result = run(sandbox.run('while :; do :; done', timeout=5, user_id=1))
+
+    assert not result['timed_out']
+    assert result['returncode'] < 0  # SIGXCPU (or SIGKILL at the hard limit)
+
+
+def test_output_is_truncated(sandbox):
+    result = run(sandbox.run('yes', user_id=1))
+
+    assert result['truncated']
+    assert len(result['stdout']) == 1000
+
+
+def test_per_user_cap(sandbox):
+    async def main():
+        first = asyncio.ensure_future(sandbox.run('sleep 0.5', user_id=1))
+        await asyncio.sleep(0)  # The first command is admitted
+        with pytest.raises(SandboxBusy):
+            await sandbox.run('true', user_id=1)
+        assert (await sandbox.run('true', user_id=2))['returncode'] == 0  # Other users still get a slot
+        await first
+
+    run(main())
+
+
+def test_total_cap(sandbox):
+    async def main():
+        running = [asyncio.ensure_future(sandbox.run('sleep 0.5', user_id=user_id)) for user_id in (1, 2)]
+        await asyncio.sleep(0)
+        with pytest.raises(SandboxBusy):
+            await sandbox.run('true', user_id=3)
+        await asyncio.gather(*running)
+        assert (await sandbox.run('true', user_id=3))['returncode'] == 0
+
+    run(main())
+
+
+def test_slot_is_held_until_the_command_ends(sandbox):
+    async def main():
+        command = asyncio.ensure_future(sandbox.run('sleep 1', user_id=1))
+        await asyncio.sleep(0.3)
+        command.cancel()  # The caller gives up (e.g. the tool call timed out); the command still runs
+        await asyncio.sleep(0.1)
+        with pytest.raises(SandboxBusy):
+            await sandbox.run('true', user_id=1)
+        await asyncio.sleep(1.2)
+        assert (await sandbox.run('true', user_id=1))['returncode'] == 0
+
+    run(main())
+
+
+def test_setup_failure_refuses_the_command(tmp_path, monkeypatch):
+    def refuse(isolate_network):
+        raise OSError(1, "unshare: Operation not permitted")
+
+    monkeypatch.setattr(sandbox_module, '_enter_namespaces', refuse)
+    marker = tmp_path / 'ran'
+    limits = ShellSandbox().limits
+
+    result = run_command(f'touch {marker}', 5, limits)
+
+    assert result['returncode'] is None
+    assert result['stderr'].startswith('Sandbox setup failed')
+    assert not marker.exists()
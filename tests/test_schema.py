@@ -0,0 +1,53 @@
+# tests/test_schema.py
+from app.models.conversation import Conversation
+from app.models.message import Message
+from app.utils.db import SCHEMA_VERSION, get_db, init_db, schema_version
+
+
+def test_init_db_is_skipped_when_current(app):
+    assert schema_version(get_db()) == SCHEMA_VERSION
+    assert init_db() is False
+    assert init_db(force=True) is True
+
+
+def test_messages_without_cascade_are_migrated(app, user):
+    db = get_db()
+    conversation = Conversation.create(user.id)
+    Message.create(conversation.id, 'user', 'hello')
+    # Recreate the messages table the way databases from before the cascade had it
+    rows = db.execute('SELECT id, conversation_id, role, content FROM messages').fetchall()
+    db.execute('DROP TABLE message_html')
+    db.execute('DROP TABLE messages')
+    db.execute('''
+        CREATE TABLE messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            conversation_id INTEGER NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (conversation_id) REFERENCES conversations (id)
+        )
+    ''')
+    db.executemany('INSERT INTO messages (id, conversation_id, role, content) VALUES (?, ?, ?, ?)',
+                   [tuple(row) for row in rows])
+    db.commit()
+
+    init_db(force=True)
+    assert Conversation.delete_many(user.id, [conversation.id]) == [conversation.id]
+    assert get_db().execute('SELECT COUNT(*) FROM messages').fetchone()[0] == 0
+
+
+def test_linear_history_is_migrated_to_a_branch(app, user):
+    db = get_db()
+    conversation = Conversation.create(user.id)
+    for i in range(4):
+        Message.create(conversation.id, 'user' if i % 2 == 0 else 'assistant', f'm{i}')
+    db.execute('UPDATE messages SET parent_id = NULL')
+    db.execute('UPDATE conversations SET active_message_id = NULL')
+    db.execute('UPDATE schema_version SET version = 1')
+    db.commit()
+
+    assert init_db() is True
+    messages = Conversation.get_by_id(conversation.id).messages
+    assert [m.content for m in messages] == ['m0', 'm1', 'm2', 'm3']
+    assert [m.parent_id for m in messages] == [None] + [m.id for m in messages[:-1]]
@@ -0,0 +1,144 @@
+# tests/test_tool_runtime.py
+"""
+guard_tool (app/tools/runtime.py) driven through the Agents SDK runner by a
+stub model, so no upstream is needed.
+"""
+import asyncio
+import time
+
+import pytest
+
+agents = pytest.importorskip('agents')
+
+from agents import Agent, ModelResponse, ModelSettings, Runner, Usage, function_tool  # noqa: E402
+from agents.models.interface import Model  # noqa: E402
+from openai.types.responses import (  # noqa: E402
+    ResponseFunctionToolCall, ResponseOutputMessage, ResponseOutputText,
+)
+
+from app.tools.context import ToolContext  # noqa: E402
+from app.tools.runtime import guard_tool  # noqa: E402
+
+DELAY = 0.3
+
+
+class StubModel(Model):
+    """Asks for one tool call per delay of each step in `steps`, then answers 'done'."""
+
+    def __init__(self, tool_name, steps):
+        self.tool_name = tool_name
+        self.steps = list(steps)
+        self.calls = 0
+
+    async def get_response(self, *args, **kwargs):
+        if self.steps:
+            delays = self.steps.pop(0)
+            output = [
+                ResponseFunctionToolCall(type='function_call', id=f'fc_{self.calls + i}',
+                                         call_id=f'call_{self.calls + i}', name=self.tool_name,
+                                         arguments=f'{{"seconds": {delay}}}')
+                for i, delay in enumerate(delays)
+            ]
+            self.calls += len(delays)
+        else:
+            output = [ResponseOutputMessage(
+                type='message', id='msg_1', role='assistant', status='completed',
+                content=[ResponseOutputText(type='output_text', text='done', annotations=[])],
+            )]
+        return ModelResponse(output=output, usage=Usage(), response_id=None)
+
+    def stream_response(self, *args, **kwargs):
+        raise NotImplementedError
+
+
+@function_tool
+async def wait_async(seconds: float) -> str:
+    """Wait without blocking the event loop."""
+    await asyncio.sleep(seconds)
+    return 'ok'
+
+
+@pytest.fixture(autouse=True)
+def no_tracing():
+    agents.set_tracing_disabled(True)
+
+
+def run_turn(steps, call_timeout=30.0, tool_budget=60.0, max_parallel=None):
+    """Run one agent turn; returns (seconds, tool outputs by call id, progress events)."""
+    events = []
+    context = ToolContext(app=None, emit=events.append, tool_budget=tool_budget, max_parallel=max_parallel)
+    tool = guard_tool(wait_async, call_timeout=call_timeout)
+    agent = Agent(name='test', instructions='', model=StubModel(tool.name, steps), tools=[tool],
+                  model_settings=ModelSettings(parallel_tool_calls=True))
+    started = time.perf_counter()
+    result = asyncio.run(Runner.run(agent, input='go', context=context))
+    seconds = time.perf_counter() - started
+    assert result.final_output == 'done'
+    outputs = {item.raw_item['call_id']: item.output
+               for item in result.new_items if item.type == 'tool_call_output_item'}
+    return seconds, outputs, events
+
+
+def statuses(events, call_id):
+    return [event['status'] for event in events if event['id'] == call_id]
+
+
+def test_calls_of_one_step_run_concurrently():
+    serial, _, _ = run_turn([[DELAY] * 4], max_parallel=1)
+    parallel, outputs, events = run_turn([[DELAY] * 4], max_parallel=4)
+
+    assert serial >= 4 * DELAY
+    assert parallel < 2 * DELAY
+    assert serial - parallel >= 2 * DELAY  # Latency saved per turn
+    assert outputs == {f'call_{i}': 'ok' for i in range(4)}
+    assert sum(1 for event in events if event['status'] == 'done') == 4
+
+
+def test_max_parallel_limits_concurrent_calls():
+    seconds, outputs, _ = run_turn([[DELAY] * 4], max_parallel=2)
+
+    assert 2 * DELAY <= seconds < 3 * DELAY
+    assert set(outputs.values()) == {'ok'}
+
+
+def test_progress_events():
+    _, _, events = run_turn([[DELAY, DELAY]])
+
+    for call_id in ('call_0', 'call_1'):
+        assert statuses(events, call_id) == ['running', 'done']
+    done = [event for event in events if event['status'] == 'done']
+    assert all(event['name'] == 'wait_async' and event['seconds'] >= DELAY for event in done)
+    # Both calls were running before either finished
+    assert [event['status'] for event in events] == ['running', 'running', 'done', 'done']
+
+
+def test_call_timeout():
+    seconds, outputs, events = run_turn([[DELAY, 5.0]], call_timeout=1.0)
+
+    assert seconds < 2.0
+    assert outputs['call_0'] == 'ok'
+    assert outputs['call_1'] == 'Error: wait_async did not finish within 1.0 seconds'
+    assert statuses(events, 'call_1') == ['running', 'timeout']
+    timeout = next(event for event in events if event['status'] == 'timeout')
+    assert 1.0 <= timeout['seconds'] < 1.5
+
+
+def test_waiting_for_a_slot_counts_against_the_timeout():
+    _, outputs, events = run_turn([[DELAY, DELAY]], call_timeout=DELAY * 1.5, max_parallel=1)
+
+    assert outputs['call_0'] == 'ok'
+    assert outputs['call_1'].startswith('Error: wait_async did not finish')
+    assert statuses(events, 'call_1') == ['running', 'timeout']
+
+
+def test_turn_budget():
+    # The first step's call uses up the turn's budget; the next step's call is not run
+    seconds, outputs, events = run_turn([[5.0], [DELAY]], tool_budget=0.5)
+
+    assert seconds < 1.5
+    assert outputs['call_0'] == 'Error: wait_async did not finish within 0.5 seconds'
+    assert outputs['call_1'] == (
+        'Error: the time budget for tool calls in this turn is used up; wait_async was not run'
+    )
+    assert statuses(events, 'call_1') == ['timeout']
+    assert events[-1] == {'id': 'call_1', 'name': 'wait_async', 'status': 'timeout', 'seconds': 0}
@@ -0,0 +1,32 @@
+# tests/test_usage.py
+import datetime
+import threading
+
+from app.models.usage import Usage
+from app.services.usage import UsageTracker
+
+
+def test_quota_read_during_a_flush_counts_each_record_once(app, user, monkeypatch):
+    tracker = UsageTracker(app, daily_quota=1000, flush_interval=0)  # record() flushes synchronously
+    today = datetime.datetime.now(datetime.timezone.utc).date()
+    insert_many = Usage.insert_many
+    readers, totals = [], []
+
+    def read_totals():
+        with app.app_context():
+            totals.append(tracker._user_totals(user.id, today.isoformat(), today.replace(day=1).isoformat()))
+
+    def insert_then_read(records):
+        # A cache miss after the batch is committed, before flush() returns
+        written = insert_many(records)
+        readers.append(threading.Thread(target=read_totals))
+        readers[0].start()
+        readers[0].join(0.2)
+        return written
+
+    monkeypatch.setattr(Usage, 'insert_many', insert_then_read)
+    tracker.record(user.id, 'm', 100, 50)
+    readers[0].join()
+
+    assert totals == [(150, 150)]
+    assert tracker.remaining(user.id)['day']['used'] == 150
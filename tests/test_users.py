@@ -0,0 +1,29 @@
+# tests/test_users.py
+from app.models.user import User
+
+
+def test_create_and_lookup(user):
+    assert user.id is not None
+    assert User.get_by_id(user.id).username == 'alice'
+    assert User.get_by_username('alice').id == user.id
+    assert User.get_by_username('bob') is None
+
+
+def test_usernames_are_unique(user):
+    assert User.create('alice', 'another password') is None
+
+
+def test_verify_password(user):
+    assert user.verify_password('correct horse')
+    assert not user.verify_password('wrong')
+
+
+def test_outdated_hash_is_upgraded_on_login(make_app):
+    app = make_app(PASSWORD_HASH_METHOD='pbkdf2:sha256:1000')
+    with app.app_context():
+        user = User.create('carol', 'secret')
+    upgraded = make_app(PASSWORD_HASH_METHOD='pbkdf2:sha256:2000')
+    with upgraded.app_context():
+        user = User.get_by_id(user.id)
+        assert user.verify_password('secret')
+        assert User.get_by_id(user.id).password_hash.startswith('pbkdf2:sha256:2000$')
@@ -0,0 +1,113 @@
+# tests/test_ws.py
+"""ChatConnection (app/routes/ws_routes.py) over an in-memory socket, with a stub generation."""
+import json
+import queue
+import threading
+from concurrent.futures import Future
+
+import pytest
+from flask_jwt_extended import create_access_token, create_refresh_token
+
+from app.models.conversation import Conversation
+from app.routes.ws_routes import ChatConnection
+from app.services import chat_service
+from app.services.stream_broker import get_stream_broker
+from app.services.title_service import _store_title
+
+
+class FakeSocket:
+    def __init__(self):
+        self.incoming = queue.Queue()
+        self.sent = queue.Queue()
+
+    def receive(self, timeout=None):
+        try:
+            return self.incoming.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def send(self, message):
+        self.sent.put(json.loads(message))
+
+    def expect(self, kind, timeout=5):
+        """Next message of type `kind` (earlier messages of other types are skipped)."""
+        while True:
+            message = self.sent.get(timeout=timeout)
+            if message['type'] == kind:
+                return message
+
+
+@pytest.fixture
+def socket(app):
+    ws = FakeSocket()
+    connection = ChatConnection(ws, app)
+
+    def serve():
+        with app.app_context():
+            connection.serve()
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    yield ws
+    connection.closed = True
+    ws.incoming.put(json.dumps({'type': 'ping'}))
+    thread.join(timeout=5)
+
+
+def send(ws, **message):
+    ws.incoming.put(json.dumps(message))
+
+
+def stub_start_stream(app_instance, user_id, conversation_id, content, model, render_markdown=False,
+                      started_at=None, parent_id=None):
+    """Publishes a two-chunk reply, like the real generation does."""
+    broker = get_stream_broker(app_instance)
+    generation_id = broker.register(user_id, conversation_id)
+    publisher, future = broker.publisher(generation_id), Future()
+
+    def generate():
+        for chunk in ('Hello', ' there'):
+            publisher.put(f"data: {json.dumps({'chunk': chunk})}\n\n")
+        publisher.put(None)
+        future.set_result(None)
+
+    threading.Thread(target=generate, daemon=True).start()
+    return generation_id, future
+
+
+def test_rejects_invalid_and_refresh_tokens(app, user, socket):
+    send(socket, type='send', ref=0, conversation_id=1, content='hi')
+    assert socket.expect('error')['code'] == 'unauthenticated'
+    send(socket, type='auth', ref='bad', token='not-a-jwt')
+    assert socket.expect('error') == {'type': 'error', 'ref': 'bad', 'code': 'unauthenticated',
+                                      'error': 'Invalid or expired token'}
+    send(socket, type='auth', ref='refresh', token=create_refresh_token(identity=str(user.id)))
+    assert socket.expect('error')['ref'] == 'refresh'
+    send(socket, type='auth', ref='access', token=create_access_token(identity=str(user.id)))
+    assert socket.expect('ready') == {'type': 'ready', 'ref': 'access', 'user_id': user.id}
+
+
+def test_send_streams_the_reply_then_done_and_title(app, user, socket, monkeypatch):
+    monkeypatch.setattr(chat_service, 'start_stream', stub_start_stream)
+    conversation = Conversation.create(user.id)
+    send(socket, type='auth', token=create_access_token(identity=str(user.id)))
+    socket.expect('ready')
+
+    send(socket, type='send', ref=7, conversation_id=conversation.id)  # No content
+    assert socket.expect('error')['code'] == 'bad_request'
+    send(socket, type='send', ref=8, content='hi')  # No conversation
+    assert socket.expect('error') == {'type': 'error', 'ref': 8, 'code': 'bad_request',
+                                      'error': "Missing field 'conversation_id'"}
+
+    send(socket, type='send', ref=1, conversation_id=conversation.id, content='hi')
+    started = socket.expect('started')
+    assert started['ref'] == 1 and started['conversation_id'] == conversation.id
+    chunks = [socket.expect('event')['data']['chunk'] for _ in range(2)]
+    assert chunks == ['Hello', ' there']
+    done = socket.expect('done')
+    assert done['generation_id'] == started['generation_id']
+    assert done['usage']['day'] == {'used': 0, 'quota': None, 'remaining': None}  # Sent without quotas too
+
+    # The detached title task stores the title once the reply is done
+    assert _store_title(app, conversation.id, 'Greetings')
+    assert socket.expect('title') == {'type': 'title', 'conversation_id': conversation.id, 'title': 'Greetings'}